@@ -10,20 +10,34 @@ NAS上の sensor_data 共有フォルダを読み書きし、以下の3つの処
                 前日サマリのSlack投稿
   weekly-report 週1回: 全デバイスのスモールマルチプルグラフを生成してSlack投稿
   status        手動実行用: 各デバイスの最終受信時刻・件数を表示（Slack設定不要）
+  report        手動実行用: 任意の期間・デバイスのスモールマルチプルグラフを作る（Slack設定不要）
+  simulate      手動実行用: 候補の設定ファイルで、過去のデータに対するアラートがどう変わるかを試算（Slack設定不要）
+  coverage      手動実行用: 各デバイスの期間内の受信率と、データの欠けた時間帯を表示（Slack設定不要）
+  migrate       手動実行用: 旧形式（テキスト時刻の readings テーブル）のDBを新形式に変換
+                （旧形式のDBは ingest などが開いたときにも自動で移行される。前もって済ませたいときに使う）
+  serve         常駐用: 上の3つのタイマーの代わりに1つのプロセスで動き続ける
+                （incoming/ を監視して届いたチャンクを数秒で取り込み、日次・週次も決まった時刻に実行）
 
 使い方:
     python3 collector.py ingest        --base-dir /mnt/sensor_data
     python3 collector.py daily         --base-dir /mnt/sensor_data
     python3 collector.py weekly-report --base-dir /mnt/sensor_data
     python3 collector.py status        --base-dir /mnt/sensor_data
+    python3 collector.py report        --base-dir /mnt/sensor_data --from 2026-07-01 --to 2026-07-31 --devices room246
+    python3 collector.py simulate      --base-dir /mnt/sensor_data --config candidate.yaml --from 2025-10-01
+    python3 collector.py coverage      --base-dir /mnt/sensor_data --from 2025-01-01 --devices room246
+    python3 collector.py migrate       --base-dir /mnt/sensor_data
+    python3 collector.py serve         --base-dir /mnt/sensor_data
     # --no-slack を付けるとSlackに送らずログ出力のみ（動作確認用）
+    # daily に --full-rebuild を付けると全期間の日次集計を計算し直す（集計の修復用）
 
 Slack設定は環境変数で渡す:
     SLACK_TOKEN        Bot User OAuth Token（xoxb- で始まる）
     SLACK_CHANNEL_ID   通知チャンネルのID（例: C0XXXXXXX）
+    SLACK_API_URL      （任意）Slack APIのURL。slack_standin.py の代役で送信を試すときだけ指定する
 
 NAS上のフォルダ構成（--base-dir 以下）:
-    incoming/<デバイス名>/   各Piから届いたCSVチャンク（取り込み後に削除）
+    incoming/<デバイス名>/   各Piから届いたCSVチャンク（.csv または gzip圧縮の .csv.gz。取り込み後に削除）
     db/sensor_data.sqlite3   全デバイス共通のデータベース
     config/thresholds.yaml   デバイスごとの許容範囲・アラート設定
     reports/weekly/          週次レポート画像のアーカイブ（月別）
@@ -31,13 +45,29 @@ NAS上のフォルダ構成（--base-dir 以下）:
 """
 
 import argparse
+import calendar
+import collections
+import concurrent.futures
+import contextlib
 import csv
+import ctypes
+import ctypes.util
 import datetime
+import functools
 import glob
+import gzip
+import itertools
 import logging
+import math
 import os
+import re
+import select
+import signal
 import sqlite3
+import struct
 import sys
+import threading
+import time
 import traceback
 
 # =============================================================================
@@ -45,23 +75,102 @@ import traceback
 # =============================================================================
 
 DB_RELATIVE_PATH = os.path.join('db', 'sensor_data.sqlite3')
+
+# DBの形式の版（PRAGMA user_version）。2 = samples（整数時刻・WITHOUT ROWID）の形式
+SCHEMA_VERSION = 2
+EPOCH = datetime.datetime(1970, 1, 1)
+MIGRATE_BATCH_ROWS = 20000          # migrate で1トランザクションに移す行数
+MIGRATE_LOCK_SUFFIX = '.migrate.lock'  # 移行中にDBの隣に置くロックファイル（DBのファイル名＋これ）
+INGEST_TRANSACTION_ROWS = 100000    # ingest で1トランザクションにまとめる行数の目安（超えたらコミットして区切る）
+DEFAULT_INGEST_WORKERS = 4          # ingest でチャンクファイルを並行して読むスレッド数（--ingest-workers）
+INGEST_READ_AHEAD_PER_WORKER = 4    # 読み込みスレッド1本あたり、書き込みを待たずに先読みしておくファイル数
+
+# レポートの期間がこの日数を超えたら、samples ではなく時間別集計（hourly_rollup）から描く（--rollup-after-days）
+DEFAULT_ROLLUP_AFTER_DAYS = 7
+# 時間別集計から描く場合、1デバイスあたりの点数がおおよそこれ以下になるよう数時間ごとにまとめる
+# （1年ぶんでも週次レポートの生データ（10分間隔で約1000点）と同じくらいの量になる）
+ROLLUP_MAX_POINTS = 1000
+
+# グラフの1パネル（1デバイスの温度または湿度）の横幅の目安（ピクセル）。report はこの幅に収まる点数まで間引く
+# （figsize の幅12インチ × dpi 110 を2列で分けた幅から、余白を除いたもの）
+GRAPH_PANEL_PIXELS = 600
+
+# Slack送信キュー（outbox）
+SLACK_TIMEOUT_SEC = 30              # Slack APIの1回の呼び出しの時間切れ
+OUTBOX_RETRY_BASE_SEC = 15          # 送信に失敗したときの再送までの待ち時間（失敗のたびに倍）
+OUTBOX_RETRY_MAX_SEC = 1800         # 再送までの待ち時間の上限
+OUTBOX_MERGE_MAX_CHARS = 3500       # アラートをまとめて1通にするときの文字数の上限
+OUTBOX_SEND_INTERVAL_SEC = 1.0      # 続けて送るときの間隔（Slackの投稿は1チャンネル毎秒1件程度まで）
+OUTBOX_DELIVERY_BUDGET_SEC = 120    # ingest / daily / weekly-report の最後に送信に使う時間の上限
+OUTBOX_IDLE_CHECK_SEC = 60          # serve の送信スレッドが、知らせが無くても outbox を見直す間隔
+# 送り直しても成功しない Slack API のエラー（これ以外は時間をおいて送り直す）
+SLACK_PERMANENT_ERRORS = {'msg_too_long', 'no_text', 'invalid_blocks', 'file_uploads_disabled'}
+
+# simulate（設定の試算）
+SIMULATE_WARMUP_HOURS = 24          # 期間の手前も読んで、期間の始まりのクールダウンの状態を作る
+SIMULATE_MAX_LISTED_ALERTS = 20     # デバイスごとに時刻を並べて表示するアラートの上限
+
+# coverage（受信率）
+COVERAGE_DEFAULT_DAYS = 30          # --from を省略したときに遡る日数
+COVERAGE_MAX_LISTED_GAPS = 20       # デバイスごとに時刻を並べて表示する欠けの上限
+
+# serve（常駐モード）
+DEFAULT_SERVE_POLL_SEC = 10         # incoming/ を定期的に確認する間隔（SMBでは inotify が届かないため）
+SERVE_SETTLE_SEC = 3                # チャンクのサイズ・更新時刻がこの秒数変わらなければ届き終わったとみなす
+SERVE_ALERT_CHECK_SEC = 60          # 欠測アラートを判定する間隔
+SERVE_SNAPSHOT_INTERVAL_SEC = 600   # --local-db のとき、NASへスナップショットを書き出す最短間隔
+SERVE_ERROR_RETRY_SEC = 60          # 処理に失敗したとき、やり直すまでの待ち時間
+SERVE_OUTBOX_BUDGET_SEC = 5         # NAS上のDBで serve がSlack送信を始めてよい時間（超えたら取り込みに戻る）
+DEFAULT_DAILY_AT = '03:30'          # 日次レポートの時刻（collector-daily.timer と同じ）
+DEFAULT_WEEKLY_AT = 'Mon 08:00'     # 週次レポートの曜日・時刻（collector-weekly.timer と同じ）
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+# グラフ用に読む時系列の列（fetch_all_series が返す NumPy 構造化配列の型）
+SERIES_FIELDS = [
+    ('device_key', 'i8'), ('ts', 'i8'), ('temperature', 'f8'), ('humidity', 'f8'),
+    ('temp_min', 'f8'), ('temp_max', 'f8'), ('humid_min', 'f8'), ('humid_max', 'f8'),
+]
+
+# CSVの時刻 'YYYY-MM-DD HH:MM:SS'。取り込みでは1行ごとに使うので、コンパイル済みの正規表現で検査する
+TIMESTAMP_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}) (\d{2}):(\d{2}):(\d{2})$')
 CONFIG_RELATIVE_PATH = os.path.join('config', 'thresholds.yaml')
 LOG_RELATIVE_PATH = os.path.join('logs', 'collector.log')
 
+# センサーPiの測定間隔（クライアントの CHECK_INTERVAL_SEC と同じ値）
+READING_INTERVAL_MINUTES = 10
+
 # 範囲逸脱判定で、測定間隔がこれより空いたペアは「2連続」とみなさない
 # （Pi再起動・欠測をまたぐと、離れた2点をたまたま拾って誤報する恐れがあるため）
 MAX_PAIR_GAP_MINUTES = 30
 
-# 範囲逸脱アラートは最新データがこの時間より古い場合は判定しない
-# （ingestは10分ごとに走るため、同じ古いペアを繰り返し判定するのを防ぐ）
+# 間引きモードで「最新の値が保たれている」とみなす範囲逸脱の判定は、最新データがこの時間
+# （＋ハートビート1回ぶん）より古くなったらやめる（止まったデバイスの古い値で判定し続けないため）
 ALERT_FRESHNESS_MINUTES = 30
 
+# 同じ判定で同じ種類のアラートがこの台数以上に出たら、デバイスごとに送らず1通の「障害」通知にまとめる
+# （NASのマウント切れ・建物のネットワーク障害で全台が一度に欠測したときに、台数ぶん連投しないため）
+ALERT_STORM_MIN_DEVICES = 3
+ALERT_INCIDENT_REMINDER_HOURS = 24  # 障害が続いている間、この間隔で「続いています」と知らせる
+ALERT_GROUP_LIST_MAX = 30           # 障害通知に並べるデバイスの上限（超えた分は台数だけ）
+# アラートの種類ごとの名前と、障害（多数のデバイスで同時に起きたとき）に確認してほしいこと
+ALERT_LABELS = {'missing': '欠測', 'temp_range': '温度の範囲逸脱', 'humid_range': '湿度の範囲逸脱'}
+ALERT_HINTS = {
+    'missing': 'NASのマウント・建物のネットワーク・停電など共通の原因を確認してください',
+    'temp_range': '空調の停止など部屋に共通の原因を確認してください',
+    'humid_range': '空調・加湿器の停止など部屋に共通の原因を確認してください',
+}
+
+# センサーPiの高頻度サンプリング（--sample-interval）で送られる集計行の追加列
+AGGREGATE_COLUMNS = ['temp_min', 'temp_max', 'humid_min', 'humid_max', 'sample_count']
+
 # thresholds.yaml に設定が無いときに使うデフォルト値
 DEFAULT_SETTINGS = {
     'temp_range': None,          # 温度の許容範囲 [下限, 上限]（°C）。None なら温度は判定しない
     'humid_range': None,         # 湿度の許容範囲 [下限, 上限]（%）。None なら湿度は判定しない
     'alert_cooldown_hours': 6,   # 同じデバイス・同じ項目のアラートの再送抑制時間
     'missing_data_hours': 2,     # データがこの時間止まったら欠測アラート
+    'heartbeat_minutes': None,   # センサーPiを間引きモード（--deadband-*）で動かす場合に、
+                                 # その --heartbeat-minutes と同じ値を書く。None なら間引きなし
 }
 
 logger = logging.getLogger('collector')
@@ -85,29 +194,231 @@ def setup_logging(base_dir: str, debug: bool) -> None:
     )
 
 
-def open_database(base_dir: str) -> sqlite3.Connection:
+def open_database(base_dir: str, allow_old_layout: bool = False,
+                  local_db: str = None, migrate_old_layout: bool = True) -> sqlite3.Connection:
     """
     SQLiteデータベースを開く（無ければテーブルごと作成する）。
 
     このDBに書き込むのはコレクターの単一プロセスだけにすること。
     ネットワーク共有上のSQLiteは複数プロセスからの同時書き込みで壊れることがある。
+
+    local_db を指定すると、NAS上の db/sensor_data.sqlite3 ではなくコレクターPiのローカルディスクの
+    DBを WAL モードで開く（NAS上のファイルは publish_snapshot で書き出すスナップショットになる）。
+    ローカルのDBがまだ無ければ、NAS上のDBを複製して始める。
+
+    旧形式（readings がテキストの時刻を持つテーブル）のDBは、開いたときにその場で新形式に移行してから
+    使う（migrate_database。中断しても次に開いたときに続きから再開する）。プログラムを更新した後、
+    誰かが migrate を手で実行するまで取り込み・アラートが止まる、ということが無いようにするため。
+    自動で移行するのは ingest と serve だけで、それ以外（daily・weekly-report・status・report など）は
+    migrate_old_layout=False で開き、移行が終わるまで何もせずに終わる。大きなDBの移行はタイマーの
+    間隔より長くかかるので、daily などが移行中のDBに書き込まないようにするため。
+    移行の間は migration_lock でロックファイルを作り、別のプロセスが同時に移行を始めないようにする
+    （ロックの効かないNAS上のDBに2つのプロセスが書くと壊れる）。
+    allow_old_layout は migrate サブコマンド用で、旧形式のまま返す。
+    """
+    nas_db_path = os.path.join(base_dir, DB_RELATIVE_PATH)
+    os.makedirs(os.path.dirname(nas_db_path), exist_ok=True)
+    if local_db:
+        if os.path.dirname(local_db):
+            os.makedirs(os.path.dirname(local_db), exist_ok=True)
+        if not os.path.exists(local_db) and os.path.exists(nas_db_path):
+            _copy_database(nas_db_path, local_db)
+            logger.info(f"NAS上のDBをローカルに複製しました: {nas_db_path} → {local_db}")
+        conn = sqlite3.connect(local_db)
+        # WAL は読み取りと書き込みが互いを待たない。ネットワーク共有では使えないが、ローカルなら安全に使える
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    else:
+        conn = sqlite3.connect(nas_db_path)
+    if _table_exists(conn, 'readings'):
+        if allow_old_layout:
+            return conn
+        if not migrate_old_layout:
+            conn.close()
+            logger.error(
+                "データベースは旧形式から新形式への移行中です。次の取り込み（collector-ingest）で"
+                "自動的に移行されます。\n"
+                "  進み具合は logs/collector.log の「移行中」の行で確認できます"
+            )
+            raise SystemExit(1)
+        try:
+            with migration_lock(conn):
+                # ロックを待つ間に別のプロセスが移行を終えていれば、そのまま使う
+                if _table_exists(conn, 'readings'):
+                    logger.info("データベースが旧形式のため、新形式に移行してから処理を続けます（最初の1回だけ）")
+                    migrate_database(conn)
+        except BaseException:
+            conn.close()
+            raise
+    _create_schema(conn)
+    return conn
+
+
+@contextlib.contextmanager
+def migration_lock(conn: sqlite3.Connection):
+    """
+    旧形式からの移行の間、DBの隣（NAS上のDBなら db/ の中）にロックファイルを作っておく。
+
+    NASの共有は nobrl でマウントしていてSQLiteのロックが効かないため、移行が長引いて次の ingest の
+    タイマーや手作業の migrate と重なると、2つのプロセスが同じDBに書き込んでしまう。
+    ロックファイルは O_CREAT | O_EXCL で作るので、作れたプロセスだけが移行する。作れなければ
+    ログに残して SystemExit(1) で終わる（DBには何も書かない。移行は先に始めたプロセスが続ける）。
+
+    停電などでロックファイルが残った場合、同じ機械のもう動いていないプロセスのものなら消して取り直す。
+    """
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    lock_path = db_path + MIGRATE_LOCK_SUFFIX
+    owner = f"{os.getpid()}@{os.uname().nodename}"
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            break
+        except FileExistsError:
+            try:
+                with open(lock_path) as f:
+                    locked_by = f.read().strip()
+            except OSError:
+                locked_by = ''
+            pid_text, _, host = locked_by.partition('@')
+            if host == os.uname().nodename and pid_text.isdigit() and not _process_exists(int(pid_text)):
+                logger.warning(f"終了したプロセスの移行ロックが残っていたため、取り直します: {lock_path}")
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(lock_path)
+                continue
+            logger.error(
+                f"別のプロセス（{locked_by or '不明'}）がデータベースを新形式に移行中のため、何もせずに終わります。\n"
+                f"  移行しているプロセスが無いのにこのメッセージが続く場合は {lock_path} を削除してください"
+            )
+            raise SystemExit(1)
+    else:
+        logger.error(f"移行ロックを取れませんでした: {lock_path}")
+        raise SystemExit(1)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(owner + '\n')
+        yield
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(lock_path)
+
+
+def _process_exists(pid: int) -> bool:
+    """同じ機械で pid のプロセスが動いているか"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _copy_database(source_path: str, destination_path: str) -> None:
+    """SQLiteのオンラインバックアップAPIで、書き込み中でも整合の取れた複製を作る"""
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    destination = sqlite3.connect(destination_path)
+    try:
+        source.backup(destination)
+    finally:
+        destination.close()
+        source.close()
+
+
+def publish_snapshot(conn: sqlite3.Connection, base_dir: str) -> bool:
+    """
+    ローカルのDB（--local-db）の内容を、NAS上の db/sensor_data.sqlite3 に書き出す。
+
+    バックアップAPIで同じフォルダの一時ファイルに複製してから os.replace で置き換えるので、
+    NAS上のDBを読む人（手作業の確認・他のツール）が書きかけのファイルを見ることはない。
+    複製に失敗した場合は一時ファイルを消して、前回のスナップショットをそのまま残す。
+    スナップショットは WAL をやめた通常のジャーナル形式にする（ネットワーク共有でWALは使えないため）。
+    """
+    nas_db_path = os.path.join(base_dir, DB_RELATIVE_PATH)
+    temp_path = f"{nas_db_path}.{os.getpid()}.tmp"
+    started = time.monotonic()
+    try:
+        destination = sqlite3.connect(temp_path)
+        try:
+            conn.backup(destination)
+            destination.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            destination.close()
+        os.replace(temp_path, nas_db_path)
+    except Exception as e:
+        logger.error(f"NASへのDBスナップショットの書き出しに失敗しました（前回のものを残します）: {e}")
+        try:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+    logger.info(f"NASへDBスナップショットを書き出しました ({time.monotonic() - started:.1f}秒)")
+    return True
+
+
+@contextlib.contextmanager
+def database_session(base_dir: str, local_db: str = None, allow_old_layout: bool = False,
+                     publish: bool = True, migrate_old_layout: bool = True):
+    """
+    サブコマンド1回ぶんのDB接続。正常に終わったら（--local-db のときは）NASへスナップショットを書き出す。
+
+    途中で例外になった場合は書き出さない（前回のスナップショットが残る）。
+    DBに書き込まない手動確認用のコマンドは migrate_old_layout=False で開く（open_database 参照）。
+    """
+    conn = open_database(base_dir, allow_old_layout, local_db, migrate_old_layout)
+    try:
+        yield conn
+        if local_db and publish:
+            publish_snapshot(conn, base_dir)
+    finally:
+        conn.close()
+
+
+def _create_schema(conn: sqlite3.Connection, with_readings_view: bool = True) -> None:
+    """
+    新形式（SCHEMA_VERSION）のテーブルを作る（既にあれば何もしない）。
+
+    測定値は samples に持つ。時刻はローカル時刻をそのままUTCとみなしたエポック秒の整数
+    （to_epoch 参照）で、主キー (device_key, ts) の WITHOUT ROWID テーブルなので、
+    デバイスごとに時刻順で詰めて格納される。デバイスIDの文字列は device_keys で小さな整数に置き換える。
+    以前の readings（テキストの時刻）と同じ列が見えるビューも作り、手作業の確認用クエリなどはそのまま使える。
+
+    hourly_rollup は samples の1時間ごとの集計で、長い期間のレポートはこちらを読む。
+    hourly_rollup が無かった頃のDBでは、ここで一度だけ samples 全体から作る。
     """
-    db_path = os.path.join(base_dir, DB_RELATIVE_PATH)
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    rollup_existed = _table_exists(conn, 'hourly_rollup')
     conn.executescript("""
-        CREATE TABLE IF NOT EXISTS readings (
-            device_id   TEXT NOT NULL,
-            timestamp   TEXT NOT NULL,   -- 'YYYY-MM-DD HH:MM:SS'（文字列比較で時系列順になる）
-            temperature REAL,
-            humidity    REAL,
-            PRIMARY KEY (device_id, timestamp)
+        CREATE TABLE IF NOT EXISTS device_keys (
+            device_key INTEGER PRIMARY KEY,
+            device_id  TEXT NOT NULL UNIQUE
         );
+        CREATE TABLE IF NOT EXISTS samples (
+            device_key  INTEGER NOT NULL,
+            ts          INTEGER NOT NULL, -- ローカル時刻をUTCとみなしたエポック秒（datetime(ts, 'unixepoch') で元の文字列）
+            temperature REAL,             -- 集計行（センサーPiの --sample-interval）では間隔内の平均
+            humidity    REAL,
+            temp_min    REAL,             -- 以下は集計行のみ。1点ずつの測定行では NULL
+            temp_max    REAL,
+            humid_min   REAL,
+            humid_max   REAL,
+            sample_count INTEGER,
+            PRIMARY KEY (device_key, ts)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS hourly_rollup (
+            device_key INTEGER NOT NULL,
+            hour_ts    INTEGER NOT NULL,  -- その1時間の始まりの samples.ts
+            temp_min  REAL, temp_max  REAL, temp_avg  REAL,
+            humid_min REAL, humid_max REAL, humid_avg REAL,
+            row_count    INTEGER NOT NULL, -- その1時間の samples の行数（数時間ごとにまとめ直すときの平均の重み）
+            sample_count INTEGER NOT NULL, -- その1時間の測定回数（集計行は中のサンプル数で数える）
+            PRIMARY KEY (device_key, hour_ts)
+        ) WITHOUT ROWID;
         CREATE TABLE IF NOT EXISTS daily_summary (
             device_id TEXT NOT NULL,
             date      TEXT NOT NULL,     -- 'YYYY-MM-DD'
             temp_min  REAL, temp_max  REAL, temp_avg  REAL,
             humid_min REAL, humid_max REAL, humid_avg REAL,
+            sample_count INTEGER,        -- その日の測定回数（集計行は中のサンプル数で数える）
             PRIMARY KEY (device_id, date)
         );
         CREATE TABLE IF NOT EXISTS alert_state (
@@ -116,14 +427,185 @@ def open_database(base_dir: str) -> sqlite3.Connection:
             last_sent TEXT NOT NULL,
             PRIMARY KEY (device_id, alert_key)
         );
+        CREATE TABLE IF NOT EXISTS alert_watermarks (
+            device_key INTEGER PRIMARY KEY,
+            ts         INTEGER NOT NULL  -- 範囲逸脱の判定が済んだ最後の samples.ts（これより後の行が次の判定の対象）
+        );
+        CREATE TABLE IF NOT EXISTS incidents (
+            id            INTEGER PRIMARY KEY,
+            alert_key     TEXT NOT NULL,  -- 'missing' / 'temp_range' / 'humid_range'
+            started_at    TEXT NOT NULL,
+            last_notified TEXT NOT NULL,
+            resolved_at   TEXT            -- NULL なら障害が続いている
+        );
+        CREATE TABLE IF NOT EXISTS incident_devices (
+            incident_id INTEGER NOT NULL,
+            device_id   TEXT NOT NULL,
+            detail      TEXT,             -- 障害通知に載せた内容
+            recovered_at TEXT,            -- NULL なら未復旧
+            PRIMARY KEY (incident_id, device_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS outbox (
+            id         INTEGER PRIMARY KEY,
+            kind       TEXT NOT NULL,    -- 'alert'（まとめて送ってよい）/ 'message' / 'file'
+            text       TEXT NOT NULL,    -- 本文（file ではコメント）
+            file_path  TEXT,             -- file の画像
+            title      TEXT,
+            created_at TEXT NOT NULL,
+            attempts   INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL, -- 次に送ってよい時刻（time.time()）
+            last_error TEXT
+        );
+        CREATE TABLE IF NOT EXISTS dirty_dates (
+            device_id TEXT NOT NULL,
+            date      TEXT NOT NULL,     -- 'YYYY-MM-DD'。日次集計の再計算が必要な日
+            PRIMARY KEY (device_id, date)
+        );
+        CREATE TABLE IF NOT EXISTS devices (
+            device_id        TEXT PRIMARY KEY,
+            first_seen       TEXT NOT NULL,  -- 最初のデータの時刻
+            row_count        INTEGER NOT NULL,
+            last_timestamp   TEXT,           -- 最新のデータ
+            last_temperature REAL,
+            last_humidity    REAL,
+            prev_timestamp   TEXT,           -- 最新の1つ前のデータ
+            prev_temperature REAL,
+            prev_humidity    REAL
+        );
     """)
-    return conn
+    if not with_readings_view:
+        return  # migrate の途中（旧 readings テーブルがまだある）。ビューと版・時間別集計は移行の最後に行う
+    if not rollup_existed:
+        started = time.monotonic()
+        rebuild_hourly_rollup(conn)
+        conn.commit()
+        logger.info(f"時間別集計（hourly_rollup）を作成しました ({time.monotonic() - started:.1f}秒)")
+    conn.executescript(READINGS_VIEW_SQL)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+
+
+# 旧形式の readings と同じ列を見せるビュー（読み取り専用）
+READINGS_VIEW_SQL = """
+    CREATE VIEW IF NOT EXISTS readings AS
+    SELECT k.device_id, datetime(s.ts, 'unixepoch') AS timestamp,
+           s.temperature, s.humidity, s.temp_min, s.temp_max, s.humid_min, s.humid_max,
+           s.sample_count
+    FROM samples s JOIN device_keys k ON k.device_key = s.device_key;
+"""
+
+
+# 時間別集計の列。日次集計（DAILY_SUMMARY_SELECT）と同じく、集計行は間隔内の最小・最大を使う
+HOURLY_ROLLUP_SELECT = """
+    SELECT device_key, ts / 3600 * 3600,
+           MIN(COALESCE(temp_min, temperature)), MAX(COALESCE(temp_max, temperature)),
+           AVG(temperature),
+           MIN(COALESCE(humid_min, humidity)), MAX(COALESCE(humid_max, humidity)),
+           AVG(humidity),
+           COUNT(*), SUM(COALESCE(sample_count, 1))
+    FROM samples
+"""
+
+
+def rebuild_hourly_rollup(conn: sqlite3.Connection) -> None:
+    """hourly_rollup を samples 全体から作り直す（コミットは呼び出し側で行う）"""
+    conn.execute("DELETE FROM hourly_rollup")
+    conn.execute(f"""
+        INSERT INTO hourly_rollup
+            (device_key, hour_ts, temp_min, temp_max, temp_avg, humid_min, humid_max, humid_avg,
+             row_count, sample_count)
+        {HOURLY_ROLLUP_SELECT}
+        GROUP BY device_key, ts / 3600
+    """)
+
+
+def update_hourly_rollup(conn: sqlite3.Connection, dirty_hours) -> None:
+    """
+    行を入れた (device_key, ts // 3600) の時間だけ hourly_rollup を計算し直す（コミットは呼び出し側）。
+
+    重複して届いた行は INSERT OR IGNORE で捨てられるため、足し込みではなく
+    その1時間の samples から集計し直す（主キーの範囲検索なので数行〜数百行しか読まない）。
+    """
+    conn.executemany(f"""
+        INSERT OR REPLACE INTO hourly_rollup
+            (device_key, hour_ts, temp_min, temp_max, temp_avg, humid_min, humid_max, humid_avg,
+             row_count, sample_count)
+        {HOURLY_ROLLUP_SELECT}
+        WHERE device_key = ? AND ts >= ? AND ts < ?
+        GROUP BY device_key
+    """, [(device_key, hour * 3600, hour * 3600 + 3600) for device_key, hour in sorted(dirty_hours)])
+
+
+def to_epoch(timestamp_text: str) -> int:
+    """
+    'YYYY-MM-DD HH:MM:SS'（センサーPiのローカル時刻）を samples.ts の整数に変換する。
+
+    タイムゾーン変換はせず、ローカル時刻をそのままUTCとみなして数える。
+    こうすると SQL の date(ts, 'unixepoch') がそのままローカルの日付になり、
+    ts // 86400 が日ごとの区切りになる（夏時間の切り替えで時刻が重複・欠落することもない）。
+    """
+    return calendar.timegm(parse_timestamp(timestamp_text).timetuple())
+
+
+def from_epoch(ts: int) -> str:
+    """samples.ts を 'YYYY-MM-DD HH:MM:SS' に戻す（to_epoch の逆）"""
+    return (EPOCH + datetime.timedelta(seconds=ts)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def intern_device(conn: sqlite3.Connection, device_id: str) -> int:
+    """デバイスIDに対応する device_key を返す（初めてのデバイスなら採番する）"""
+    conn.execute("INSERT OR IGNORE INTO device_keys (device_id) VALUES (?)", (device_id,))
+    return get_device_key(conn, device_id)
+
+
+def get_device_key(conn: sqlite3.Connection, device_id: str):
+    """デバイスIDに対応する device_key を返す（未登録なら None）"""
+    row = conn.execute(
+        "SELECT device_key FROM device_keys WHERE device_id = ?", (device_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _refresh_latest_readings(conn: sqlite3.Connection, device_id: str) -> None:
+    """devices の最新2点を samples から取り直す（主キーの末尾を2行読むだけ）"""
+    rows = conn.execute(
+        "SELECT datetime(ts, 'unixepoch'), temperature, humidity FROM samples "
+        "WHERE device_key = ? ORDER BY ts DESC LIMIT 2",
+        (get_device_key(conn, device_id),),
+    ).fetchall()
+    latest = rows[0] if rows else (None, None, None)
+    previous = rows[1] if len(rows) > 1 else (None, None, None)
+    conn.execute(
+        "UPDATE devices SET last_timestamp = ?, last_temperature = ?, last_humidity = ?, "
+        "prev_timestamp = ?, prev_temperature = ?, prev_humidity = ? WHERE device_id = ?",
+        (*latest, *previous, device_id),
+    )
+
+
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: list) -> None:
+    """テーブルに無い列を ALTER TABLE で追加する（古いDBを新しい列構成に合わせるため）"""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+            logger.info(f"{table} テーブルに列 {name} を追加しました")
+    conn.commit()
 
 
 def load_config(base_dir: str) -> dict:
     """thresholds.yaml を読み込む。無ければデフォルト構成を返す"""
+    return load_config_file(os.path.join(base_dir, CONFIG_RELATIVE_PATH))
+
+
+def load_config_file(config_path: str) -> dict:
+    """thresholds.yaml と同じ形式の設定ファイルを読み込む（simulate の候補の設定にも使う）"""
     import yaml  # PyYAMLが未インストールでも --help 等が動くよう、ここでimportする
-    config_path = os.path.join(base_dir, CONFIG_RELATIVE_PATH)
     if os.path.exists(config_path):
         with open(config_path, encoding='utf-8') as f:
             config = yaml.safe_load(f) or {}
@@ -153,12 +635,28 @@ def parse_timestamp(text: str) -> datetime.datetime:
 # Slack送信
 # =============================================================================
 
+class SlackDeliveryError(Exception):
+    """
+    Slackへの送信の失敗。
+
+    retry_after: レート制限（HTTP 429）で、Slackから指定された待ち時間（秒）
+    permanent: 送り直しても成功しない失敗（送る画像が無い・本文が長すぎる等）
+    """
+
+    def __init__(self, message: str, retry_after: float = None, permanent: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+
 class SlackSender:
     """
-    Slack送信をまとめたクラス。
+    Slack送信をまとめたクラス。アラート・レポートは outbox に入れ、送信は deliver_outbox がこれを使って行う。
 
     --no-slack のときは実際には送らず、送るはずだった内容をログに出す
     （Slack未設定の環境やテストでの動作確認用）。
+    環境変数 SLACK_API_URL を指定すると、そのURLをSlack APIとして使う
+    （slack_standin.py で立てた手元の代役に送って、送信の動きを試すため。例: http://127.0.0.1:8099/api/）。
     """
 
     def __init__(self, no_slack: bool):
@@ -179,36 +677,43 @@ class SlackSender:
             raise SystemExit(1)
 
         from slack_sdk import WebClient
-        self.client = WebClient(token=token)
+        client_options = {}
+        if os.environ.get('SLACK_API_URL'):
+            client_options['base_url'] = os.environ['SLACK_API_URL']
+        self.client = WebClient(token=token, timeout=SLACK_TIMEOUT_SEC, **client_options)
 
-    def post_message(self, text: str) -> bool:
-        """テキストメッセージを送信する"""
+    def post_message(self, text: str) -> None:
+        """テキストメッセージを送信する（失敗したら SlackDeliveryError）"""
         if self.no_slack:
             logger.info(f"[dry-run] Slackメッセージ: {text}")
-            return True
-        try:
-            self.client.chat_postMessage(channel=self.channel_id, text=text)
-            return True
-        except Exception as e:
-            logger.error(f"Slackメッセージ送信に失敗しました: {e}")
-            return False
+            return
+        self._call(self.client.chat_postMessage, channel=self.channel_id, text=text)
 
-    def upload_file(self, file_path: str, title: str, comment: str) -> bool:
-        """ファイル（グラフ画像）をコメント付きで送信する"""
+    def upload_file(self, file_path: str, title: str, comment: str) -> None:
+        """ファイル（グラフ画像）をコメント付きで送信する（失敗したら SlackDeliveryError）"""
         if self.no_slack:
             logger.info(f"[dry-run] Slackファイル送信: {file_path}\n{comment}")
-            return True
+            return
+        self._call(self.client.files_upload_v2, channels=[self.channel_id], file=file_path,
+                   title=title, initial_comment=comment)
+
+    @staticmethod
+    def _call(method, **kwargs) -> None:
+        """slack_sdk の呼び出しの失敗を SlackDeliveryError に直す"""
+        from slack_sdk.errors import SlackApiError
         try:
-            self.client.files_upload_v2(
-                channels=[self.channel_id],
-                file=file_path,
-                title=title,
-                initial_comment=comment,
-            )
-            return True
+            method(**kwargs)
+        except SlackApiError as e:
+            response = e.response
+            if response.status_code == 429:
+                raise SlackDeliveryError(
+                    "レート制限 (HTTP 429)", retry_after=float(response.headers.get('Retry-After', 30)))
+            error_code = response.get('error', '') if isinstance(response.data, dict) else ''
+            raise SlackDeliveryError(
+                f"Slack APIエラー: {error_code or response.status_code}",
+                permanent=error_code in SLACK_PERMANENT_ERRORS)
         except Exception as e:
-            logger.error(f"Slackファイル送信に失敗しました: {e}")
-            return False
+            raise SlackDeliveryError(f"{type(e).__name__}: {e}")
 
 
 def is_cooldown_passed(conn: sqlite3.Connection, device_id: str, alert_key: str,
@@ -223,254 +728,1005 @@ def is_cooldown_passed(conn: sqlite3.Connection, device_id: str, alert_key: str,
     return (now - parse_timestamp(row[0])).total_seconds() > cooldown_hours * 3600
 
 
-def record_alert_sent(conn: sqlite3.Connection, device_id: str, alert_key: str,
-                      now: datetime.datetime) -> None:
-    """アラート送信時刻を記録する（クールダウン管理用）"""
+# =============================================================================
+# Slack送信キュー（outbox）
+# =============================================================================
+
+def enqueue_slack(conn: sqlite3.Connection, kind: str, text: str,
+                  file_path: str = None, title: str = None) -> None:
+    """
+    Slackに送る内容を outbox に入れる（コミットは呼び出し側。アラートなら alert_state の更新と同じトランザクション）。
+
+    kind は 'alert'（まとめて1通にしてよいアラート）/ 'message'（レポートなど単独で送る文章）/
+    'file'（画像を text をコメントにして送る）。実際の送信は deliver_outbox が行う。
+    """
     conn.execute(
-        "INSERT OR REPLACE INTO alert_state (device_id, alert_key, last_sent) VALUES (?, ?, ?)",
-        (device_id, alert_key, now.strftime('%Y-%m-%d %H:%M:%S')),
+        "INSERT INTO outbox (kind, text, file_path, title, created_at, next_attempt_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (kind, text, file_path, title, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+         time.time()),
     )
-    conn.commit()
 
 
-# =============================================================================
-# ingest: 取り込みとアラート判定
-# =============================================================================
+def _take_delivery_batch(rows: list) -> list:
+    """
+    送信時刻の来た行（id順）から、次に1通で送る分を取り出す。
 
-def ingest_incoming_files(conn: sqlite3.Connection, base_dir: str) -> int:
+    先頭から続くアラートは OUTBOX_MERGE_MAX_CHARS 文字までまとめて1通にする
+    （NAS停止明けなどで一度に何件も出たときに、チャンネルを連投で埋めないため）。
     """
-    incoming/<デバイス名>/ に届いたCSVチャンクをDBに取り込む。
+    batch = [rows[0]]
+    if rows[0][1] != 'alert':
+        return batch
+    length = len(rows[0][2])
+    for row in rows[1:]:
+        if row[1] != 'alert' or length + len(row[2]) + 2 > OUTBOX_MERGE_MAX_CHARS:
+            break
+        batch.append(row)
+        length += len(row[2]) + 2
+    return batch
+
+
+def _send_batch(slack: SlackSender, batch: list) -> None:
+    """outbox の1通ぶんを送る（失敗したら SlackDeliveryError）"""
+    _, kind, text, file_path, title, _ = batch[0]
+    if kind == 'file':
+        if not os.path.exists(file_path):
+            raise SlackDeliveryError(f"送るファイルがありません: {file_path}", permanent=True)
+        slack.upload_file(file_path, title, text)
+    elif len(batch) == 1:
+        slack.post_message(text)
+    else:
+        slack.post_message(f"アラート{len(batch)}件をまとめて送信します\n\n"
+                           + "\n\n".join(row[2] for row in batch))
 
-    - 主キー (device_id, timestamp) への INSERT OR IGNORE により、
-      Piからの再送・重複データは自然に排除される
-    - 取り込みに成功したファイルは削除する（データはDBにあり、NASスナップショットが保険）
-    - 壊れたファイルは拡張子 .error を付けて残し、次回以降は処理しない
+
+def deliver_outbox(conn: sqlite3.Connection, slack: SlackSender, time_budget_sec: float = None,
+                   stop_event: threading.Event = None, wait_for_retry: bool = True):
+    """
+    送信時刻の来た outbox の項目を古い順に送る。送れたものは outbox から消す。
+
+    - 送信に失敗したら、その項目の attempts を増やし、OUTBOX_RETRY_BASE_SEC 秒から倍々に
+      （最大 OUTBOX_RETRY_MAX_SEC 秒）待ってから送り直す。Slack側の障害の可能性が高いので、
+      後ろの項目も同じだけ待たせる（障害中のSlackを連打せず、届く順番も入れ替わらない）
+    - レート制限（HTTP 429）なら Retry-After の秒数だけ全ての項目を待たせる
+    - 送り直しても意味の無い失敗（送る画像が消えた等）はログに残して捨てる
+    - 続けて送るときは OUTBOX_SEND_INTERVAL_SEC 秒あける（Slackの投稿は1チャンネル毎秒1件程度まで）
+
+    time_budget_sec を指定すると（ingest などの1回実行用）、その時間を過ぎたら次の項目を送り始めずに戻り、
+    その時間内なら再送までの待ちもここで待つ。
+    指定しなければ（serve の送信スレッド用）、送れる分を送ったら待たずに戻る。
+    wait_for_retry=False は（NAS上のDBの serve 用）、持ち時間で送るのを区切るが、再送までの待ちは待たずに戻る。
 
     Returns:
-        取り込んだ行数
+        次に送る項目までの秒数（outbox が空なら None）
     """
-    pattern = os.path.join(base_dir, 'incoming', '*', '*.csv')
-    total_inserted = 0
+    started = time.monotonic()
+    last_call = None
+    while not (stop_event is not None and stop_event.is_set()):
+        if time_budget_sec is not None and time.monotonic() - started >= time_budget_sec:
+            # Slackの応答が遅いと、送れる項目が続く限り戻らなくなるため
+            logger.info("Slack送信の持ち時間を使い切りました。残りは後で送ります")
+            break
+        rows = conn.execute(
+            "SELECT id, kind, text, file_path, title, attempts FROM outbox "
+            "WHERE next_attempt_at <= ? ORDER BY id LIMIT 100",
+            (time.time(),),
+        ).fetchall()
+        if not rows:
+            next_attempt_at = conn.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()[0]
+            if next_attempt_at is None or time_budget_sec is None or not wait_for_retry:
+                break
+            wait_sec = max(next_attempt_at - time.time(), 0)
+            if time.monotonic() + wait_sec - started > time_budget_sec:
+                logger.warning("Slack送信の持ち時間内に送り切れませんでした。残りは次回送ります")
+                break
+            time.sleep(wait_sec)
+            continue
+        if last_call is not None:
+            time.sleep(max(last_call + OUTBOX_SEND_INTERVAL_SEC - time.monotonic(), 0))
 
-    for file_path in sorted(glob.glob(pattern)):
-        # デバイス名は incoming/ 直下のフォルダ名から取る
-        device_id = os.path.basename(os.path.dirname(file_path))
+        batch = _take_delivery_batch(rows)
+        ids = [row[0] for row in batch]
+        id_placeholders = ', '.join('?' * len(ids))
+        last_call = time.monotonic()
         try:
-            with open(file_path, newline='') as f:
-                rows = list(csv.reader(f))
+            _send_batch(slack, batch)
+        except SlackDeliveryError as e:
+            if e.permanent:
+                conn.execute(f"DELETE FROM outbox WHERE id IN ({id_placeholders})", ids)
+                conn.commit()
+                logger.error(f"Slackに送れない項目を破棄しました: {e}\n{batch[0][2]}")
+                continue
+            attempts = max(row[5] for row in batch)
+            if e.retry_after is not None:
+                # レート制限は失敗の回数に数えない（待てば送れる）
+                delay = e.retry_after
+                logger.warning(f"Slackのレート制限のため{delay:g}秒待ってから送ります")
+            else:
+                attempts += 1
+                delay = min(OUTBOX_RETRY_BASE_SEC * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SEC)
+                logger.error(f"Slack送信に失敗しました（{attempts}回目。{delay}秒後に再送します）: {e}")
+            conn.execute(f"UPDATE outbox SET attempts = ?, last_error = ? WHERE id IN ({id_placeholders})",
+                         (attempts, str(e), *ids))
+            conn.execute("UPDATE outbox SET next_attempt_at = MAX(next_attempt_at, ?)",
+                         (time.time() + delay,))
+            conn.commit()
+            continue
 
-            valid_rows = []
-            for row in rows[1:]:  # 先頭はヘッダー行
-                if len(row) != 3:
-                    continue
-                timestamp_text, temperature_text, humidity_text = row
-                # 不正な行が1つでもあればファイルごと保留するのではなく、行単位でスキップする
-                # （Piの電源断でCSV末尾が中途半端に書かれた行などがここで弾かれる）
-                try:
-                    parse_timestamp(timestamp_text)
-                    valid_rows.append((device_id, timestamp_text,
-                                       float(temperature_text), float(humidity_text)))
-                except ValueError:
-                    logger.warning(
-                        f"不正な行をスキップしました ({os.path.basename(file_path)}): {row}"
-                    )
+        conn.execute(f"DELETE FROM outbox WHERE id IN ({id_placeholders})", ids)
+        conn.commit()
+        logger.info(f"Slackに送信しました（{batch[0][1]}, {len(batch)}件）")
 
-            conn.executemany(
-                "INSERT OR IGNORE INTO readings (device_id, timestamp, temperature, humidity) "
-                "VALUES (?, ?, ?, ?)",
-                valid_rows,
-            )
-            conn.commit()
-            total_inserted += len(valid_rows)
-            os.remove(file_path)
-            logger.info(f"取り込み完了: {os.path.basename(file_path)} ({len(valid_rows)}行)")
+    next_attempt_at = conn.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()[0]
+    return None if next_attempt_at is None else max(next_attempt_at - time.time(), 0)
 
-        except Exception as e:
-            logger.error(f"ファイルの取り込みに失敗しました: {file_path}: {e}")
-            try:
-                # 壊れたファイルを毎回処理し直さないよう .error を付けて退避する
-                os.replace(file_path, file_path + '.error')
-            except Exception as rename_error:
-                logger.error(f"エラーファイルの退避にも失敗しました: {rename_error}")
 
-    return total_inserted
+class OutboxWorker(threading.Thread):
+    """
+    outbox を送り続けるスレッド（serve 用）。
 
+    取り込み・アラート判定はキューに入れてコミットするだけで先に進み、Slackが遅い・落ちている間も止まらない。
+    DB接続はこのスレッド専用に開く（sqlite3 の接続はスレッドをまたいで使えないため）。
+    書き込む接続が2本になるので、--local-db（ローカルディスク・WAL）のときだけ使う。
+    NAS上のDB（nobrl でロックが効かない）に2本目の書き込み接続を開くと壊れるおそれがある。
+    """
 
-def get_all_device_ids(conn: sqlite3.Connection) -> list:
-    """DBに記録のある全デバイスIDを返す"""
-    return [row[0] for row in conn.execute(
-        "SELECT DISTINCT device_id FROM readings ORDER BY device_id")]
+    def __init__(self, db_path: str, slack: SlackSender):
+        super().__init__(name='slack-outbox', daemon=True)
+        self.db_path = db_path
+        self.slack = slack
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def notify(self) -> None:
+        """outbox に入れたことを知らせる（すぐ送りにかかる）"""
+        self._wakeup.set()
+
+    def stop(self, timeout: float) -> None:
+        """送信中の1通を終えたら止める（timeout 秒まで待つ。残りは outbox に残り次回送られる）"""
+        self._stopping.set()
+        self._wakeup.set()
+        self.join(timeout)
+
+    def run(self) -> None:
+        # メインスレッドの書き込みと重なったときは、ロックが外れるまで待つ
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            while not self._stopping.is_set():
+                self._wakeup.clear()
+                try:
+                    wait_sec = deliver_outbox(conn, self.slack, stop_event=self._stopping)
+                except Exception as e:
+                    logger.error(f"Slack送信キューの処理中にエラーが発生しました: {e}")
+                    traceback.print_exc()
+                    if conn.in_transaction:
+                        conn.rollback()
+                    wait_sec = OUTBOX_RETRY_BASE_SEC
+                self._wakeup.wait(OUTBOX_IDLE_CHECK_SEC if wait_sec is None
+                                  else min(wait_sec, OUTBOX_IDLE_CHECK_SEC))
+        finally:
+            conn.close()
 
 
-def check_range_alerts(conn: sqlite3.Connection, config: dict, slack: SlackSender,
-                       now: datetime.datetime) -> None:
-    """
-    範囲逸脱アラートの判定。
+# =============================================================================
+# ingest: 取り込みとアラート判定
+# =============================================================================
 
-    デバイスごとに直近2点を見て、温度・湿度が「許容範囲」の同じ側に2回連続で
-    逸脱していたらSlackに通知する。2連続を条件にすることで、DHT22の単発ノイズや
-    短時間のドア開閉では鳴らず、インキュベータの開けっ放しのような継続的な逸脱だけを捉える。
-    許容範囲（temp_range / humid_range）が未設定の項目は判定しない。
-    """
-    for device_id in get_all_device_ids(conn):
-        rows = conn.execute(
-            "SELECT timestamp, temperature, humidity FROM readings "
-            "WHERE device_id = ? ORDER BY timestamp DESC LIMIT 2",
-            (device_id,),
-        ).fetchall()
-        if len(rows) < 2:
-            continue
+def list_incoming_files(base_dir: str) -> list:
+    """incoming/<デバイス名>/ に届いている取り込み待ちのチャンク（.csv / .csv.gz）を返す"""
+    incoming_dir = os.path.join(base_dir, 'incoming')
+    return sorted(glob.glob(os.path.join(incoming_dir, '*', '*.csv'))
+                  + glob.glob(os.path.join(incoming_dir, '*', '*.csv.gz')))
 
-        newest_time = parse_timestamp(rows[0][0])
-        older_time = parse_timestamp(rows[1][0])
 
-        # 古いデータしか無い場合は判定しない（同じペアを繰り返し判定しないため）
-        if (now - newest_time).total_seconds() > ALERT_FRESHNESS_MINUTES * 60:
-            continue
+def _parse_optional_float(text: str):
+    """空欄なら None（DBでは NULL）、それ以外は数値として読む"""
+    return float(text) if text.strip() else None
 
-        # 測定間隔が空きすぎたペアは「2連続」とみなさない
-        # （欠測明けの1点目や、離れた2点をたまたま拾って誤報するのを防ぐ）
-        gap_minutes = (newest_time - older_time).total_seconds() / 60
-        if not (0 < gap_minutes <= MAX_PAIR_GAP_MINUTES):
-            continue
 
-        # 温度・湿度それぞれで、2連続の範囲逸脱を判定する
-        # rows[0] が最新、rows[1] が1つ前。列は (timestamp, temperature, humidity)
-        _check_one_range(conn, config, slack, now, device_id,
-                         setting_key='temp_range', label='温度', unit='°C',
-                         newest_value=rows[0][1], older_value=rows[1][1])
-        _check_one_range(conn, config, slack, now, device_id,
-                         setting_key='humid_range', label='湿度', unit='%',
-                         newest_value=rows[0][2], older_value=rows[1][2])
+@functools.lru_cache(maxsize=4096)
+def _day_start_epoch(date_text: str) -> int:
+    """'YYYY-MM-DD' の0時の samples.ts（存在しない日付なら ValueError）"""
+    return calendar.timegm(datetime.date.fromisoformat(date_text).timetuple())
 
 
-def _check_one_range(conn: sqlite3.Connection, config: dict, slack: SlackSender,
-                     now: datetime.datetime, device_id: str, setting_key: str,
-                     label: str, unit: str,
-                     newest_value: float, older_value: float) -> None:
+def parse_epoch_fast(timestamp_text: str) -> int:
     """
-    1項目（温度または湿度）の範囲逸脱を判定してアラートを送る。
+    to_epoch と同じ値を、datetime を作らずに求める（取り込みで1行ごとに呼ぶため）。
 
-    直近2点が「両方とも下限未満」または「両方とも上限超過」のときだけ発報する。
-    片側だけの逸脱（単発ノイズの疑い）や範囲内では通知しない。
+    書式は TIMESTAMP_PATTERN で検査し、日付部分の変換は日付ごとにキャッシュする
+    （1つのチャンクはほぼ同じ日付の行ばかりなので、実際の変換は数回で済む）。
     """
-    allowed = get_setting(config, device_id, setting_key)
-    if not allowed:  # 未設定（None）なら判定しない
-        return
-    low, high = allowed[0], allowed[1]
+    match = TIMESTAMP_PATTERN.match(timestamp_text)
+    if match is None:
+        raise ValueError(f"時刻の書式が不正です: {timestamp_text!r}")
+    date_text, hour, minute, second = match.groups()
+    hour, minute, second = int(hour), int(minute), int(second)
+    if hour > 23 or minute > 59 or second > 59:
+        raise ValueError(f"時刻の値が不正です: {timestamp_text!r}")
+    return _day_start_epoch(date_text) + hour * 3600 + minute * 60 + second
+
+
+class _ParsedChunk:
+    """作業スレッドが読み終えた1チャンクファイルの中身（DBへの書き込みはメインスレッドが行う）"""
+
+    def __init__(self, file_path: str, device_id: str, device_key: int):
+        self.file_path = file_path
+        self.device_id = device_id
+        self.device_key = device_key
+        self.extra_columns = []   # ヘッダーにあった集計行の列（AGGREGATE_COLUMNS のうち）
+        self.rows = []            # samples に入れる行のタプル
+        self.earliest = None      # 取り込む行の最古の ts
+        self.latest = None        # 取り込む行の最新の ts
+        self.hours = set()        # 行のある時間（ts // 3600。日は hour // 24）
+        self.error = None         # 読めなかった場合の例外
+
+
+def _list_chunk_files(device_dir: str, file_filter=None) -> list:
+    """incoming/<デバイス名>/ の取り込み待ちチャンク（.csv / .csv.gz）を名前順に返す"""
+    with os.scandir(device_dir) as entries:
+        return sorted(entry.path for entry in entries
+                      if entry.name.endswith(('.csv', '.csv.gz')) and entry.is_file()
+                      and (file_filter is None or file_filter(entry.path)))
+
+
+def _read_chunk_file(file_path: str, device_id: str, device_key: int) -> _ParsedChunk:
+    """
+    1つのチャンクファイルを読んで samples の行に変換する（作業スレッドで呼ぶ。DBには触らない）。
 
-    # 2点とも同じ側に逸脱しているときだけ発報する
-    if newest_value < low and older_value < low:
-        direction = "低すぎます"
-    elif newest_value > high and older_value > high:
-        direction = "高すぎます"
-    else:
-        return
+    読めないファイル（gzipの破損など）は例外を投げず、error に入れて返す。
+    列数がヘッダーと合わない行はスキップし、ファイルごとに件数と最初の1行をログに残す。
+    """
+    chunk = _ParsedChunk(file_path, device_id, device_key)
+    file_name = os.path.basename(file_path)
+    open_chunk = gzip.open if file_path.endswith('.gz') else open
+    try:
+        with open_chunk(file_path, 'rt', newline='') as f:
+            reader = csv.reader(f)
+            # 先頭はヘッダー行。集計行の列（AGGREGATE_COLUMNS）があれば一緒に取り込む
+            header = next(reader, None) or []
+            chunk.extra_columns = [name for name in AGGREGATE_COLUMNS if name in header]
+            extra_indexes = [header.index(name) for name in chunk.extra_columns]
+            column_count = len(header)
+            if column_count < 3:
+                logger.warning(f"ヘッダー行の列が足りないため、ファイル全体をスキップしました ({file_name}): {header}")
+                return chunk
+            skipped_rows = 0
+            first_skipped_row = None
+            for row in reader:
+                if not row:
+                    continue  # 空行
+                if len(row) != column_count:
+                    skipped_rows += 1
+                    if first_skipped_row is None:
+                        first_skipped_row = row
+                    continue
+                # 不正な行が1つでもあればファイルごと保留するのではなく、行単位でスキップする
+                # （Piの電源断でCSV末尾が中途半端に書かれた行などがここで弾かれる）
+                try:
+                    ts = parse_epoch_fast(row[0])
+                    chunk.rows.append((device_key, ts, float(row[1]), float(row[2]),
+                                       *(_parse_optional_float(row[index]) for index in extra_indexes)))
+                except ValueError:
+                    logger.warning(f"不正な行をスキップしました ({file_name}): {row}")
+                    continue
+                if chunk.earliest is None or ts < chunk.earliest:
+                    chunk.earliest = ts
+                if chunk.latest is None or ts > chunk.latest:
+                    chunk.latest = ts
+                chunk.hours.add(ts // 3600)
+            if skipped_rows:
+                logger.warning(f"列数がヘッダーと合わない行を{skipped_rows}行スキップしました "
+                               f"({file_name}, 最初の行: {first_skipped_row})")
+    except Exception as e:
+        chunk.error = e
+    return chunk
 
-    cooldown_hours = get_setting(config, device_id, 'alert_cooldown_hours')
-    if not is_cooldown_passed(conn, device_id, setting_key, cooldown_hours, now):
-        logger.info(f"{device_id}: {label}の範囲逸脱を検出しましたがクールダウン中のため送信しません")
-        return
 
-    message = (
-        f":rotating_light: [{device_id}] {label}が{direction}（インキュベータの開けっ放し等に注意）\n"
-        f"直近2回の{label}: {older_value}{unit} → {newest_value}{unit}"
-        f"（許容範囲: {low}〜{high}{unit}）\n"
-        f"以後{cooldown_hours}時間はこのデバイスの{label}アラートを送信しません"
-    )
-    if slack.post_message(message):
-        record_alert_sent(conn, device_id, setting_key, now)
-        logger.info(
-            f"{device_id}: {label}範囲逸脱アラートを送信しました "
-            f"({newest_value}{unit}, 許容 {low}〜{high}{unit})"
-        )
+def _remove_ingested_file(file_path: str) -> None:
+    """取り込み済みのファイルを削除する（失敗しても次回 INSERT OR IGNORE で取り込み直すだけなので警告のみ）"""
+    try:
+        os.remove(file_path)
+    except OSError as e:
+        logger.warning(f"取り込み済みファイルの削除に失敗しました（次回取り込み直します）: {file_path}: {e}")
 
 
-def check_missing_data_alerts(conn: sqlite3.Connection, config: dict, slack: SlackSender,
-                              now: datetime.datetime) -> None:
+class _IngestTransaction:
     """
-    欠測アラートの判定。
+    ingest の1トランザクションぶんの集計（コミット前に devices・dirty_dates へまとめて反映する）。
 
-    最終データが missing_data_hours（デフォルト2時間）以上前のデバイスを通知する。
-    センサー故障・Piの停止・NASへの送信失敗のいずれもこの1本で検出できる。
-    通知はデバイスごとに1日1回まで。
+    ファイルごとに devices を更新すると、ファイル数ぶん同じデバイスの行を書き直すことになるため、
+    デバイスごとの件数・最古の時刻・触った日をためておき、コミットの直前に1回だけ書く。
     """
-    for device_id in get_all_device_ids(conn):
-        row = conn.execute(
-            "SELECT MAX(timestamp) FROM readings WHERE device_id = ?", (device_id,)
-        ).fetchone()
-        last_time = parse_timestamp(row[0])
-        missing_hours = get_setting(config, device_id, 'missing_data_hours')
 
-        elapsed_hours = (now - last_time).total_seconds() / 3600
-        if elapsed_hours < missing_hours:
-            continue
+    def __init__(self):
+        self.row_count = 0
+        self.committed_files = []     # コミットしたら削除するファイル
+        self.inserted_by_device = {}  # device_id → 新しく入った行数
+        self.earliest_by_device = {}  # device_id → 新しく入った行の最古の ts
+        self.dirty_days = set()       # (device_id, ts // 86400)
+        self.dirty_hours = set()      # (device_key, ts // 3600)。hourly_rollup を計算し直す時間
+
+    def add(self, chunk: _ParsedChunk, inserted: int, inserted_earliest: int) -> None:
+        """
+        SAVEPOINT を抜けた（取り込みが確定した）チャンクを集計に加える。
+
+        inserted_earliest は新しく入った行の最古の ts（全て取り込み済みの行だったら None）。
+        """
+        self.committed_files.append(chunk.file_path)
+        self.row_count += len(chunk.rows)
+        if not chunk.rows:
+            return
+        device_id = chunk.device_id
+        self.inserted_by_device[device_id] = self.inserted_by_device.get(device_id, 0) + inserted
+        earliest = self.earliest_by_device.get(device_id)
+        if inserted_earliest is not None and (earliest is None or inserted_earliest < earliest):
+            self.earliest_by_device[device_id] = inserted_earliest
+        self.dirty_days.update((device_id, hour // 24) for hour in chunk.hours)
+        self.dirty_hours.update((chunk.device_key, hour) for hour in chunk.hours)
+
+    def flush(self, conn: sqlite3.Connection, executor: concurrent.futures.Executor) -> None:
+        """devices・dirty_dates・hourly_rollup・alert_watermarks を更新してコミットし、取り込み済みのファイルをまとめて削除する"""
+        update_hourly_rollup(conn, self.dirty_hours)
+        conn.executemany(
+            "INSERT OR IGNORE INTO dirty_dates (device_id, date) VALUES (?, ?)",
+            sorted((device_id, from_epoch(day * 86400)[:10]) for device_id, day in self.dirty_days),
+        )
+        for device_id, inserted in self.inserted_by_device.items():
+            if inserted > 0:
+                update_device_registry(conn, device_id, inserted,
+                                       from_epoch(self.earliest_by_device[device_id]))
+        lower_alert_watermarks(conn, {device_id: self.earliest_by_device[device_id]
+                                      for device_id, inserted in self.inserted_by_device.items()
+                                      if inserted > 0})
+        conn.commit()
+
+        # 削除はコミットの後。削除前に止まっても、次回の取り込みは INSERT OR IGNORE で重複しない。
+        # NAS上の削除は1件ずつ往復待ちが発生するので、読み込みと同じスレッドプールで並行して行う
+        list(executor.map(_remove_ingested_file, self.committed_files))
+
+
+def _quarantine_chunk_file(file_path: str, error: Exception) -> None:
+    """壊れたファイルを毎回処理し直さないよう .error を付けて退避する"""
+    logger.error(f"ファイルの取り込みに失敗しました: {file_path}: {error}")
+    try:
+        os.replace(file_path, file_path + '.error')
+    except Exception as rename_error:
+        logger.error(f"エラーファイルの退避にも失敗しました: {rename_error}")
 
-        # 1日1回まで（クールダウン24時間）
-        if not is_cooldown_passed(conn, device_id, 'missing', 24, now):
-            continue
 
-        message = (
-            f":warning: [{device_id}] データが {last_time:%m/%d %H:%M} から届いていません"
-            f"（約{elapsed_hours:.1f}時間）\n"
-            f"Piの電源・センサー配線・NASへの接続を確認してください。"
-            f"手順書（OPERATIONS.md）の「トラブル対応」を参照。"
-        )
-        if slack.post_message(message):
-            record_alert_sent(conn, device_id, 'missing', now)
-            logger.info(f"{device_id}: 欠測アラートを送信しました")
+def _write_chunk(conn: sqlite3.Connection, chunk: _ParsedChunk,
+                 transaction: _IngestTransaction) -> bool:
+    """
+    読み終えたチャンクを samples に入れる（メインスレッド＝唯一の書き込み役で呼ぶ）。
 
+    Returns:
+        取り込めたら True（壊れたファイルは .error に退避して False）
+    """
+    if chunk.error is not None:
+        _quarantine_chunk_file(chunk.file_path, chunk.error)
+        return False
 
-def run_ingest(base_dir: str, slack: SlackSender) -> None:
-    """ingest サブコマンド本体"""
-    conn = open_database(base_dir)
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    conn.execute("SAVEPOINT chunk_file")
     try:
-        config = load_config(base_dir)
-        now = datetime.datetime.now()
+        # センサーPiはCRCの合わないセグメントを丸ごと送り直すので、チャンクの大半が取り込み済みのことがある。
+        # 範囲逸脱の判定をやり直すのは新しく入った行からにしたいので、入れる前に取り込み済みの時刻を調べておく
+        # （主キーの範囲検索で、読むのはチャンクの期間の行だけ）
+        inserted_earliest = None
+        if chunk.rows:
+            existing = {ts for (ts,) in conn.execute(
+                "SELECT ts FROM samples WHERE device_key = ? AND ts BETWEEN ? AND ?",
+                (chunk.device_key, chunk.earliest, chunk.latest))}
+            inserted_earliest = min((row[1] for row in chunk.rows if row[1] not in existing),
+                                    default=None)
+        column_names = ', '.join(['device_key', 'ts', 'temperature', 'humidity'] + chunk.extra_columns)
+        placeholders = ', '.join('?' * (4 + len(chunk.extra_columns)))
+        inserted = conn.executemany(
+            f"INSERT OR IGNORE INTO samples ({column_names}) VALUES ({placeholders})",
+            chunk.rows,
+        ).rowcount
+        conn.execute("RELEASE chunk_file")
+    except Exception as e:
+        conn.execute("ROLLBACK TO chunk_file")
+        conn.execute("RELEASE chunk_file")
+        _quarantine_chunk_file(chunk.file_path, e)
+        return False
 
-        inserted = ingest_incoming_files(conn, base_dir)
-        logger.info(f"取り込み処理完了: {inserted}行")
+    transaction.add(chunk, inserted, inserted_earliest)
+    return True
 
-        check_range_alerts(conn, config, slack, now)
-        check_missing_data_alerts(conn, config, slack, now)
-    finally:
-        conn.close()
 
+def ingest_incoming_files(conn: sqlite3.Connection, base_dir: str,
+                          workers: int = DEFAULT_INGEST_WORKERS, file_filter=None) -> int:
+    """
+    incoming/<デバイス名>/ に届いたCSVチャンクをDBに取り込む。
 
-# =============================================================================
-# daily: 日次集計と前日サマリ投稿
-# =============================================================================
+    - 主キー (device_key, ts) への INSERT OR IGNORE により、
+      Piからの再送・重複データは自然に排除される
+    - 取り込みに成功したファイルは削除する（データはDBにあり、NASスナップショットが保険）
+    - 壊れたファイルは拡張子 .error を付けて残し、次回以降は処理しない
+    - センサーPiが圧縮送信（--compress-uploads）した .csv.gz もそのまま取り込む
+    - 高頻度サンプリング（--sample-interval）の集計行は、ヘッダーに
+      temp_min / temp_max / humid_min / humid_max / sample_count の列があるので、それも保存する
+    - 行を入れた (デバイス, 日付) は同じトランザクションで dirty_dates に記録し、
+      daily がその日の集計だけを再計算できるようにする（数日遅れて届いた行も反映される）
+    - devices（デバイスごとの最新2点・件数）も同じトランザクションで更新する。
+      アラート判定や status は samples を読まずにこれだけを見る
+    - 行を入れた時間の hourly_rollup（時間別集計）も同じトランザクションで計算し直す
+
+    NAS停止明けには数千ファイルがたまることがあるため、ファイルごとにコミットせず
+    INGEST_TRANSACTION_ROWS 行ごとのトランザクションにまとめる（コミットのたびにNAS越しの
+    fsync が走るため）。ファイルごとに SAVEPOINT を切り、壊れたファイルの行だけを取り消す。
+    ファイルの削除は、そのファイルを含むトランザクションのコミット後にまとめて行う。
+
+    NAS上の小さなファイルは、一覧・open・読み込み・削除のたびにネットワークの往復待ちになる。
+    そこで一覧と読み込み（CSVの解析まで）は workers 本のスレッドで並行して行い、
+    SQLiteへの書き込みはこの関数を呼んだスレッドだけが行う（SQLiteの書き込みは1本に限られるため）。
+    先読みは workers × INGEST_READ_AHEAD_PER_WORKER ファイルまでにして、メモリに載る量を抑える。
+
+    file_filter（パスを受け取り bool を返す関数）を渡すと、True のファイルだけを取り込む
+    （serve が書き込み途中のファイルを後回しにするのに使う。読み込みスレッドから呼ばれる）。
 
-def update_daily_summary(conn: sqlite3.Connection) -> None:
+    Returns:
+        取り込んだ行数
     """
-    完了した日（今日より前）の日次集計を計算する。
+    started = time.monotonic()
+    total_rows = 0
+    file_count = 0
+    incoming_dir = os.path.join(base_dir, 'incoming')
 
-    INSERT OR REPLACE で毎回全期間を再計算する（データ量は10年で200万行程度と
-    小さいため、差分管理より単純さを優先。遅延取り込みで過去の日が更新されても
-    自動的に集計へ反映される利点もある）。
-    """
-    conn.execute("""
-        INSERT OR REPLACE INTO daily_summary
-            (device_id, date, temp_min, temp_max, temp_avg, humid_min, humid_max, humid_avg)
-        SELECT device_id, date(timestamp),
-               MIN(temperature), MAX(temperature), ROUND(AVG(temperature), 3),
-               MIN(humidity), MAX(humidity), ROUND(AVG(humidity), 3)
-        FROM readings
-        WHERE date(timestamp) < date('now', 'localtime')
-        GROUP BY device_id, date(timestamp)
-    """)
-    conn.commit()
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ingest-reader') as executor:
+        # デバイス名は incoming/ 直下のフォルダ名から取る
+        device_dirs = []
+        if os.path.isdir(incoming_dir):
+            with os.scandir(incoming_dir) as entries:
+                device_dirs = sorted(entry.path for entry in entries if entry.is_dir())
+        file_lists = executor.map(functools.partial(_list_chunk_files, file_filter=file_filter),
+                                  device_dirs)
+
+        pending_files = []
+        device_keys = {}
+        for device_dir, file_paths in zip(device_dirs, file_lists):
+            if not file_paths:
+                continue
+            device_id = os.path.basename(device_dir)
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            device_keys[device_id] = intern_device(conn, device_id)
+            pending_files.extend((file_path, device_id) for file_path in file_paths)
+
+        transaction = _IngestTransaction()
+        read_ahead = collections.deque()
+        pending = iter(pending_files)
+        read_ahead_limit = workers * INGEST_READ_AHEAD_PER_WORKER
+        while True:
+            # 先読みの枠が空いているぶんだけ読み込みを依頼し、書き込みは依頼した順に行う
+            for file_path, device_id in itertools.islice(pending, read_ahead_limit - len(read_ahead)):
+                read_ahead.append(executor.submit(
+                    _read_chunk_file, file_path, device_id, device_keys[device_id]))
+            if not read_ahead:
+                break
+
+            chunk = read_ahead.popleft().result()
+            if not _write_chunk(conn, chunk, transaction):
+                continue
+            logger.debug(f"取り込み完了: {os.path.basename(chunk.file_path)} ({len(chunk.rows)}行)")
+            total_rows += len(chunk.rows)
+            file_count += 1
+            if transaction.row_count >= INGEST_TRANSACTION_ROWS:
+                transaction.flush(conn, executor)
+                transaction = _IngestTransaction()
+
+        if conn.in_transaction or transaction.committed_files:
+            transaction.flush(conn, executor)
+
+    elapsed = time.monotonic() - started
+    # serve では数秒おきに呼ばれるので、何も無かった回はデバッグログにとどめる
+    logger.log(
+        logging.INFO if file_count else logging.DEBUG,
+        f"取り込み処理完了: {total_rows}行 / {file_count}ファイル "
+        f"({elapsed:.1f}秒, {total_rows / max(elapsed, 0.001):.0f}行/秒, 読み込みスレッド{workers}本)"
+    )
+    return total_rows
 
 
-def build_daily_comment(conn: sqlite3.Connection, all_device_ids: list,
-                        target_date: datetime.date) -> str:
+def update_device_registry(conn: sqlite3.Connection, device_id: str, inserted_count: int,
+                           earliest_timestamp: str) -> None:
     """
-    日次レポートに使うコメント（前日の各デバイスのmin/max/avgと欠測注記）を作る。
+    取り込んだ行を devices に反映する（件数・最初の時刻・最新2点）。
 
-    週次レポートの build_weekly_comment と書式をそろえている。
-    前日の集計行が無いデバイスは「データなし（要確認）」と明記し、欠測に気づけるようにする。
+    コミットは呼び出し側（取り込みと同じトランザクション）で行う。
+    遅れて届いた古い行で最新2点が入れ替わることは無いが、入れ替わる場合も含めて
+    最新2点は samples から取り直す（主キーの末尾を読むだけなのでDBの大きさに関係なく速い）。
     """
-    date_key = target_date.strftime('%Y-%m-%d')
+    conn.execute(
+        "INSERT INTO devices (device_id, first_seen, row_count) VALUES (?, ?, ?) "
+        "ON CONFLICT (device_id) DO UPDATE SET "
+        "  first_seen = MIN(first_seen, excluded.first_seen), "
+        "  row_count = row_count + excluded.row_count",
+        (device_id, earliest_timestamp, inserted_count),
+    )
+    _refresh_latest_readings(conn, device_id)
+
+
+def get_all_device_ids(conn: sqlite3.Connection) -> list:
+    """DBに記録のある全デバイスIDを返す"""
+    return [row[0] for row in conn.execute(
+        "SELECT device_id FROM devices ORDER BY device_id")]
+
+
+class _AlertBatch:
+    """
+    1回の判定で出たアラートと復旧をまとめて、通知と記録を行う（アラートの種類ごと）。
+
+    NASのマウント切れや建物のネットワーク障害では、多数のデバイスが同時に欠測・逸脱する。
+    同じ判定で ALERT_STORM_MIN_DEVICES 台以上に出たら、デバイスごとに送らず1通の「障害」通知にまとめ、
+    incidents / incident_devices に記録する。障害が続いている間に加わったデバイス・復旧したデバイスも
+    判定1回につき1通にまとめて知らせ、全台が復旧したら障害を閉じる。
+    障害に含まれているデバイスには、個別のアラートは送らない。
+    台数が少ないときは、これまでどおりデバイスごとのアラートを送る。
+
+    通知の件数と、DBへの書き込みの回数（executemany）は、巻き込まれた台数によらず一定になる。
+    """
+
+    def __init__(self, conn: sqlite3.Connection, alert_key: str):
+        self.alert_key = alert_key
+        self.label = ALERT_LABELS[alert_key]
+        row = conn.execute(
+            "SELECT id, started_at, last_notified FROM incidents "
+            "WHERE alert_key = ? AND resolved_at IS NULL ORDER BY id DESC LIMIT 1",
+            (alert_key,),
+        ).fetchone()
+        self.incident_id, self.incident_started, self.incident_notified = row or (None, None, None)
+        # 障害に含まれていて、まだ復旧していないデバイス
+        self.active_device_ids = {device_id for (device_id,) in conn.execute(
+            "SELECT device_id FROM incident_devices WHERE incident_id = ? AND recovered_at IS NULL",
+            (self.incident_id,),
+        )}
+        self.alerts = []      # (device_id, 個別に送るときの本文, 障害通知に並べる1行)
+        self.recovered = []   # 障害から復旧したデバイス
+
+    def is_active(self, device_id: str) -> bool:
+        """このデバイスが進行中の障害に含まれているか（含まれていれば個別のアラートは出さない）"""
+        return device_id in self.active_device_ids
+
+    def add_alert(self, device_id: str, message: str, summary: str) -> None:
+        self.alerts.append((device_id, message, summary))
+
+    def add_recovery(self, device_id: str) -> None:
+        if self.is_active(device_id):
+            self.recovered.append(device_id)
+
+    def flush(self, conn: sqlite3.Connection, now: datetime.datetime) -> None:
+        """通知を outbox に入れ、送信時刻と障害の状態を記録する（コミットは呼び出し側）"""
+        now_text = now.strftime('%Y-%m-%d %H:%M:%S')
+        notified = False
+
+        if self.recovered:
+            conn.executemany(
+                "UPDATE incident_devices SET recovered_at = ? WHERE incident_id = ? AND device_id = ?",
+                [(now_text, self.incident_id, device_id) for device_id in self.recovered],
+            )
+            remaining = len(self.active_device_ids) - len(self.recovered)
+            duration_hours = (now - parse_timestamp(self.incident_started)).total_seconds() / 3600
+            if remaining:
+                message = (f":white_check_mark: {self.label}の障害: {len(self.recovered)}台が復旧しました"
+                           f"（残り{remaining}台）\n{_format_device_list(self.recovered)}")
+            else:
+                conn.execute("UPDATE incidents SET resolved_at = ? WHERE id = ?",
+                             (now_text, self.incident_id))
+                message = (f":white_check_mark: {self.label}の障害: 全台が復旧しました"
+                           f"（{self.incident_started[5:16]} から約{duration_hours:.1f}時間）\n"
+                           f"{_format_device_list(self.recovered)}")
+                self.incident_id = None
+            enqueue_slack(conn, 'alert', message)
+            notified = True
+            logger.info(f"{self.label}の障害: {len(self.recovered)}台が復旧しました（残り{remaining}台）")
+
+        if self.incident_id is None and len(self.alerts) >= ALERT_STORM_MIN_DEVICES:
+            cursor = conn.execute(
+                "INSERT INTO incidents (alert_key, started_at, last_notified) VALUES (?, ?, ?)",
+                (self.alert_key, now_text, now_text),
+            )
+            self.incident_id = cursor.lastrowid
+            self.incident_started = now_text
+            heading = (f":rotating_light: {self.label}が{len(self.alerts)}台のデバイスで同時に起きています"
+                       f"（{ALERT_HINTS[self.alert_key]}）")
+        elif self.incident_id is not None and self.alerts:
+            heading = f":rotating_light: {self.label}の障害: さらに{len(self.alerts)}台で起きています"
+        else:
+            heading = None
+
+        if heading:
+            # 障害にまとめる。一度復旧して再び起きたデバイスは、復旧の記録を消して戻す
+            conn.executemany(
+                "INSERT OR REPLACE INTO incident_devices (incident_id, device_id, detail, recovered_at) "
+                "VALUES (?, ?, ?, NULL)",
+                [(self.incident_id, device_id, summary) for device_id, _, summary in self.alerts],
+            )
+            conn.execute("UPDATE incidents SET last_notified = ? WHERE id = ?", (now_text, self.incident_id))
+            summaries = [summary for _, _, summary in self.alerts]
+            enqueue_slack(conn, 'alert', f"{heading}\n{_format_device_list(summaries)}\n"
+                                         f"復旧するまで、これらのデバイスの{self.label}アラートは個別に送りません")
+            logger.info(f"{self.label}の障害: {len(self.alerts)}台をまとめて送信キューに入れました")
+        else:
+            for device_id, message, _ in self.alerts:
+                enqueue_slack(conn, 'alert', message)
+                logger.info(f"{device_id}: {self.label}アラートを送信キューに入れました")
+            conn.executemany(
+                "INSERT OR REPLACE INTO alert_state (device_id, alert_key, last_sent) VALUES (?, ?, ?)",
+                [(device_id, self.alert_key, now_text) for device_id, _, _ in self.alerts],
+            )
+            # 障害が長引いている場合は、ALERT_INCIDENT_REMINDER_HOURS ごとに続いていることを知らせる
+            if (self.incident_id is not None and not notified
+                    and (now - parse_timestamp(self.incident_notified)).total_seconds()
+                    > ALERT_INCIDENT_REMINDER_HOURS * 3600):
+                remaining_ids = sorted(self.active_device_ids)
+                enqueue_slack(conn, 'alert', (
+                    f":warning: {self.label}の障害が続いています"
+                    f"（{self.incident_started[5:16]} から。未復旧{len(remaining_ids)}台）\n"
+                    f"{_format_device_list(remaining_ids)}"))
+                conn.execute("UPDATE incidents SET last_notified = ? WHERE id = ?",
+                             (now_text, self.incident_id))
+
+
+def _format_device_list(lines: list) -> str:
+    """障害通知に並べるデバイスの一覧（ALERT_GROUP_LIST_MAX 台を超えた分は台数だけにする）"""
+    shown = [f"- {line}" for line in lines[:ALERT_GROUP_LIST_MAX]]
+    if len(lines) > ALERT_GROUP_LIST_MAX:
+        shown.append(f"- 他{len(lines) - ALERT_GROUP_LIST_MAX}台")
+    return "\n".join(shown)
+
+
+# 範囲逸脱の判定。前回の判定以降（alert_watermarks.ts より後）に入った行を、1つ前の行と組にして
+# 「2点とも許容範囲の同じ側」の組だけを全デバイスぶん1回で返す。
+# 1つ前の行を LAG で取れるよう、透かしの手前も組の間隔の上限（max_gap_sec）ぶんだけ読む
+# （それより前の行とは、どのみち「2連続」とみなさない）。読む行数は新しく入った行数に比例する
+RANGE_EXCURSION_SQL = """
+    WITH paired AS (
+        SELECT t.device_key, t.max_gap_sec, w.ts AS watermark,
+               t.temp_low, t.temp_high, t.humid_low, t.humid_high,
+               s.ts, s.temperature, s.humidity,
+               LAG(s.ts)          OVER pair AS prev_ts,
+               LAG(s.temperature) OVER pair AS prev_temperature,
+               LAG(s.humidity)    OVER pair AS prev_humidity
+        -- CROSS JOIN で結合の順を固定し、samples はデバイスごとに主キーの範囲だけを読ませる
+        FROM temp.alert_thresholds t
+        CROSS JOIN alert_watermarks w ON w.device_key = t.device_key
+        CROSS JOIN samples s ON s.device_key = t.device_key AND s.ts > w.ts - t.max_gap_sec
+        WINDOW pair AS (PARTITION BY s.device_key ORDER BY s.ts)
+    )
+    SELECT device_key, prev_ts, ts, prev_temperature, temperature, prev_humidity, humidity
+    FROM paired
+    WHERE ts > watermark AND ts - prev_ts <= max_gap_sec
+      AND ((temperature < temp_low  AND prev_temperature < temp_low)
+        OR (temperature > temp_high AND prev_temperature > temp_high)
+        OR (humidity    < humid_low  AND prev_humidity < humid_low)
+        OR (humidity    > humid_high AND prev_humidity > humid_high))
+    ORDER BY device_key, ts
+"""
+
+
+def _prepare_alert_thresholds(conn: sqlite3.Connection, config: dict, device_keys: dict) -> None:
+    """
+    範囲逸脱の判定に使う、デバイスごとの許容範囲と組の間隔の上限を一時テーブルに入れる
+    （thresholds.yaml の設定をSQLの中で突き合わせるため。判定のたびに入れ直す）。
+    許容範囲が1つも設定されていないデバイスは入れない（判定しない）。
+    """
+    conn.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS alert_thresholds ("
+        "  device_key INTEGER PRIMARY KEY, max_gap_sec INTEGER NOT NULL,"
+        "  temp_low REAL, temp_high REAL, humid_low REAL, humid_high REAL)"
+    )
+    conn.execute("DELETE FROM temp.alert_thresholds")
+    rows = []
+    for device_id, device_key in device_keys.items():
+        temp_range = get_setting(config, device_id, 'temp_range') or (None, None)
+        humid_range = get_setting(config, device_id, 'humid_range') or (None, None)
+        if temp_range[0] is None and humid_range[0] is None:
+            continue
+        heartbeat_minutes = get_setting(config, device_id, 'heartbeat_minutes') or 0
+        max_gap_minutes = max(MAX_PAIR_GAP_MINUTES, heartbeat_minutes + READING_INTERVAL_MINUTES)
+        rows.append((device_key, max_gap_minutes * 60, temp_range[0], temp_range[1],
+                     humid_range[0], humid_range[1]))
+    conn.executemany("INSERT INTO temp.alert_thresholds VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def lower_alert_watermarks(conn: sqlite3.Connection, earliest_by_device: dict) -> None:
+    """
+    新しく入った行が次の範囲逸脱の判定に入るよう、デバイスごとの判定済みの位置を新しく入った最古の行の手前まで戻す。
+
+    初めてのデバイスは、取り込んだ行の全体が判定の対象になる。コミットは呼び出し側（取り込みと同じトランザクション）。
+    """
+    conn.executemany(
+        "INSERT INTO alert_watermarks (device_key, ts) "
+        "SELECT device_key, ? FROM device_keys WHERE device_id = ? "
+        "ON CONFLICT (device_key) DO UPDATE SET ts = MIN(ts, excluded.ts)",
+        [(earliest - 1, device_id) for device_id, earliest in earliest_by_device.items()],
+    )
+
+
+def _excursion_direction(newest_value: float, older_value: float, low: float, high: float):
+    """2点とも同じ側に逸脱していれば "低すぎます" / "高すぎます"、そうでなければ None"""
+    if newest_value is None or older_value is None:
+        return None
+    if newest_value < low and older_value < low:
+        return "低すぎます"
+    if newest_value > high and older_value > high:
+        return "高すぎます"
+    return None
+
+
+def check_range_alerts(conn: sqlite3.Connection, config: dict, now: datetime.datetime) -> None:
+    """
+    範囲逸脱アラートの判定。
+
+    前回の判定以降に取り込んだ全ての行について、温度・湿度が「許容範囲」の同じ側に2回連続で
+    逸脱していたらSlackに通知する（outbox に入れる）。2連続を条件にすることで、DHT22の単発ノイズや
+    短時間のドア開閉では鳴らず、インキュベータの開けっ放しのような継続的な逸脱だけを捉える。
+    許容範囲（temp_range / humid_range）が未設定の項目は判定しない。
+    測定間隔が MAX_PAIR_GAP_MINUTES より空いた2点は「2連続」とみなさない
+    （欠測明けの1点目や、離れた2点をたまたま拾って誤報するのを防ぐ）。
+
+    判定は RANGE_EXCURSION_SQL の1回のクエリで全デバイスぶんまとめて行い、判定済みの位置
+    （alert_watermarks）を最新の行まで進める。NAS障害明けなどにたまったチャンクがまとめて届いても、
+    途中の逸脱を見落とさない。同じデバイス・項目の逸脱が何組あっても、アラートは最初の1組について1通
+    （クールダウン中なら送らない）。
+
+    間引きモード（heartbeat_minutes 設定あり）のデバイスは、値が動かない間は行が来ないため、
+    記録されていない測定は「最後に記録した値のまま」とみなす。
+      - 2点の間隔はハートビート1回ぶんまで「連続」として扱う
+      - 最新の1点が2測定間隔以上そのまま保たれていれば、その値が2回続いたとみなす
+        （1間隔ぶんは、まだ届いていないだけの可能性があるので待つ。行が増えないので devices の最新の1点で見る）
+
+    多数のデバイスで同時に逸脱したときは、1通の障害通知にまとめる（_AlertBatch）。
+    """
+    items = {'temp_range': ('温度', '°C'), 'humid_range': ('湿度', '%')}
+    batches = {key: _AlertBatch(conn, key) for key in items}
+    device_keys = dict(conn.execute("SELECT device_id, device_key FROM device_keys"))
+    device_ids_by_key = {device_key: device_id for device_id, device_key in device_keys.items()}
+    _prepare_alert_thresholds(conn, config, device_keys)
+
+    # (device_id, 項目) → [最初の逸脱の組 (古い方の ts, 新しい方の ts, 古い方の値, 新しい方の値), 逸脱の組の数]
+    excursions = {}
+    for device_key, prev_ts, ts, *values in conn.execute(RANGE_EXCURSION_SQL):
+        device_id = device_ids_by_key[device_key]
+        for setting_key, older_value, newest_value in (('temp_range', values[0], values[1]),
+                                                       ('humid_range', values[2], values[3])):
+            allowed = get_setting(config, device_id, setting_key)
+            if not allowed or not _excursion_direction(newest_value, older_value, allowed[0], allowed[1]):
+                continue
+            entry = excursions.setdefault((device_id, setting_key),
+                                          [(prev_ts, ts, older_value, newest_value), 0])
+            entry[1] += 1
+
+    # 最新の1点での判定（障害からの復旧と、間引きモードで値が保たれている場合）
+    for device_id, last_timestamp, *latest_values in conn.execute(
+            "SELECT device_id, last_timestamp, last_temperature, last_humidity "
+            "FROM devices WHERE last_timestamp IS NOT NULL ORDER BY device_id").fetchall():
+        heartbeat_minutes = get_setting(config, device_id, 'heartbeat_minutes') or 0
+        newest_age_minutes = (now - parse_timestamp(last_timestamp)).total_seconds() / 60
+        is_held = (heartbeat_minutes and 2 * READING_INTERVAL_MINUTES <= newest_age_minutes
+                   <= ALERT_FRESHNESS_MINUTES + heartbeat_minutes)
+        for setting_key, value in zip(items, latest_values):
+            allowed = get_setting(config, device_id, setting_key)
+            if not allowed or value is None:
+                continue
+            if batches[setting_key].is_active(device_id):
+                if allowed[0] <= value <= allowed[1]:
+                    batches[setting_key].add_recovery(device_id)
+            elif (is_held and (device_id, setting_key) not in excursions
+                    and _excursion_direction(value, value, allowed[0], allowed[1])):
+                ts = to_epoch(last_timestamp)
+                excursions[(device_id, setting_key)] = [(ts, ts, value, value), 1]
+
+    for (device_id, setting_key), (excursion, excursion_count) in sorted(excursions.items()):
+        batch = batches[setting_key]
+        if batch.is_active(device_id):
+            continue
+        label, unit = items[setting_key]
+        _check_one_range(conn, config, now, device_id, batch, setting_key, label, unit,
+                         excursion, excursion_count)
+
+    # 判定済みの位置を最新の行まで進める（変わらないデバイスの行は書き換えない）
+    conn.execute(
+        "INSERT INTO alert_watermarks (device_key, ts) "
+        "SELECT k.device_key, CAST(strftime('%s', d.last_timestamp) AS INTEGER) "
+        "FROM devices d JOIN device_keys k ON k.device_id = d.device_id "
+        "WHERE d.last_timestamp IS NOT NULL "
+        "ON CONFLICT (device_key) DO UPDATE SET ts = excluded.ts WHERE excluded.ts > ts"
+    )
+    for batch in batches.values():
+        batch.flush(conn, now)
+    conn.commit()
+
+
+def _check_one_range(conn: sqlite3.Connection, config: dict,
+                     now: datetime.datetime, device_id: str, batch: _AlertBatch,
+                     setting_key: str, label: str, unit: str,
+                     excursion: tuple, excursion_count: int) -> None:
+    """
+    1項目（温度または湿度）の範囲逸脱のアラートを、クールダウン中でなければ batch に加える。
+
+    excursion は最初に見つかった「2点とも同じ側に逸脱」の組 (古い方の ts, 新しい方の ts, 古い方の値, 新しい方の値)。
+    間引きモードで値が保たれている場合は、最新の1点を2回続いたものとして渡す。
+    """
+    low, high = get_setting(config, device_id, setting_key)[:2]
+    older_ts, newest_ts, older_value, newest_value = excursion
+    direction = _excursion_direction(newest_value, older_value, low, high)
+
+    cooldown_hours = get_setting(config, device_id, 'alert_cooldown_hours')
+    if not is_cooldown_passed(conn, device_id, setting_key, cooldown_hours, now):
+        logger.info(f"{device_id}: {label}の範囲逸脱を検出しましたがクールダウン中のため送信しません")
+        return
+
+    older_time = parse_timestamp(from_epoch(older_ts))
+    newest_time = parse_timestamp(from_epoch(newest_ts))
+    if newest_ts == older_ts:
+        observed = f"{newest_time:%m/%d %H:%M} から変わらない{label}: {newest_value}{unit}"
+    else:
+        observed = (f"{older_time:%m/%d %H:%M}・{newest_time:%H:%M} の{label}: "
+                    f"{older_value}{unit} → {newest_value}{unit}")
+    message = (
+        f":rotating_light: [{device_id}] {label}が{direction}（インキュベータの開けっ放し等に注意）\n"
+        f"{observed}（許容範囲: {low}〜{high}{unit}）\n"
+        + (f"この後にも逸脱した記録が{excursion_count - 1}組あります\n" if excursion_count > 1 else "")
+        + f"以後{cooldown_hours}時間はこのデバイスの{label}アラートを送信しません"
+    )
+    batch.add_alert(device_id, message,
+                    summary=f"{device_id}: {older_value}{unit} → {newest_value}{unit}"
+                            f"（許容範囲: {low}〜{high}{unit}）")
+
+
+def check_missing_data_alerts(conn: sqlite3.Connection, config: dict,
+                              now: datetime.datetime) -> None:
+    """
+    欠測アラートの判定。
+
+    最終データが missing_data_hours（デフォルト2時間）以上前のデバイスを通知する。
+    センサー故障・Piの停止・NASへの送信失敗のいずれもこの1本で検出できる。
+    通知はデバイスごとに1日1回まで。
+    間引きモードのデバイスは値が動かなければハートビートごとにしか行が来ないので、
+    ハートビート2回ぶん来ないときまでは欠測とみなさない。
+    多数のデバイスで同時に欠測したときは、1通の障害通知にまとめる（_AlertBatch）。
+    """
+    batch = _AlertBatch(conn, 'missing')
+    for device_id, last_timestamp in conn.execute(
+            "SELECT device_id, last_timestamp FROM devices "
+            "WHERE last_timestamp IS NOT NULL ORDER BY device_id").fetchall():
+        last_time = parse_timestamp(last_timestamp)
+        missing_hours = get_setting(config, device_id, 'missing_data_hours')
+        heartbeat_minutes = get_setting(config, device_id, 'heartbeat_minutes')
+        if heartbeat_minutes:
+            missing_hours = max(missing_hours, 2 * heartbeat_minutes / 60)
+
+        elapsed_hours = (now - last_time).total_seconds() / 3600
+        if elapsed_hours < missing_hours:
+            batch.add_recovery(device_id)
+            continue
+        if batch.is_active(device_id):
+            continue
+
+        # 1日1回まで（クールダウン24時間）
+        if not is_cooldown_passed(conn, device_id, 'missing', 24, now):
+            continue
+
+        message = (
+            f":warning: [{device_id}] データが {last_time:%m/%d %H:%M} から届いていません"
+            f"（約{elapsed_hours:.1f}時間）\n"
+            f"Piの電源・センサー配線・NASへの接続を確認してください。"
+            f"手順書（OPERATIONS.md）の「トラブル対応」を参照。"
+        )
+        batch.add_alert(device_id, message,
+                        summary=f"{device_id}: {last_time:%m/%d %H:%M} から（約{elapsed_hours:.1f}時間）")
+    batch.flush(conn, now)
+    conn.commit()
+
+
+def ingest_and_check_alerts(conn: sqlite3.Connection, base_dir: str, config: dict,
+                            workers: int = DEFAULT_INGEST_WORKERS, file_filter=None) -> int:
+    """
+    取り込みとアラート判定（ingest サブコマンドと serve の共通部分）。取り込んだ行数を返す。
+
+    アラートは outbox に入れ、送信時刻の記録（alert_state）と一緒に1回でコミットする。
+    Slackへの送信は待たない（deliver_outbox が別に行う）。
+    """
+    now = datetime.datetime.now()
+    row_count = ingest_incoming_files(conn, base_dir, workers, file_filter)
+
+    check_range_alerts(conn, config, now)
+    check_missing_data_alerts(conn, config, now)
+    return row_count
+
+
+def run_ingest(base_dir: str, slack: SlackSender, local_db: str = None,
+               workers: int = DEFAULT_INGEST_WORKERS) -> None:
+    """ingest サブコマンド本体"""
+    with database_session(base_dir, local_db) as conn:
+        ingest_and_check_alerts(conn, base_dir, load_config(base_dir), workers)
+        deliver_outbox(conn, slack, OUTBOX_DELIVERY_BUDGET_SEC)
+
+
+# =============================================================================
+# daily: 日次集計と前日サマリ投稿
+# =============================================================================
+
+# 日次集計の列。集計行は間隔内の最小・最大を持っているので、日の最小・最大はそれを使う
+# （平均だけを見ると、短時間の逸脱が日次集計から消えてしまうため）
+DAILY_SUMMARY_SELECT = """
+    SELECT k.device_id, date(s.ts, 'unixepoch'),
+           MIN(COALESCE(s.temp_min, s.temperature)), MAX(COALESCE(s.temp_max, s.temperature)),
+           ROUND(AVG(s.temperature), 3),
+           MIN(COALESCE(s.humid_min, s.humidity)), MAX(COALESCE(s.humid_max, s.humidity)),
+           ROUND(AVG(s.humidity), 3),
+           SUM(COALESCE(s.sample_count, 1))
+"""
+
+
+def update_daily_summary(conn: sqlite3.Connection, full_rebuild: bool = False) -> int:
+    """
+    完了した日（今日より前）の日次集計を計算する。
+
+    通常は ingest が dirty_dates に記録した (デバイス, 日付) だけを再計算する。
+    毎回全期間を集計し直すと、10年で200万行程度になる samples をSMB越しに全件読むことになるため。
+    数日遅れて届いた行もその日が dirty_dates に載るので、次の daily で集計に反映される。
+    今日の分は日が終わるまで dirty_dates に残しておく。
+
+    full_rebuild が True なら全期間を集計し直す（集計が壊れた・手でDBを直した場合の修復用）。
+    時間別集計（hourly_rollup）も同じ理由で作り直す。
+
+    Returns:
+        集計し直した (デバイス, 日付) の数
+    """
+    today_ts = to_epoch(datetime.date.today().strftime('%Y-%m-%d 00:00:00'))
+    if full_rebuild:
+        # ts は1日が86400で割り切れる（to_epoch 参照）ので、ts / 86400 が日ごとのグループになる
+        cursor = conn.execute(f"""
+            INSERT OR REPLACE INTO daily_summary
+                (device_id, date, temp_min, temp_max, temp_avg, humid_min, humid_max, humid_avg,
+                 sample_count)
+            {DAILY_SUMMARY_SELECT}
+            FROM samples s JOIN device_keys k ON k.device_key = s.device_key
+            WHERE s.ts < ?
+            GROUP BY s.device_key, s.ts / 86400
+        """, (today_ts,))
+        rebuild_hourly_rollup(conn)
+    else:
+        # 日付の範囲で絞ることで、samples の主キー (device_key, ts) の範囲検索になる。
+        # CROSS JOIN は SQLite で結合順を固定する書き方（dirty_dates を外側にして samples を全件走査させない）
+        cursor = conn.execute(f"""
+            INSERT OR REPLACE INTO daily_summary
+                (device_id, date, temp_min, temp_max, temp_avg, humid_min, humid_max, humid_avg,
+                 sample_count)
+            {DAILY_SUMMARY_SELECT}
+            FROM dirty_dates d
+            CROSS JOIN device_keys k ON k.device_id = d.device_id
+            CROSS JOIN samples s
+              ON s.device_key = k.device_key
+             AND s.ts >= CAST(strftime('%s', d.date) AS INTEGER)
+             AND s.ts < CAST(strftime('%s', d.date) AS INTEGER) + 86400
+            WHERE d.date < date('now', 'localtime')
+            GROUP BY d.device_id, d.date
+        """)
+    updated = cursor.rowcount
+    conn.execute("DELETE FROM dirty_dates WHERE date < date('now', 'localtime')")
+    conn.commit()
+    return updated
+
+
+def build_daily_comment(conn: sqlite3.Connection, all_device_ids: list,
+                        target_date: datetime.date) -> str:
+    """
+    日次レポートに使うコメント（前日の各デバイスのmin/max/avgと欠測注記）を作る。
+
+    週次レポートの build_weekly_comment と書式をそろえている。
+    前日の集計行が無いデバイスは「データなし（要確認）」と明記し、欠測に気づけるようにする。
+    """
+    date_key = target_date.strftime('%Y-%m-%d')
     lines = [f":bar_chart: 日次レポート ({target_date:%m/%d})"]
 
     for device_id in all_device_ids:
@@ -490,40 +1746,151 @@ def build_daily_comment(conn: sqlite3.Connection, all_device_ids: list,
     return "\n".join(lines)
 
 
-def run_daily(base_dir: str, slack: SlackSender) -> None:
-    """daily サブコマンド本体"""
-    conn = open_database(base_dir)
-    try:
-        now = datetime.datetime.now()
+def post_daily_report(conn: sqlite3.Connection, full_rebuild: bool = False) -> None:
+    """日次集計を更新して前日サマリを投稿する（daily サブコマンドと serve の共通部分）"""
+    now = datetime.datetime.now()
 
-        update_daily_summary(conn)
-        logger.info("日次集計を更新しました")
+    updated = update_daily_summary(conn, full_rebuild)
+    scope_label = "全期間" if full_rebuild else "更新のあった日"
+    logger.info(f"日次集計を更新しました（{scope_label}: {updated}件）")
 
-        device_ids = get_all_device_ids(conn)
+    device_ids = get_all_device_ids(conn)
+
+    # 前日サマリをSlackに投稿する（毎日03:30の実行時に届く）。
+    # outbox に入れて送るため、Slack障害があっても復旧後に届く
+    if device_ids:
+        target_date = (now - datetime.timedelta(days=1)).date()
+        enqueue_slack(conn, 'message', build_daily_comment(conn, device_ids, target_date))
+        conn.commit()
+        logger.info("日次レポートを送信キューに入れました")
 
-        # 前日サマリをSlackに投稿する（毎日03:30の実行時に届く）。
-        # 集計の保存が終わった後に送るため、Slack障害があっても日次集計は失われない
-        if device_ids:
-            target_date = (now - datetime.timedelta(days=1)).date()
-            if slack.post_message(build_daily_comment(conn, device_ids, target_date)):
-                logger.info("日次レポートを送信しました")
-    finally:
-        conn.close()
+
+def run_daily(base_dir: str, slack: SlackSender, full_rebuild: bool = False,
+              local_db: str = None) -> None:
+    """daily サブコマンド本体（旧形式のDBの移行中は何もしない。open_database 参照）"""
+    with database_session(base_dir, local_db, migrate_old_layout=False) as conn:
+        post_daily_report(conn, full_rebuild)
+        deliver_outbox(conn, slack, OUTBOX_DELIVERY_BUDGET_SEC)
 
 
 # =============================================================================
 # weekly-report: 週次スモールマルチプルレポート
 # =============================================================================
 
-def create_weekly_graph(readings_by_device: dict, output_path: str,
-                        start_time: datetime.datetime, end_time: datetime.datetime) -> bool:
+def fetch_all_series(conn: sqlite3.Connection, device_ids: list, start_time: datetime.datetime,
+                     end_time: datetime.datetime,
+                     rollup_after_days: float = DEFAULT_ROLLUP_AFTER_DAYS,
+                     max_points: int = ROLLUP_MAX_POINTS) -> dict:
+    """
+    指定デバイスの期間内の時系列を、1回のクエリでまとめて読む。
+
+    Returns:
+        {デバイスID: NumPyの構造化配列（SERIES_FIELDS の列。ts は datetime64[s]）}。
+        期間内にデータの無いデバイスは含まない
+
+    期間が rollup_after_days 日以下なら samples の生データ（1点ずつの測定行の最小・最大は値そのもの）。
+    それより長い期間は hourly_rollup を読み、点数が max_points 程度になるよう
+    数時間ごとにまとめ直す（平均は行数で重み付け）。1か月・1年の期間でも読む行数は
+    時間別集計の件数までで、描く点数は週次レポートと変わらない。
+
+    行は (device_key, ts) の順に取り出し（主キーの順なので並べ替えは起きない）、Pythonのタプルの
+    リストを作らずに np.fromiter で直接配列に詰める。デバイスごとの配列は、その配列の区切りを
+    指すビューなのでコピーしない。
+    """
+    # numpy は matplotlib と一緒に入るもので、グラフを描くときしか使わないため、ここでimportする
+    import numpy as np
+
+    started = time.monotonic()
+    start_ts = to_epoch(start_time.strftime('%Y-%m-%d %H:%M:%S'))
+    end_ts = to_epoch(end_time.strftime('%Y-%m-%d %H:%M:%S'))
+    placeholders = ', '.join('?' * len(device_ids))
+    # CROSS JOIN で device_keys を外側に固定し、デバイスごとに主キーの範囲検索にする
+    if (end_time - start_time).total_seconds() <= rollup_after_days * 86400:
+        cursor = conn.execute(
+            "SELECT s.device_key, s.ts, s.temperature, s.humidity, "
+            "       COALESCE(s.temp_min, s.temperature), COALESCE(s.temp_max, s.temperature), "
+            "       COALESCE(s.humid_min, s.humidity), COALESCE(s.humid_max, s.humidity) "
+            "FROM device_keys k CROSS JOIN samples s "
+            "  ON s.device_key = k.device_key AND s.ts >= ? AND s.ts < ? "
+            f"WHERE k.device_id IN ({placeholders}) "
+            "ORDER BY s.device_key, s.ts",
+            (start_ts, end_ts, *device_ids),
+        )
+    else:
+        bucket_hours = max(1, -(-(end_ts - start_ts) // (3600 * max_points)))
+        bucket_sec = bucket_hours * 3600
+        # 時刻はまとめた区間の中央に置く
+        cursor = conn.execute(
+            "SELECT r.device_key, r.hour_ts / ? * ? + ? / 2, "
+            "       SUM(r.temp_avg * r.row_count) / SUM(r.row_count), "
+            "       SUM(r.humid_avg * r.row_count) / SUM(r.row_count), "
+            "       MIN(r.temp_min), MAX(r.temp_max), MIN(r.humid_min), MAX(r.humid_max) "
+            "FROM device_keys k CROSS JOIN hourly_rollup r "
+            "  ON r.device_key = k.device_key AND r.hour_ts >= ? AND r.hour_ts < ? "
+            f"WHERE k.device_id IN ({placeholders}) "
+            "GROUP BY r.device_key, r.hour_ts / ? ORDER BY r.device_key, r.hour_ts / ?",
+            (bucket_sec, bucket_sec, bucket_sec, start_ts - start_ts % 3600, end_ts, *device_ids,
+             bucket_sec, bucket_sec),
+        )
+    data = np.fromiter(cursor, dtype=SERIES_FIELDS)
+    fetched = time.monotonic()
+
+    # ts は「ローカル時刻をUTCとみなしたエポック秒」なので、そのまま datetime64[s] として読み替えられる
+    data = data.view([(name, 'M8[s]' if name == 'ts' else dtype) for name, dtype in SERIES_FIELDS])
+    device_names = dict(conn.execute(
+        f"SELECT device_key, device_id FROM device_keys WHERE device_id IN ({placeholders})",
+        device_ids,
+    ).fetchall())
+    boundaries = np.flatnonzero(np.diff(data['device_key'])) + 1
+    series_by_device = {
+        device_names[int(chunk['device_key'][0])]: chunk
+        for chunk in np.split(data, boundaries) if len(chunk)
+    }
+    logger.info(
+        f"時系列の読み込み: {len(data)}点 / {len(series_by_device)}デバイス "
+        f"(取得 {fetched - started:.2f}秒, 変換 {time.monotonic() - fetched:.2f}秒)"
+    )
+    return series_by_device
+
+
+def downsample_min_max(series, start_time: datetime.datetime, end_time: datetime.datetime,
+                       buckets: int = GRAPH_PANEL_PIXELS):
+    """
+    fetch_all_series の1デバイスの配列を、グラフの横幅（ピクセル数）ぶんの時間の区間に分け、区間ごとに
+    温度の最小・最大、湿度の最小・最大を持つ行だけを残す（区間あたり最大4行、時刻順のまま）。
+
+    1ピクセルの幅に入る点は、線としては最小〜最大の縦線にしか見えないので、
+    その両端を持つ行を残せば見た目は間引く前と変わらない。平均を取る間引きと違い、
+    短時間の逸脱（ドアの開けっ放し・停電）のピークが消えない。
+    """
+    import numpy as np
+
+    if len(series) <= buckets * 4:
+        return series
+    bucket_width = max(int((end_time - start_time).total_seconds() / buckets), 1)
+    bucket = (series['ts'] - np.datetime64(start_time, 's')).astype(np.int64) // bucket_width
+    kept = []
+    for field, sign in (('temp_min', 1), ('temp_max', -1), ('humid_min', 1), ('humid_max', -1)):
+        # 区間の番号で並べ、同じ区間の中では値の小さい（sign=-1 なら大きい）順にしたときの各区間の先頭
+        order = np.lexsort((sign * series[field], bucket))
+        is_first = np.concatenate(([True], np.diff(bucket[order]) != 0))
+        kept.append(order[is_first])
+    return series[np.unique(np.concatenate(kept))]
+
+
+def create_small_multiples(series_by_device: dict, output_path: str,
+                           start_time: datetime.datetime, end_time: datetime.datetime,
+                           title: str) -> bool:
     """
     全デバイスの温度・湿度をスモールマルチプル（行=デバイス、列=温度/湿度）で
-    1枚の画像に描画する。
+    1枚の画像に描画する（週次レポート・report サブコマンド共通）。
 
     設置場所ごとに平常時のレンジが異なるため、Y軸はパネルごとに独立させる
     （重ね書きにしない・共通Y軸にしないのは要件による設計判断）。
     グラフ内の文字は、日本語フォントの無い環境での文字化けを防ぐため英語のみ。
+    系列は fetch_all_series の配列。集計された点（時間別集計・集計行）は、平均の線の周りに最小〜最大を帯で描く。
+    X軸の目盛りは期間の長さに合わせて 時刻 / 月日 / 年月 を切り替える。
+    線は1ピクセル未満の折れ曲がりをまとめて描く（path.simplify）。見た目は変わらず描画が軽くなる。
     """
     # matplotlibはコレクターでしか使わないため、ここでimportする。
     # Aggバックエンドは画面の無い環境（systemd実行）用
@@ -531,44 +1898,62 @@ def create_weekly_graph(readings_by_device: dict, output_path: str,
     matplotlib.use('Agg')
     import matplotlib.pyplot as plt
     import matplotlib.dates as mdates
+    import numpy as np
+
+    span_days = (end_time - start_time).total_seconds() / 86400
+    date_format = '%m/%d %H:%M' if span_days <= 2 else '%m/%d' if span_days <= 90 else '%Y/%m'
+    started = time.monotonic()
 
     try:
-        device_ids = sorted(readings_by_device.keys())
-        n_devices = len(device_ids)
-        fig, axes = plt.subplots(
-            n_devices, 2,
-            figsize=(12, 2.6 * n_devices + 0.8),
-            squeeze=False, sharex=True,
-        )
+        with matplotlib.rc_context({'path.simplify': True, 'path.simplify_threshold': 1.0,
+                                    'agg.path.chunksize': 10000}):
+            device_ids = sorted(series_by_device.keys())
+            n_devices = len(device_ids)
+            fig_height = 2.6 * n_devices + 0.8
+            fig, axes = plt.subplots(
+                n_devices, 2,
+                figsize=(12, fig_height),
+                squeeze=False, sharex=True,
+            )
 
-        for row_index, device_id in enumerate(device_ids):
-            rows = readings_by_device[device_id]
-            times = [parse_timestamp(r[0]) for r in rows]
-            temperatures = [r[1] for r in rows]
-            humidities = [r[2] for r in rows]
-
-            temp_ax = axes[row_index][0]
-            temp_ax.plot(times, temperatures, color='tab:red', linewidth=0.9)
-            temp_ax.set_title(f"{device_id} - Temperature (C)", fontsize=10)
-            temp_ax.grid(True, alpha=0.4)
-
-            humid_ax = axes[row_index][1]
-            humid_ax.plot(times, humidities, color='tab:blue', linewidth=0.9)
-            humid_ax.set_title(f"{device_id} - Humidity (%)", fontsize=10)
-            humid_ax.grid(True, alpha=0.4)
-
-            for ax in (temp_ax, humid_ax):
-                ax.set_xlim([start_time, end_time])
-                ax.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d'))
-
-        fig.suptitle(
-            f"Weekly Report  {start_time:%Y-%m-%d} - {end_time:%Y-%m-%d}",
-            fontsize=13,
-        )
-        fig.tight_layout(rect=[0, 0, 1, 0.97])
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        fig.savefig(output_path, dpi=110)
-        plt.close(fig)
+            for row_index, device_id in enumerate(device_ids):
+                series = series_by_device[device_id]
+                times = series['ts']
+                # 最小と最大が平均と一致する（1点ずつの測定行だけ）なら帯は描かない
+                has_range = bool(np.any(series['temp_min'] != series['temp_max'])
+                                 or np.any(series['humid_min'] != series['humid_max']))
+
+                temp_ax = axes[row_index][0]
+                if has_range:
+                    temp_ax.fill_between(times, series['temp_min'], series['temp_max'],
+                                         color='tab:red', alpha=0.2, linewidth=0)
+                temp_ax.plot(times, series['temperature'], color='tab:red', linewidth=0.9)
+                temp_ax.set_title(f"{device_id} - Temperature (C)", fontsize=10)
+                temp_ax.grid(True, alpha=0.4)
+
+                humid_ax = axes[row_index][1]
+                if has_range:
+                    humid_ax.fill_between(times, series['humid_min'], series['humid_max'],
+                                          color='tab:blue', alpha=0.2, linewidth=0)
+                humid_ax.plot(times, series['humidity'], color='tab:blue', linewidth=0.9)
+                humid_ax.set_title(f"{device_id} - Humidity (%)", fontsize=10)
+                humid_ax.grid(True, alpha=0.4)
+
+                for ax in (temp_ax, humid_ax):
+                    ax.set_xlim([start_time, end_time])
+                    ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=8))
+                    ax.xaxis.set_major_formatter(mdates.DateFormatter(date_format))
+
+            fig.suptitle(title, fontsize=13, y=1 - 0.15 / fig_height)
+            # 余白は tight_layout で文字の大きさを測って決めると、パネル数に比例して時間がかかる
+            # （描画時間の大半を占めていた）。レイアウトは固定なので、インチ単位の余白を直接指定する
+            fig.subplots_adjust(left=0.6 / 12, right=1 - 0.2 / 12,
+                                bottom=0.45 / fig_height, top=1 - 0.75 / fig_height,
+                                hspace=0.45 / 2.15, wspace=0.6 / 5.6)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            fig.savefig(output_path, dpi=110)
+            plt.close(fig)
+        logger.info(f"グラフを描画しました: {n_devices}デバイス (描画 {time.monotonic() - started:.2f}秒)")
         return True
 
     except Exception as e:
@@ -577,11 +1962,32 @@ def create_weekly_graph(readings_by_device: dict, output_path: str,
         return False
 
 
-def build_weekly_comment(conn: sqlite3.Connection, device_ids_with_data: list,
+def create_weekly_graph(series_by_device: dict, output_path: str,
+                        start_time: datetime.datetime, end_time: datetime.datetime) -> bool:
+    """週次レポートのグラフを描く"""
+    return create_small_multiples(
+        series_by_device, output_path, start_time, end_time,
+        f"Weekly Report  {start_time:%Y-%m-%d} - {end_time:%Y-%m-%d}",
+    )
+
+
+def build_weekly_comment(conn: sqlite3.Connection, config: dict, device_ids_with_data: list,
                          all_device_ids: list,
                          start_time: datetime.datetime, end_time: datetime.datetime) -> str:
-    """週次レポートに添えるコメント（各デバイスの週間min/max/avgと欠測注記）を作る"""
+    """
+    週次レポートに添えるコメント（各デバイスの週間min/max/avg・受信率と欠測注記）を作る。
+
+    受信率は時間別集計の行数から求める（compute_coverage）。1日まるごとでなく数時間だけ
+    届かなかった欠けにも気づけるよう、全体の平均と最も低いデバイスを1行目の下に書く。
+    """
     lines = [f"週間レポート ({start_time:%m/%d} 〜 {end_time:%m/%d})"]
+    coverage_by_device = compute_coverage(conn, config, all_device_ids, start_time, end_time)
+    if coverage_by_device:
+        average_uptime = sum(coverage.uptime for coverage in coverage_by_device.values()) / len(coverage_by_device)
+        lowest_device_id = min(coverage_by_device, key=lambda device_id: coverage_by_device[device_id].uptime)
+        lines.append(f"受信率: 全デバイス平均 {average_uptime:.1%}"
+                     + (f" / 最低 {lowest_device_id} {coverage_by_device[lowest_device_id].uptime:.1%}"
+                        if len(coverage_by_device) > 1 else ""))
 
     for device_id in all_device_ids:
         if device_id not in device_ids_with_data:
@@ -596,66 +2002,890 @@ def build_weekly_comment(conn: sqlite3.Connection, device_ids_with_data: list,
         if row is None or row[0] is None:
             lines.append(f"- {device_id}: 集計データなし")
             continue
+        coverage = coverage_by_device.get(device_id)
         lines.append(
             f"- {device_id}: 温度 {row[0]}〜{row[1]}°C (平均 {row[2]}°C), "
             f"湿度 {row[3]}〜{row[4]}% (平均 {row[5]}%)"
+            + (f", {format_coverage(coverage)}" if coverage else "")
         )
     return "\n".join(lines)
 
 
-def run_weekly_report(base_dir: str, slack: SlackSender) -> None:
-    """weekly-report サブコマンド本体"""
-    conn = open_database(base_dir)
-    try:
-        end_time = datetime.datetime.now()
-        start_time = end_time - datetime.timedelta(days=7)
+def post_weekly_report(conn: sqlite3.Connection, base_dir: str,
+                       rollup_after_days: float = DEFAULT_ROLLUP_AFTER_DAYS) -> None:
+    """週次グラフを作って投稿する（weekly-report サブコマンドと serve の共通部分）"""
+    end_time = datetime.datetime.now()
+    start_time = end_time - datetime.timedelta(days=7)
 
-        # 最新の集計をコメントに使えるよう、レポート前に日次集計を更新しておく
-        update_daily_summary(conn)
+    # 最新の集計をコメントに使えるよう、レポート前に日次集計を更新しておく
+    update_daily_summary(conn)
 
-        all_device_ids = get_all_device_ids(conn)
-        if not all_device_ids:
-            slack.post_message("週間レポート: データが1件もありません。システムの状態を確認してください。")
-            logger.warning("週次レポート: DBにデータがありません")
-            return
+    all_device_ids = get_all_device_ids(conn)
+    if not all_device_ids:
+        enqueue_slack(conn, 'message', "週間レポート: データが1件もありません。システムの状態を確認してください。")
+        conn.commit()
+        logger.warning("週次レポート: DBにデータがありません")
+        return
 
-        # 期間内のデータをデバイスごとに取得する
-        readings_by_device = {}
-        for device_id in all_device_ids:
-            rows = conn.execute(
-                "SELECT timestamp, temperature, humidity FROM readings "
-                "WHERE device_id = ? AND timestamp >= ? ORDER BY timestamp",
-                (device_id, start_time.strftime('%Y-%m-%d %H:%M:%S')),
-            ).fetchall()
-            if rows:
-                readings_by_device[device_id] = rows
+    # 期間内の全デバイスのデータを1回のクエリで取得する
+    readings_by_device = fetch_all_series(conn, all_device_ids, start_time, end_time,
+                                          rollup_after_days)
 
-        if not readings_by_device:
-            slack.post_message("週間レポート: 今週のデータがありません。全デバイスの状態を確認してください。")
-            logger.warning("週次レポート: 期間内のデータがありません")
-            return
+    if not readings_by_device:
+        enqueue_slack(conn, 'message', "週間レポート: 今週のデータがありません。全デバイスの状態を確認してください。")
+        conn.commit()
+        logger.warning("週次レポート: 期間内のデータがありません")
+        return
+
+    # グラフ画像はNAS上の月別フォルダにアーカイブとして直接生成する
+    output_path = os.path.join(
+        base_dir, 'reports', 'weekly',
+        f"{end_time:%Y-%m}", f"weekly_{end_time:%Y%m%d}.png",
+    )
+    if not create_weekly_graph(readings_by_device, output_path, start_time, end_time):
+        return
+
+    comment = build_weekly_comment(
+        conn, load_config(base_dir), list(readings_by_device.keys()), all_device_ids,
+        start_time, end_time)
+    enqueue_slack(conn, 'file', comment, file_path=output_path, title="Weekly Report")
+    conn.commit()
+    logger.info(f"週次レポートを送信キューに入れました: {output_path}")
+
+
+def run_weekly_report(base_dir: str, slack: SlackSender, local_db: str = None,
+                      rollup_after_days: float = DEFAULT_ROLLUP_AFTER_DAYS) -> None:
+    """weekly-report サブコマンド本体（旧形式のDBの移行中は何もしない。open_database 参照）"""
+    with database_session(base_dir, local_db, migrate_old_layout=False) as conn:
+        post_weekly_report(conn, base_dir, rollup_after_days)
+        deliver_outbox(conn, slack, OUTBOX_DELIVERY_BUDGET_SEC)
+
+
+# =============================================================================
+# report: 任意期間のグラフ
+# =============================================================================
+
+def run_report(base_dir: str, start_time: datetime.datetime, end_time: datetime.datetime,
+               device_ids: list = None, output_path: str = None, local_db: str = None,
+               rollup_after_days: float = DEFAULT_ROLLUP_AFTER_DAYS) -> None:
+    """
+    report サブコマンド本体。指定期間・デバイスのグラフを週次レポートと同じレイアウトで画像にする。
+
+    「room246 の直近3か月」「NAS移行のあった7月の全部屋」のような確認用。Slackには送らず、
+    画像を reports/adhoc/ （または output_path）に保存してパスを表示する。DBには書き込まない。
+    各系列はグラフの横幅（GRAPH_PANEL_PIXELS）に収まるよう downsample_min_max で間引くので、
+    10デバイス×1年でもコレクターPiで数秒で描ける（長い期間は時間別集計から読む）。
+    """
+    started = time.monotonic()
+    with database_session(base_dir, local_db, publish=False, migrate_old_layout=False) as conn:
+        known_device_ids = get_all_device_ids(conn)
+        unknown = [device_id for device_id in device_ids or [] if device_id not in known_device_ids]
+        if unknown:
+            logger.error(
+                f"DBに記録の無いデバイスが指定されています: {', '.join(unknown)}\n"
+                f"  記録のあるデバイス: {', '.join(known_device_ids) or '（なし）'}"
+            )
+            raise SystemExit(1)
 
-        # グラフ画像はNAS上の月別フォルダにアーカイブとして直接生成する
+        device_ids = device_ids or known_device_ids
+        series_by_device = fetch_all_series(conn, device_ids, start_time, end_time,
+                                            rollup_after_days, max_points=GRAPH_PANEL_PIXELS)
+    for device_id in device_ids:
+        if device_id not in series_by_device:
+            logger.warning(f"{device_id}: 期間内のデータがありません")
+            continue
+        series = series_by_device[device_id]
+        series_by_device[device_id] = downsample_min_max(series, start_time, end_time)
+        logger.debug(f"{device_id}: {len(series)}点 → {len(series_by_device[device_id])}点")
+
+    if not series_by_device:
+        logger.warning("期間内のデータがありません。グラフは作成しません")
+        return
+
+    if output_path is None:
         output_path = os.path.join(
-            base_dir, 'reports', 'weekly',
-            f"{end_time:%Y-%m}", f"weekly_{end_time:%Y%m%d}.png",
+            base_dir, 'reports', 'adhoc',
+            f"report_{start_time:%Y%m%d%H%M}_{end_time:%Y%m%d%H%M}.png",
         )
-        if not create_weekly_graph(readings_by_device, output_path, start_time, end_time):
+    title = f"Report  {start_time:%Y-%m-%d %H:%M} - {end_time:%Y-%m-%d %H:%M}"
+    if not create_small_multiples(series_by_device, output_path, start_time, end_time, title):
+        raise SystemExit(1)
+    logger.info(f"レポートを作成しました: {output_path} （合計 {time.monotonic() - started:.1f}秒）")
+
+
+def parse_report_time(text: str, is_end: bool = False) -> datetime.datetime:
+    """
+    report の --from / --to を読む（'YYYY-MM-DD' / 'YYYY-MM-DD HH:MM' / 'YYYY-MM-DD HH:MM:SS'）。
+
+    --to に日付だけを書いた場合はその日の終わりまで（翌日0時）とする（--to 2026-07-31 で7月31日を含む）。
+    """
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            return datetime.datetime.strptime(text, time_format)
+        except ValueError:
+            pass
+    day = datetime.datetime.strptime(text, '%Y-%m-%d')
+    return day + datetime.timedelta(days=1) if is_end else day
+
+
+# =============================================================================
+# simulate: 許容範囲・アラート設定の試算
+# =============================================================================
+
+def _apply_cooldown(times, cooldown_sec: float):
+    """
+    発報の候補時刻（昇順）から、クールダウンで止められずに送られるものの添字を返す。
+
+    is_cooldown_passed と同じく、前回の送信から cooldown_sec 秒を「超えた」候補だけが送られる。
+    繰り返しの回数は送られる件数だけなので、候補が多くても速い。
+    """
+    import numpy as np
+    sent = []
+    index = 0
+    while index < len(times):
+        sent.append(index)
+        index = int(np.searchsorted(times, times[index] + cooldown_sec, side='right'))
+    return np.array(sent, dtype=np.int64)
+
+
+def _simulate_range_alerts(ts, values, low: float, high: float, max_gap_sec: int,
+                           heartbeat_minutes: float, end_ts: int, cooldown_sec: float):
+    """
+    1デバイス・1項目の範囲逸脱アラートを配列で再現する（check_range_alerts と同じ判定）。
+
+      - 連続する2行が両方とも下限未満、または両方とも上限超過で、間隔が max_gap_sec 以下
+        → 新しい方の行の時刻に発報
+      - 間引きモードでは、範囲外の行の後に2測定間隔以上行が来なければ、値が保たれたとみなして
+        その行の2測定間隔後に発報
+
+    Returns:
+        (発報時刻の配列, その時刻の値の配列)。クールダウン適用後
+    """
+    import numpy as np
+    below = values < low
+    above = values > high
+    pairs = (((below[1:] & below[:-1]) | (above[1:] & above[:-1]))
+             & (np.diff(ts) <= max_gap_sec))
+    times = ts[1:][pairs]
+    alert_values = values[1:][pairs]
+    if heartbeat_minutes:
+        held_sec = 2 * READING_INTERVAL_MINUTES * 60
+        next_ts = np.append(ts[1:], end_ts)
+        # ちょうど2測定間隔後に次の行が届いていれば、保持とはみなさない（判定のときには次の行が最新になっている）
+        held = (below | above) & (next_ts - ts > held_sec)
+        times = np.concatenate([times, ts[held] + held_sec])
+        alert_values = np.concatenate([alert_values, values[held]])
+        order = np.argsort(times, kind='stable')
+        times, alert_values = times[order], alert_values[order]
+    sent = _apply_cooldown(times, cooldown_sec)
+    return times[sent], alert_values[sent]
+
+
+def _simulate_missing_alerts(ts, missing_sec: float, end_ts: int):
+    """
+    1デバイスの欠測アラートを再現する（check_missing_data_alerts と同じ判定）。
+
+    行と行の間（最後の行の後は期間の終わりまで）が missing_sec 以上空いたら、空き始めから
+    missing_sec 後に発報し、その後も届かなければ24時間（のクールダウン）を過ぎた次の判定
+    （ingest のタイマーの間隔 READING_INTERVAL_MINUTES ごと）で発報する。
+
+    Returns:
+        (発報時刻の配列, その時点で最後に届いていた行の時刻の配列)
+    """
+    import numpy as np
+    next_ts = np.append(ts[1:], end_ts)
+    gap_indexes = np.flatnonzero(next_ts - ts >= missing_sec)
+    repeat_sec = 24 * 3600 + READING_INTERVAL_MINUTES * 60
+    times, last_seen = [], []
+    last_sent = -np.inf
+    # 欠測の区間ごとに回す（区間の数だけなので、1年分でも少ない）
+    for index in gap_indexes:
+        alert_ts = max(ts[index] + missing_sec, last_sent + repeat_sec)
+        while alert_ts < next_ts[index]:
+            times.append(alert_ts)
+            last_seen.append(ts[index])
+            last_sent = alert_ts
+            alert_ts = last_sent + repeat_sec
+    return np.array(times, dtype=np.int64), np.array(last_seen, dtype=np.int64)
+
+
+def simulate_alerts(series_by_device: dict, config: dict, start_ts: int, end_ts: int) -> dict:
+    """
+    履歴データに設定 config のアラート判定を当てはめて、送られたはずのアラートを再現する。
+
+    Returns:
+        {デバイスID: [(発報時刻の ts, アラート種別, 内容), ...]}（時刻順。期間 start_ts〜end_ts の分だけ）
+
+    時刻は判定のもとになった行の時刻（実際の通知はその後の取り込み・判定のとき）。
+    多数のデバイスで同時に起きたときの障害通知へのまとめ（_AlertBatch）は再現せず、デバイスごとの発報として数える。
+    """
+    alerts_by_device = {}
+    for device_id, series in series_by_device.items():
+        ts = series['ts'].astype('int64')
+        alerts = []
+        heartbeat_minutes = get_setting(config, device_id, 'heartbeat_minutes') or 0
+        max_gap_sec = max(MAX_PAIR_GAP_MINUTES, heartbeat_minutes + READING_INTERVAL_MINUTES) * 60
+        cooldown_sec = get_setting(config, device_id, 'alert_cooldown_hours') * 3600
+        for setting_key, column, label, unit in (('temp_range', 'temperature', '温度', '°C'),
+                                                 ('humid_range', 'humidity', '湿度', '%')):
+            allowed = get_setting(config, device_id, setting_key)
+            if not allowed:
+                continue
+            low, high = allowed[0], allowed[1]
+            times, values = _simulate_range_alerts(ts, series[column], low, high, max_gap_sec,
+                                                   heartbeat_minutes, end_ts, cooldown_sec)
+            alerts.extend(
+                (int(alert_ts), setting_key,
+                 f"{label}が{'高すぎ' if value > high else '低すぎ'} {value:g}{unit}")
+                for alert_ts, value in zip(times, values)
+            )
+
+        missing_hours = get_setting(config, device_id, 'missing_data_hours')
+        if heartbeat_minutes:
+            missing_hours = max(missing_hours, 2 * heartbeat_minutes / 60)
+        times, last_seen = _simulate_missing_alerts(ts, missing_hours * 3600, end_ts)
+        alerts.extend(
+            (int(alert_ts), 'missing', f"欠測（{from_epoch(int(seen_ts))[5:16].replace('-', '/')} から）")
+            for alert_ts, seen_ts in zip(times, last_seen)
+        )
+        # 期間の前の余裕ぶん（SIMULATE_WARMUP_HOURS）は、クールダウンの状態を作るためだけに使う
+        alerts_by_device[device_id] = sorted(alert for alert in alerts if alert[0] >= start_ts)
+    return alerts_by_device
+
+
+def _print_alert_comparison(device_ids: list, current: dict, candidate: dict) -> None:
+    """現在の設定と候補の設定のアラートを、デバイスごとの件数と時刻で並べて表示する"""
+    kinds = [('temp_range', '温度'), ('humid_range', '湿度'), ('missing', '欠測')]
+    # 全角の見出しは表示幅が2倍なので、桁はその分を見込んで揃える
+    print(f"{'デバイス':<12}" + ''.join(f" {label} 現在→候補" for _, label in kinds))
+    totals = collections.Counter()
+    for device_id in device_ids:
+        columns = []
+        for kind, _ in kinds:
+            current_count = sum(1 for alert in current.get(device_id, []) if alert[1] == kind)
+            candidate_count = sum(1 for alert in candidate.get(device_id, []) if alert[1] == kind)
+            totals[kind, 'current'] += current_count
+            totals[kind, 'candidate'] += candidate_count
+            columns.append(f"{current_count:>9} → {candidate_count:<4}")
+        print(f"{device_id:<16}" + ''.join(columns))
+    print(f"{'合計':<14}" + ''.join(
+        f"{totals[kind, 'current']:>9} → {totals[kind, 'candidate']:<4}" for kind, _ in kinds))
+
+    for device_id in device_ids:
+        current_alerts = set(current.get(device_id, []))
+        candidate_alerts = set(candidate.get(device_id, []))
+        if not current_alerts and not candidate_alerts:
+            continue
+        print(f"\n[{device_id}] {'現在の設定':<41}候補の設定")
+        events = sorted(current_alerts | candidate_alerts)
+        for alert in events[:SIMULATE_MAX_LISTED_ALERTS]:
+            alert_ts, _, description = alert
+            line = f"{from_epoch(alert_ts)[:16]} {description}"
+            left = line if alert in current_alerts else '-'
+            right = line if alert in candidate_alerts else '-'
+            print(f"  {left:<45}{right}")
+        if len(events) > SIMULATE_MAX_LISTED_ALERTS:
+            print(f"  （他{len(events) - SIMULATE_MAX_LISTED_ALERTS}件）")
+
+
+def run_simulate(base_dir: str, candidate_config_path: str, start_time: datetime.datetime,
+                 end_time: datetime.datetime, device_ids: list = None, local_db: str = None) -> None:
+    """
+    simulate サブコマンド本体。許容範囲などを変えたら、過去のデータでアラートがどう変わったかを試算する。
+
+    期間内（と、クールダウンの状態を作るための手前 SIMULATE_WARMUP_HOURS 時間）の生データを
+    1回のクエリで NumPy の配列に読み、現在の thresholds.yaml と候補の設定ファイルのそれぞれで、
+    範囲逸脱（2連続・間隔の上限・間引きモードの保持）と欠測の判定をクールダウン込みで配列演算で再現し、
+    デバイスごとの件数と時刻を並べて表示する。Slackには送らず、DBにも書き込まない。
+    """
+    started = time.monotonic()
+    current_config = load_config(base_dir)
+    candidate_config = load_config_file(candidate_config_path)
+    warmup_start = start_time - datetime.timedelta(hours=SIMULATE_WARMUP_HOURS)
+    with database_session(base_dir, local_db, publish=False, migrate_old_layout=False) as conn:
+        known_device_ids = get_all_device_ids(conn)
+        unknown = [device_id for device_id in device_ids or [] if device_id not in known_device_ids]
+        if unknown:
+            logger.error(
+                f"DBに記録の無いデバイスが指定されています: {', '.join(unknown)}\n"
+                f"  記録のあるデバイス: {', '.join(known_device_ids) or '（なし）'}"
+            )
+            raise SystemExit(1)
+        device_ids = device_ids or known_device_ids
+        # 判定は1点ずつの値で行うので、長い期間でも時間別集計ではなく生データを読む
+        series_by_device = fetch_all_series(conn, device_ids, warmup_start, end_time,
+                                            rollup_after_days=float('inf'))
+
+    start_ts = to_epoch(start_time.strftime('%Y-%m-%d %H:%M:%S'))
+    end_ts = to_epoch(end_time.strftime('%Y-%m-%d %H:%M:%S'))
+    loaded = time.monotonic()
+    current = simulate_alerts(series_by_device, current_config, start_ts, end_ts)
+    candidate = simulate_alerts(series_by_device, candidate_config, start_ts, end_ts)
+    logger.info(f"アラートを再現しました: {len(series_by_device)}デバイス "
+                f"(読み込み {loaded - started:.1f}秒, 判定 {time.monotonic() - loaded:.1f}秒)")
+
+    print(f"===== アラートの試算 ({start_time:%Y-%m-%d %H:%M} 〜 {end_time:%Y-%m-%d %H:%M}) =====")
+    print(f"現在: {os.path.join(base_dir, CONFIG_RELATIVE_PATH)}")
+    print(f"候補: {candidate_config_path}")
+    for device_id in device_ids:
+        if device_id not in series_by_device:
+            print(f"  {device_id}: 期間内のデータがありません（欠測アラートは数えません）")
+    _print_alert_comparison([device_id for device_id in device_ids if device_id in series_by_device],
+                            current, candidate)
+
+
+# =============================================================================
+# coverage: データの受信率・欠け
+# =============================================================================
+
+# summarize_coverage の結果。uptime は受信率（0〜1）、received / expected は行数、
+# gaps は行が1つも無かった区間 (始まりの ts, 終わりの ts) のリスト
+Coverage = collections.namedtuple('Coverage', 'uptime received expected gaps')
+
+
+def fetch_hourly_counts(conn: sqlite3.Connection, device_ids: list,
+                        start_ts: int, end_ts: int) -> dict:
+    """
+    指定デバイスの期間内の1時間ごとの行数を、時間別集計（hourly_rollup）から1回のクエリで読む。
+
+    Returns:
+        {デバイスID: {1時間の始まりの ts: 行数}}。行の無い時間は含まない
+
+    hourly_rollup は取り込みのたびに更新されているので、これが「デバイス×1時間の受信数」の索引になる。
+    読む行数はデバイス×時間の数まで（1年で1デバイス8760行）で、samples は読まない。
+    """
+    placeholders = ', '.join('?' * len(device_ids))
+    counts = {device_id: {} for device_id in device_ids}
+    # CROSS JOIN で device_keys を外側に固定し、デバイスごとに主キーの範囲検索にする
+    for device_id, hour_ts, row_count in conn.execute(
+            "SELECT k.device_id, r.hour_ts, r.row_count "
+            "FROM device_keys k CROSS JOIN hourly_rollup r "
+            "  ON r.device_key = k.device_key AND r.hour_ts >= ? AND r.hour_ts < ? "
+            f"WHERE k.device_id IN ({placeholders})",
+            (start_ts, end_ts, *device_ids)):
+        counts[device_id][hour_ts] = row_count
+    return counts
+
+
+def summarize_coverage(hour_counts: dict, start_ts: int, end_ts: int,
+                       heartbeat_minutes: float = None) -> Coverage:
+    """
+    1デバイスの1時間ごとの行数から、期間内の受信率と欠け（行が1つも無い区間）を求める。
+
+    想定する行数は測定間隔（READING_INTERVAL_MINUTES）ごとに1行。間引きモードのデバイスは
+    値が動かなければハートビートごとにしか行が来ないので、ハートビート1回ぶんの時間に1行とし、
+    それより短い欠けは数えない。想定より多く届いた時間（重複・集計行）は想定の数までで数える。
+    start_ts / end_ts は時間の区切り（3600の倍数）で渡す。
+    """
+    interval_minutes = heartbeat_minutes or READING_INTERVAL_MINUTES
+    block_hours = max(1, math.ceil(interval_minutes / 60))
+    expected_per_block = block_hours * 60 / interval_minutes
+
+    received = 0.0
+    block_count = 0
+    gaps = []
+    gap_start = None
+    for block_ts in range(start_ts, end_ts, block_hours * 3600):
+        rows = sum(hour_counts.get(hour_ts, 0)
+                   for hour_ts in range(block_ts, min(block_ts + block_hours * 3600, end_ts), 3600))
+        received += min(rows, expected_per_block)
+        block_count += 1
+        if rows == 0 and gap_start is None:
+            gap_start = block_ts
+        elif rows and gap_start is not None:
+            gaps.append((gap_start, block_ts))
+            gap_start = None
+    if gap_start is not None:
+        gaps.append((gap_start, end_ts))
+
+    expected = block_count * expected_per_block
+    return Coverage(received / expected if expected else 1.0, round(received), round(expected), gaps)
+
+
+def compute_coverage(conn: sqlite3.Connection, config: dict, device_ids: list,
+                     start_time: datetime.datetime, end_time: datetime.datetime) -> dict:
+    """
+    指定デバイスの期間内の受信率と欠けを求める（coverage サブコマンドと週次レポートの共通部分）。
+
+    Returns:
+        {デバイスID: Coverage}。期間より後に使い始めたデバイスは含まない
+
+    期間は1時間単位に切り詰める（今まさに測っている最中の1時間は数えない）。
+    デバイスを使い始める前の時間は欠けとみなさない。
+    """
+    now_ts = to_epoch(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    start_ts = to_epoch(start_time.strftime('%Y-%m-%d %H:%M:%S')) // 3600 * 3600
+    end_ts = min(to_epoch(end_time.strftime('%Y-%m-%d %H:%M:%S')), now_ts) // 3600 * 3600
+    first_seen = dict(conn.execute("SELECT device_id, first_seen FROM devices").fetchall())
+    counts_by_device = fetch_hourly_counts(conn, device_ids, start_ts, end_ts)
+
+    coverage_by_device = {}
+    for device_id in device_ids:
+        if device_id not in first_seen:
+            continue
+        device_start_ts = max(start_ts, to_epoch(first_seen[device_id]) // 3600 * 3600)
+        if device_start_ts >= end_ts:
+            continue
+        coverage_by_device[device_id] = summarize_coverage(
+            counts_by_device[device_id], device_start_ts, end_ts,
+            get_setting(config, device_id, 'heartbeat_minutes'))
+    return coverage_by_device
+
+
+def format_coverage(coverage: Coverage) -> str:
+    """受信率の1行ぶんの表記（例: 受信率 98.8%（欠け 2回・計5時間））"""
+    text = f"受信率 {coverage.uptime:.1%}"
+    if coverage.gaps:
+        gap_hours = sum(end_ts - start_ts for start_ts, end_ts in coverage.gaps) // 3600
+        text += f"（欠け {len(coverage.gaps)}回・計{gap_hours}時間）"
+    return text
+
+
+def run_coverage(base_dir: str, start_time: datetime.datetime, end_time: datetime.datetime,
+                 device_ids: list = None, local_db: str = None) -> None:
+    """
+    coverage サブコマンド本体。デバイスごとの期間内の受信率と、データの欠けた時間帯を表示する。
+
+    時間別集計（hourly_rollup）の行数を読むだけなので、数年の期間でも読む行数は
+    デバイス×時間の数まで。Slackには送らず、DBにも書き込まない。
+    """
+    with database_session(base_dir, local_db, publish=False, migrate_old_layout=False) as conn:
+        known_device_ids = get_all_device_ids(conn)
+        unknown = [device_id for device_id in device_ids or [] if device_id not in known_device_ids]
+        if unknown:
+            logger.error(
+                f"DBに記録の無いデバイスが指定されています: {', '.join(unknown)}\n"
+                f"  記録のあるデバイス: {', '.join(known_device_ids) or '（なし）'}"
+            )
+            raise SystemExit(1)
+        device_ids = device_ids or known_device_ids
+        coverage_by_device = compute_coverage(conn, load_config(base_dir), device_ids,
+                                              start_time, end_time)
+
+    print(f"===== データの受信率 ({start_time:%Y-%m-%d %H:%M} 〜 {end_time:%Y-%m-%d %H:%M}) =====")
+    for device_id in device_ids:
+        coverage = coverage_by_device.get(device_id)
+        if coverage is None:
+            print(f"  {device_id}: この期間にはまだ使われていません")
+            continue
+        print(f"  {device_id}: {format_coverage(coverage)} "
+              f"受信 {coverage.received} / 想定 {coverage.expected}行")
+        for gap_start, gap_end in coverage.gaps[:COVERAGE_MAX_LISTED_GAPS]:
+            print(f"      {from_epoch(gap_start)[:16]} 〜 {from_epoch(gap_end)[:16]}"
+                  f"（{(gap_end - gap_start) // 3600}時間）")
+        if len(coverage.gaps) > COVERAGE_MAX_LISTED_GAPS:
+            print(f"      （他{len(coverage.gaps) - COVERAGE_MAX_LISTED_GAPS}回）")
+
+
+# =============================================================================
+# serve: 常駐モード
+# =============================================================================
+
+class ConfigCache:
+    """
+    thresholds.yaml を読み込んだまま保持し、ファイルが更新されたら読み直す（serve 用）。
+
+    書き換え途中などで読めなかった場合は、エラーをログに出して前回の設定を使い続ける。
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self.config_path = os.path.join(base_dir, CONFIG_RELATIVE_PATH)
+        self._config = None
+        self._signature = None
+
+    def _current_signature(self):
+        try:
+            stat = os.stat(self.config_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self) -> dict:
+        """最新の設定を返す（前回から thresholds.yaml が変わっていれば読み直す）"""
+        signature = self._current_signature()
+        if self._config is not None and signature == self._signature:
+            return self._config
+        try:
+            config = load_config(self.base_dir)
+        except Exception as e:
+            if self._config is None:
+                raise
+            logger.error(f"設定ファイルの再読み込みに失敗しました（前の設定のまま動きます）: {e}")
+            self._signature = signature  # 直るまで毎回エラーを出さないよう、この版は読んだことにする
+            return self._config
+        if self._config is not None:
+            logger.info(f"設定ファイルを再読み込みしました: {self.config_path}")
+        self._config = config
+        self._signature = signature
+        return config
+
+
+class ChunkSettler:
+    """
+    書き込み途中のチャンクを取り込まないための判定（serve 用。ingest_incoming_files の file_filter）。
+
+    センサーPiはNAS上のファイルに直接書き込むので、届いた直後のファイルはまだ書きかけのことがある。
+    サイズと更新時刻が SERVE_SETTLE_SEC 秒以上変わっていないファイルだけを「届き終わった」とみなす。
+    更新時刻を現在時刻と比べないのは、NASとコレクターPiの時計がずれていても判定が狂わないようにするため。
+    """
+
+    def __init__(self, settle_sec: float = None):
+        self.settle_sec = SERVE_SETTLE_SEC if settle_sec is None else settle_sec
+        self._lock = threading.Lock()  # 読み込みスレッドから並行して呼ばれる
+        self._seen = {}  # パス → ((サイズ, 更新時刻), その状態を最初に見た time.monotonic())
+
+    def __call__(self, file_path: str) -> bool:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_size, stat.st_mtime_ns)
+        now = time.monotonic()
+        with self._lock:
+            previous = self._seen.get(file_path)
+            if previous is None or previous[0] != signature:
+                self._seen[file_path] = (signature, now)
+                return False
+            return now - previous[1] >= self.settle_sec
+
+    def forget_missing(self) -> None:
+        """取り込み済み（削除・退避された）ファイルの記録を捨てる"""
+        with self._lock:
+            for file_path in [path for path in self._seen if not os.path.exists(path)]:
+                del self._seen[file_path]
+
+
+# inotify(7) の定数（<sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class _Inotify:
+    """libc の inotify を ctypes で呼ぶ最小限のラッパー（Linux専用。使えなければ OSError）"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(f"{libc_name} に inotify がありません")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number))
+        self.watched = set()
+
+    def add_watch(self, path: str, mask: int) -> None:
+        if path in self.watched:
             return
+        if self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number), path)
+        self.watched.add(path)
+
+    def read_events(self, timeout: float) -> list:
+        """timeout 秒までイベントを待ち、(mask, 名前) のリストを返す（来なければ空）"""
+        readable, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + INOTIFY_EVENT_HEADER.size <= len(data):
+            _, mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0').decode(errors='replace')
+            offset += name_length
+            events.append((mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class IncomingWatcher:
+    """
+    incoming/ に新しいチャンクが届くのを待つ（serve 用）。
 
-        comment = build_weekly_comment(
-            conn, list(readings_by_device.keys()), all_device_ids, start_time, end_time)
-        if slack.upload_file(output_path, "Weekly Report", comment):
-            logger.info(f"週次レポートを送信しました: {output_path}")
-    finally:
-        conn.close()
+    - inotify: 変化があればすぐ分かる。ただしSMBなどのネットワーク共有では、他のPCが書いた
+      ファイルのイベントは届かないことがある（このPi自身の書き込みしか見えない）
+    - poll: poll_interval 秒ごとに incoming/ を見て、チャンクが残っていれば知らせる
+    mode が 'auto' なら両方を使う（inotify で届いたものはすぐ、届かないものも poll で拾う）。
+    inotify が使えない環境では poll だけになる。
+    """
+
+    def __init__(self, base_dir: str, mode: str = 'auto', poll_interval: float = None):
+        self.base_dir = base_dir
+        self.incoming_dir = os.path.join(base_dir, 'incoming')
+        self.poll_interval = DEFAULT_SERVE_POLL_SEC if poll_interval is None else poll_interval
+        self.use_poll = mode in ('auto', 'poll')
+        self._next_poll = time.monotonic() + self.poll_interval
+        self._inotify = None
+        if mode in ('auto', 'inotify'):
+            try:
+                self._inotify = _Inotify()
+                os.makedirs(self.incoming_dir, exist_ok=True)
+                self._watch_tree()
+            except OSError as e:
+                if mode == 'inotify':
+                    raise
+                logger.warning(f"inotify が使えないため、{self.poll_interval:g}秒ごとの確認だけで動きます: {e}")
+                if self._inotify is not None:
+                    self._inotify.close()
+                self._inotify = None
+        logger.info(
+            f"incoming/ の監視を開始しました（inotify: {'あり' if self._inotify else 'なし'}, "
+            f"定期確認: {f'{self.poll_interval:g}秒ごと' if self.use_poll else 'なし'}）"
+        )
+
+    def _watch_tree(self) -> None:
+        """incoming/ と、その下の各デバイスのフォルダを監視対象にする（新しいフォルダも随時追加）"""
+        self._inotify.add_watch(self.incoming_dir, IN_CREATE | IN_MOVED_TO)
+        with os.scandir(self.incoming_dir) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    self._inotify.add_watch(entry.path, IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+
+    def wait(self, timeout: float, stop_event: threading.Event) -> bool:
+        """
+        新しいチャンクが届くか timeout 秒経つか stop_event が立つまで待つ。
+
+        Returns:
+            チャンクが届いた（または incoming/ に残っている）なら True
+        """
+        deadline = time.monotonic() + timeout
+        while not stop_event.is_set():
+            now = time.monotonic()
+            if now >= deadline:
+                return False
+            # 停止要求に1秒以内に気づけるよう、待ち時間を区切る
+            wait_sec = min(deadline - now, 1.0)
+            if self.use_poll:
+                wait_sec = min(wait_sec, max(self._next_poll - now, 0))
+
+            if self._inotify is not None:
+                if self._handle_events(self._inotify.read_events(wait_sec)):
+                    return True
+            else:
+                stop_event.wait(wait_sec)
+
+            if self.use_poll and time.monotonic() >= self._next_poll:
+                self._next_poll = time.monotonic() + self.poll_interval
+                if list_incoming_files(self.base_dir):
+                    return True
+        return False
+
+    def _handle_events(self, events: list) -> bool:
+        """inotify のイベントを見て、チャンクが届いていれば True（新しいデバイスのフォルダは監視に加える）"""
+        arrived = False
+        for mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # イベントがあふれた。何が届いたか分からないので、取り込みを走らせて監視を張り直す
+                self._watch_tree()
+                return True
+            if mask & IN_ISDIR:
+                self._watch_tree()
+                arrived = True
+            elif name.endswith(('.csv', '.csv.gz')):
+                arrived = True
+        return arrived
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+
+
+def next_scheduled_time(now: datetime.datetime, at: datetime.time, weekday: int = None) -> datetime.datetime:
+    """now より後で最初の at の時刻（weekday を指定すればその曜日。0=月曜）を返す"""
+    candidate = datetime.datetime.combine(now.date(), at)
+    if weekday is not None:
+        candidate += datetime.timedelta(days=(weekday - now.weekday()) % 7)
+    while candidate <= now:
+        candidate += datetime.timedelta(days=7 if weekday is not None else 1)
+    return candidate
+
+
+def parse_schedule(text: str, with_weekday: bool = False):
+    """
+    --daily-at 'HH:MM' / --weekly-at 'Mon HH:MM' を読む。
+
+    Returns:
+        (datetime.time, 曜日 0〜6 または None)。書式が不正なら ValueError
+    """
+    weekday = None
+    if with_weekday:
+        day_name, _, text = text.strip().partition(' ')
+        weekday = WEEKDAY_NAMES.index(day_name.capitalize()[:3])
+    return datetime.datetime.strptime(text.strip(), '%H:%M').time(), weekday
+
+
+def run_serve(base_dir: str, slack: SlackSender, local_db: str = None,
+              workers: int = DEFAULT_INGEST_WORKERS,
+              rollup_after_days: float = DEFAULT_ROLLUP_AFTER_DAYS,
+              watch_mode: str = 'auto', poll_interval: float = DEFAULT_SERVE_POLL_SEC,
+              daily_at: str = DEFAULT_DAILY_AT, weekly_at: str = DEFAULT_WEEKLY_AT) -> None:
+    """
+    serve サブコマンド本体。ingest / daily / weekly-report のタイマーの代わりに常駐する。
+
+    DB接続と thresholds.yaml（更新されたら読み直す）を持ったまま incoming/ を監視し、
+    チャンクが届いてから数秒で取り込み・範囲逸脱アラートの判定を行う。
+    欠測アラートは SERVE_ALERT_CHECK_SEC 秒ごとに判定し、日次・週次レポートは
+    daily_at / weekly_at の時刻に同じプロセスの中で実行する。
+    --local-db のときは、変更があれば SERVE_SNAPSHOT_INTERVAL_SEC 秒ごとと終了時に
+    NASへスナップショットを書き出す。
+    SIGTERM（systemctl stop）/ Ctrl+C で、実行中の処理を終えてから止まる。
+
+    --local-db のときは、Slackへの送信は OutboxWorker のスレッドが outbox から行うので、
+    Slackが遅い・落ちている間も取り込みは止まらない。NAS上のDBを直接使うときは書き込む接続を
+    1本に保つため、各処理の合間にこのスレッドで送る。1回に送り始めるのは SERVE_OUTBOX_BUDGET_SEC 秒までで、
+    残りと再送待ちの分は next_delivery に回して取り込みなどに戻る（Slackの応答が遅くても取り込みが止まり続けない）。
+    送れなかった分は outbox に残り、復旧後（または次の起動後）に送られる。
+
+    1つの処理が失敗しても（NASの一時的な切断など）ログに残して動き続け、
+    SERVE_ERROR_RETRY_SEC 秒後にやり直す。
+    """
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"停止要求を受け取りました（シグナル {signum}）")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    daily_time, _ = parse_schedule(daily_at)
+    weekly_time, weekly_weekday = parse_schedule(weekly_at, with_weekday=True)
+    config_cache = ConfigCache(base_dir)
+    settler = ChunkSettler()
+
+    with database_session(base_dir, local_db, publish=False) as conn:
+        watcher = IncomingWatcher(base_dir, watch_mode, poll_interval)
+        if local_db:
+            db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+            outbox_worker = OutboxWorker(db_path, slack)
+            outbox_worker.start()
+        else:
+            # NAS上のDBには書き込む接続を2本開かない（ロックが効かない）。送信もこの接続で行う
+            outbox_worker = None
+        now = datetime.datetime.now()
+        next_daily = next_scheduled_time(now, daily_time)
+        next_weekly = next_scheduled_time(now, weekly_time, weekly_weekday)
+        logger.info(f"常駐モードを開始しました（次回の日次: {next_daily:%m/%d %H:%M}, "
+                    f"週次: {next_weekly:%m/%d %H:%M}）")
+        next_ingest = time.monotonic()  # 起動時にたまっている分をまず取り込む
+        next_alert_check = time.monotonic() + SERVE_ALERT_CHECK_SEC
+        next_snapshot = time.monotonic() + SERVE_SNAPSHOT_INTERVAL_SEC
+        next_delivery = time.monotonic()  # 前回送り残した分があれば送る（送信スレッドを使わないとき）
+        has_unpublished_changes = False
+
+        def run_step(description: str, func) -> bool:
+            """1つの処理を実行する。失敗してもログに残して常駐は続ける"""
+            nonlocal next_delivery
+            if outbox_worker is None:
+                # キューに入った通知があればすぐ送る（deliver 自身は実行中に次の送信時刻で上書きする）
+                next_delivery = time.monotonic()
+            try:
+                func()
+                # キューに入った通知があればすぐ送らせる
+                if outbox_worker is not None:
+                    outbox_worker.notify()
+                return True
+            except Exception as e:
+                logger.error(f"{description}に失敗しました（{SERVE_ERROR_RETRY_SEC}秒後にやり直します）: {e}")
+                traceback.print_exc()
+                if conn.in_transaction:
+                    conn.rollback()
+                return False
+
+        def deliver() -> None:
+            nonlocal next_delivery
+            # 送り切るまで続けると、Slackの応答が遅いときに取り込みが止まるので、持ち時間で区切る
+            wait_sec = deliver_outbox(conn, slack, SERVE_OUTBOX_BUDGET_SEC, stop_event, wait_for_retry=False)
+            next_delivery = None if wait_sec is None else time.monotonic() + wait_sec
+
+        def ingest() -> None:
+            nonlocal has_unpublished_changes
+            if ingest_and_check_alerts(conn, base_dir, config_cache.get(), workers, settler):
+                has_unpublished_changes = True
+
+        try:
+            while not stop_event.is_set():
+                if next_ingest is not None and time.monotonic() >= next_ingest:
+                    next_ingest = None
+                    if run_step("取り込み", ingest):
+                        settler.forget_missing()
+                        # 書き込み途中で後回しにしたファイルが残っていれば、落ち着くのを待って取り込み直す
+                        if list_incoming_files(base_dir):
+                            next_ingest = time.monotonic() + settler.settle_sec
+                    else:
+                        next_ingest = time.monotonic() + SERVE_ERROR_RETRY_SEC
+
+                if time.monotonic() >= next_alert_check:
+                    # データが届かなくなったデバイスは、ファイルが来ないので取り込みの契機が無い
+                    run_step("欠測アラートの判定", lambda: check_missing_data_alerts(
+                        conn, config_cache.get(), datetime.datetime.now()))
+                    next_alert_check = time.monotonic() + SERVE_ALERT_CHECK_SEC
+
+                now = datetime.datetime.now()
+                if now >= next_daily:
+                    if run_step("日次レポート", lambda: post_daily_report(conn)):
+                        next_daily = next_scheduled_time(now, daily_time)
+                    else:
+                        next_daily = now + datetime.timedelta(seconds=SERVE_ERROR_RETRY_SEC)
+                    has_unpublished_changes = True
+                if now >= next_weekly:
+                    if run_step("週次レポート", lambda: post_weekly_report(
+                            conn, base_dir, rollup_after_days)):
+                        next_weekly = next_scheduled_time(now, weekly_time, weekly_weekday)
+                    else:
+                        next_weekly = now + datetime.timedelta(seconds=SERVE_ERROR_RETRY_SEC)
+                    has_unpublished_changes = True
+
+                if (outbox_worker is None and next_delivery is not None
+                        and time.monotonic() >= next_delivery):
+                    next_delivery = None
+                    if not run_step("Slack送信キューの処理", deliver):
+                        next_delivery = time.monotonic() + OUTBOX_RETRY_BASE_SEC
+
+                if local_db and has_unpublished_changes and time.monotonic() >= next_snapshot:
+                    if publish_snapshot(conn, base_dir):
+                        has_unpublished_changes = False
+                    next_snapshot = time.monotonic() + SERVE_SNAPSHOT_INTERVAL_SEC
+
+                # 次にやることの時刻まで、incoming/ を見張りながら待つ
+                deadlines = [next_alert_check, time.monotonic() + (
+                    min(next_daily, next_weekly) - datetime.datetime.now()).total_seconds()]
+                if next_ingest is not None:
+                    deadlines.append(next_ingest)
+                if outbox_worker is None and next_delivery is not None:
+                    deadlines.append(next_delivery)
+                if local_db and has_unpublished_changes:
+                    deadlines.append(next_snapshot)
+                if watcher.wait(max(min(deadlines) - time.monotonic(), 0), stop_event):
+                    # 続けて届くファイルをまとめて取り込めるよう、少し待ってから取り込む
+                    if next_ingest is None:
+                        next_ingest = time.monotonic() + settler.settle_sec
+        finally:
+            watcher.close()
+            if outbox_worker is not None:
+                outbox_worker.stop(SLACK_TIMEOUT_SEC)
+            if local_db and has_unpublished_changes:
+                publish_snapshot(conn, base_dir)
+            logger.info("常駐モードを終了しました")
 
 
 # =============================================================================
 # エントリポイント
 # =============================================================================
 
-def run_status(base_dir: str) -> None:
+def run_status(base_dir: str, local_db: str = None) -> None:
     """
     各デバイスの受信状況を画面に表示する（読み取り専用の動作確認コマンド）。
 
@@ -666,21 +2896,15 @@ def run_status(base_dir: str) -> None:
     print(f"===== 受信状況 ({now.strftime('%Y-%m-%d %H:%M:%S')}) =====")
 
     # DBに入っている各デバイスの最終データと件数
-    conn = open_database(base_dir)
-    try:
+    with database_session(base_dir, local_db, publish=False, migrate_old_layout=False) as conn:
         summary_rows = conn.execute(
-            "SELECT device_id, COUNT(*), MAX(timestamp) "
-            "FROM readings GROUP BY device_id ORDER BY device_id"
+            "SELECT device_id, row_count, last_timestamp, last_temperature, last_humidity "
+            "FROM devices WHERE last_timestamp IS NOT NULL ORDER BY device_id"
         ).fetchall()
         if not summary_rows:
             print("データベースにデータがまだ1件もありません。")
             print("  センサーPiの送信と、collector-ingest の実行を確認してください。")
-        for device_id, row_count, last_timestamp in summary_rows:
-            temperature, humidity = conn.execute(
-                "SELECT temperature, humidity FROM readings "
-                "WHERE device_id = ? AND timestamp = ?",
-                (device_id, last_timestamp)
-            ).fetchone()
+        for device_id, row_count, last_timestamp, temperature, humidity in summary_rows:
             elapsed_minutes = int((now - parse_timestamp(last_timestamp)).total_seconds() // 60)
             # 欠測アラートと同じ2時間を目安に注意表示を付ける
             warning_label = "  <-- 2時間以上データが届いていません（要確認）" if elapsed_minutes >= 120 else ""
@@ -688,24 +2912,175 @@ def run_status(base_dir: str) -> None:
                 f"  {device_id}: 最終 {last_timestamp} ({elapsed_minutes}分前) "
                 f"温度 {temperature}C / 湿度 {humidity}% / 累計 {row_count}行{warning_label}"
             )
-    finally:
-        conn.close()
+
+        # Slackにまだ送れていない通知（Slack障害中などにたまる）
+        outbox_count, oldest_created_at, last_error = conn.execute(
+            "SELECT COUNT(*), MIN(created_at), "
+            "       (SELECT last_error FROM outbox WHERE last_error IS NOT NULL ORDER BY id DESC LIMIT 1) "
+            "FROM outbox"
+        ).fetchone()
+        print(f"Slack未送信: {outbox_count}件"
+              + (f"（最も古いもの: {oldest_created_at}）" if outbox_count else ""))
+        if last_error:
+            print(f"  直近の送信エラー: {last_error}")
 
     # incoming に残っている未取り込みファイル数（次のingestで取り込まれる分）
-    pending_files = glob.glob(os.path.join(base_dir, 'incoming', '*', '*.csv'))
+    pending_files = list_incoming_files(base_dir)
     print(f"未取り込みファイル: {len(pending_files)}件"
           + ("（次の collector-ingest で取り込まれます）" if pending_files else ""))
 
 
+# =============================================================================
+# migrate: 旧形式DBの変換
+# =============================================================================
+
+def run_migrate(base_dir: str, local_db: str = None) -> None:
+    """
+    migrate サブコマンド本体。旧形式のDBを新形式に変換する（migrate_database）。
+
+    旧形式のDBは ingest などが開いたときにも自動で移行されるので、このコマンドは
+    更新前に移行を済ませておきたいとき・進み具合を画面で見たいときに使う。
+    """
+    with database_session(base_dir, local_db, allow_old_layout=True) as conn:
+        if not _table_exists(conn, 'readings'):
+            logger.info(f"データベースは既に新形式です（version {SCHEMA_VERSION}）。移行は不要です")
+            return
+        with migration_lock(conn):
+            if _table_exists(conn, 'readings'):
+                migrate_database(conn)
+
+
+def migrate_database(conn: sqlite3.Connection) -> None:
+    """
+    旧形式の readings テーブルを新形式の samples に変換する。
+
+    MIGRATE_BATCH_ROWS 行ずつ (device_id, timestamp) の順に写し、1バッチごとに
+    どこまで写したかを migrate_progress に記録してコミットする。途中で止まっても
+    （Ctrl+C・停電・NASの切断・タイマーの停止）、次に開いたときに続きから再開する。
+    全行を写し終えたら、1つのトランザクションで旧テーブルを削除して readings ビューに置き換え、
+    最後に VACUUM で空いた領域をファイルから取り除く。
+    移行中に届いたCSVは incoming/ に残り、移行を終えた同じ ingest の中で取り込まれる。
+    """
+    # 旧形式のまま作られた補助テーブルの有無を、新形式のテーブルを作る前に確かめておく
+    is_resuming = _table_exists(conn, 'migrate_progress')
+    dirty_dates_existed = _table_exists(conn, 'dirty_dates')
+    devices_existed = _table_exists(conn, 'devices')
+    # 集計行の列が無かった頃に作られたDBでも、同じ列の並びで読めるようにする
+    _add_missing_columns(conn, 'readings', [
+        ('temp_min', 'REAL'), ('temp_max', 'REAL'),
+        ('humid_min', 'REAL'), ('humid_max', 'REAL'), ('sample_count', 'INTEGER'),
+    ])
+    if _table_exists(conn, 'daily_summary'):
+        _add_missing_columns(conn, 'daily_summary', [('sample_count', 'INTEGER')])
+
+    if not is_resuming:
+        _create_schema(conn, with_readings_view=False)
+        conn.execute(
+            "CREATE TABLE migrate_progress ("
+            "  id INTEGER PRIMARY KEY CHECK (id = 1),"
+            "  device_id TEXT, timestamp TEXT, copied INTEGER NOT NULL)"
+        )
+        conn.execute("INSERT INTO migrate_progress (id, device_id, timestamp, copied) "
+                     "VALUES (1, NULL, NULL, 0)")
+        if not dirty_dates_existed:
+            # 前回の daily 以降に取り込まれた日が分からないため、全ての日を再計算対象にする
+            conn.execute(
+                "INSERT OR IGNORE INTO dirty_dates (device_id, date) "
+                "SELECT DISTINCT device_id, date(timestamp) FROM readings"
+            )
+        if not devices_existed:
+            conn.execute(
+                "INSERT OR IGNORE INTO devices (device_id, first_seen, row_count) "
+                "SELECT device_id, MIN(timestamp), COUNT(*) FROM readings GROUP BY device_id"
+            )
+        conn.commit()
+        logger.info("新形式への移行を開始します")
+    else:
+        logger.info("中断していた新形式への移行を再開します")
+
+    total = conn.execute("SELECT SUM(row_count) FROM devices").fetchone()[0] or 0
+    last_device_id, last_timestamp, copied = conn.execute(
+        "SELECT device_id, timestamp, copied FROM migrate_progress").fetchone()
+    device_keys = {}
+    started = time.monotonic()
+
+    while True:
+        if last_device_id is None:
+            batch = conn.execute(
+                "SELECT device_id, timestamp, temperature, humidity, "
+                "       temp_min, temp_max, humid_min, humid_max, sample_count "
+                "FROM readings ORDER BY device_id, timestamp LIMIT ?",
+                (MIGRATE_BATCH_ROWS,),
+            ).fetchall()
+        else:
+            # 主キー順の続きから読む（OFFSET と違い、読み飛ばす行を数え直さない）
+            batch = conn.execute(
+                "SELECT device_id, timestamp, temperature, humidity, "
+                "       temp_min, temp_max, humid_min, humid_max, sample_count "
+                "FROM readings WHERE (device_id, timestamp) > (?, ?) "
+                "ORDER BY device_id, timestamp LIMIT ?",
+                (last_device_id, last_timestamp, MIGRATE_BATCH_ROWS),
+            ).fetchall()
+        if not batch:
+            break
+
+        sample_rows = []
+        for device_id, timestamp_text, *values in batch:
+            if device_id not in device_keys:
+                device_keys[device_id] = intern_device(conn, device_id)
+            sample_rows.append((device_keys[device_id], to_epoch(timestamp_text), *values))
+        conn.executemany(
+            "INSERT OR IGNORE INTO samples (device_key, ts, temperature, humidity, "
+            "temp_min, temp_max, humid_min, humid_max, sample_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            sample_rows,
+        )
+        last_device_id, last_timestamp = batch[-1][0], batch[-1][1]
+        copied += len(batch)
+        conn.execute("UPDATE migrate_progress SET device_id = ?, timestamp = ?, copied = ?",
+                     (last_device_id, last_timestamp, copied))
+        conn.commit()
+
+        percent = copied * 100 / total if total else 100
+        rate = copied / max(time.monotonic() - started, 0.001)
+        logger.info(f"移行中: {copied}/{total}行 ({percent:.1f}%, {rate:.0f}行/秒)")
+
+    # 旧テーブルを readings ビューに置き換える。途中で止まっても旧形式のまま残るよう、1トランザクションで行う
+    conn.execute("BEGIN")
+    for (device_id,) in conn.execute("SELECT device_id FROM devices").fetchall():
+        _refresh_latest_readings(conn, device_id)
+    conn.execute("DROP TABLE readings")
+    conn.execute("DROP TABLE migrate_progress")
+    rebuild_hourly_rollup(conn)
+    conn.execute(READINGS_VIEW_SQL)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+    logger.info(f"{copied}行を新形式に移しました。空き領域を整理しています（VACUUM）...")
+
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    size_before = os.path.getsize(db_path)
+    conn.execute("VACUUM")
+    logger.info(
+        f"移行が完了しました（DBサイズ: {size_before / 1e6:.1f}MB → "
+        f"{os.path.getsize(db_path) / 1e6:.1f}MB）"
+    )
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='温湿度データコレクター')
     parser.add_argument(
         'command',
-        choices=['ingest', 'daily', 'weekly-report', 'status'],
+        choices=['ingest', 'daily', 'weekly-report', 'status', 'migrate', 'report', 'simulate', 'coverage',
+                 'serve'],
         help='ingest: 取り込み＋アラート判定（10分ごと） / '
              'daily: 日次集計＋前日サマリ投稿（1日1回） / '
              'weekly-report: 週次レポート送信（週1回） / '
-             'status: 各デバイスの受信状況を表示（手動確認用・Slack設定不要）'
+             'status: 各デバイスの受信状況を表示（手動確認用・Slack設定不要） / '
+             'migrate: 旧形式のDBを新形式に変換（ingest などでも自動で行われる。前もって済ませたいときに実行。中断しても再開できる） / '
+             'report: 任意の期間・デバイスのグラフを画像に保存（手動確認用・Slack設定不要） / '
+             'simulate: 候補の設定ファイルで過去のアラートがどう変わるかを試算（手動確認用・Slack設定不要） / '
+             'coverage: 各デバイスの受信率とデータの欠けた時間帯を表示（手動確認用・Slack設定不要） / '
+             'serve: 常駐して取り込み・アラート判定・日次・週次をまとめて行う（3つのタイマーの代わり）'
     )
     parser.add_argument(
         '--base-dir',
@@ -717,8 +3092,122 @@ def parse_args() -> argparse.Namespace:
         action='store_true',
         help='Slackに送信せず、送る内容をログに出すだけにする（動作確認用）'
     )
+    parser.add_argument(
+        '--local-db',
+        default=None,
+        metavar='PATH',
+        help='作業用のDBをコレクターPiのローカルディスクのこのパスに置き（WALモード）、'
+             '各実行の最後にNAS上の db/sensor_data.sqlite3 へスナップショットを書き出す。'
+             '全てのサブコマンド（タイマー）で同じパスを指定すること（例: /var/lib/sensor-collector/sensor_data.sqlite3）'
+    )
+    parser.add_argument(
+        '--full-rebuild',
+        action='store_true',
+        help='daily で、更新のあった日だけでなく全期間の日次集計を計算し直す（集計の修復用）'
+    )
+    parser.add_argument(
+        '--ingest-workers',
+        type=int,
+        default=DEFAULT_INGEST_WORKERS,
+        metavar='N',
+        help=f'ingest でチャンクファイルの一覧・読み込み・削除を並行して行うスレッド数'
+             f'（デフォルト: {DEFAULT_INGEST_WORKERS}。DBへの書き込みは常に1本）'
+    )
+    parser.add_argument(
+        '--rollup-after-days',
+        type=float,
+        default=DEFAULT_ROLLUP_AFTER_DAYS,
+        metavar='DAYS',
+        help=f'レポートの期間がこの日数を超えたら、生データではなく時間別集計から描く'
+             f'（デフォルト: {DEFAULT_ROLLUP_AFTER_DAYS}。週次レポートは生データのまま）'
+    )
+    parser.add_argument(
+        '--from',
+        dest='date_from',
+        metavar='DATETIME',
+        help="report / simulate / coverage の期間の始まり（'YYYY-MM-DD' または 'YYYY-MM-DD HH:MM'。"
+             f"report / simulate では必須。coverage では省略すると{COVERAGE_DEFAULT_DAYS}日前から）"
+    )
+    parser.add_argument(
+        '--to',
+        dest='date_to',
+        metavar='DATETIME',
+        help="report / simulate / coverage の期間の終わり（日付だけならその日の終わりまで。省略時は現在時刻）"
+    )
+    parser.add_argument(
+        '--devices',
+        default=None,
+        help='report / simulate / coverage の対象のデバイス名をカンマ区切りで指定（例: room246,room301。省略時は全デバイス）'
+    )
+    parser.add_argument(
+        '--config',
+        dest='candidate_config',
+        metavar='PATH',
+        help='simulate で試す設定ファイル（thresholds.yaml と同じ形式。現在の設定と並べて表示する）'
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        metavar='PATH',
+        help='report の画像の保存先（省略時は reports/adhoc/ 以下）'
+    )
+    parser.add_argument(
+        '--watch',
+        choices=['auto', 'inotify', 'poll'],
+        default='auto',
+        help='serve での incoming/ の監視方法。auto: inotify と定期確認の併用（デフォルト。SMBマウントでも取りこぼさない） / '
+             'inotify: inotify のみ（ローカルディスク用） / poll: 定期確認のみ'
+    )
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=DEFAULT_SERVE_POLL_SEC,
+        metavar='SEC',
+        help=f'serve で incoming/ を定期確認する間隔（秒。デフォルト: {DEFAULT_SERVE_POLL_SEC}）'
+    )
+    parser.add_argument(
+        '--daily-at',
+        default=DEFAULT_DAILY_AT,
+        metavar='HH:MM',
+        help=f'serve で日次レポートを実行する時刻（デフォルト: {DEFAULT_DAILY_AT}）'
+    )
+    parser.add_argument(
+        '--weekly-at',
+        default=DEFAULT_WEEKLY_AT,
+        metavar="'Mon HH:MM'",
+        help=f'serve で週次レポートを実行する曜日と時刻（デフォルト: {DEFAULT_WEEKLY_AT}）'
+    )
     parser.add_argument('--debug', action='store_true', help='デバッグログを有効化')
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.ingest_workers < 1:
+        parser.error('--ingest-workers は1以上を指定してください')
+    if args.poll_interval <= 0:
+        parser.error('--poll-interval は0より大きい値を指定してください')
+    try:
+        parse_schedule(args.daily_at)
+        parse_schedule(args.weekly_at, with_weekday=True)
+    except ValueError:
+        parser.error("--daily-at は 'HH:MM'、--weekly-at は 'Mon HH:MM' の形式で指定してください")
+    if args.command == 'simulate':
+        if not args.candidate_config:
+            parser.error('simulate には --config で試す設定ファイルを指定してください')
+        if not os.path.isfile(args.candidate_config):
+            parser.error(f'--config の設定ファイルが見つかりません: {args.candidate_config}')
+    if args.command in ('report', 'simulate', 'coverage'):
+        if not args.date_from and args.command != 'coverage':
+            parser.error(f'{args.command} には --from を指定してください')
+        try:
+            args.date_from = (parse_report_time(args.date_from) if args.date_from
+                              else datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+                              - datetime.timedelta(days=COVERAGE_DEFAULT_DAYS))
+            args.date_to = (parse_report_time(args.date_to, is_end=True) if args.date_to
+                            else datetime.datetime.now().replace(microsecond=0))
+        except ValueError:
+            parser.error("--from / --to は 'YYYY-MM-DD' または 'YYYY-MM-DD HH:MM' の形式で指定してください")
+        if args.date_from >= args.date_to:
+            parser.error('--from は --to より前の時刻を指定してください')
+        args.devices = [name.strip() for name in args.devices.split(',') if name.strip()] if args.devices else None
+    return args
 
 
 def main() -> None:
@@ -737,19 +3226,50 @@ def main() -> None:
     # status は読み取り専用の手動確認コマンド。Slack設定（環境変数）が無くても
     # 動くように、SlackSenderの初期化より前に処理する
     if args.command == 'status':
-        run_status(args.base_dir)
+        run_status(args.base_dir, args.local_db)
         return
 
     setup_logging(args.base_dir, args.debug)
+
+    # migrate もSlackを使わない
+    if args.command == 'migrate':
+        try:
+            run_migrate(args.base_dir, args.local_db)
+        except KeyboardInterrupt:
+            logger.info("移行を中断しました。もう一度 migrate を実行すると続きから再開します")
+            raise SystemExit(1)
+        return
+
+    # report は画像を保存するだけでSlackを使わない
+    if args.command == 'report':
+        run_report(args.base_dir, args.date_from, args.date_to, args.devices, args.output,
+                   args.local_db, args.rollup_after_days)
+        return
+
+    # simulate も結果を表示するだけでSlackを使わない
+    if args.command == 'simulate':
+        run_simulate(args.base_dir, args.candidate_config, args.date_from, args.date_to,
+                     args.devices, args.local_db)
+        return
+
+    # coverage も結果を表示するだけでSlackを使わない
+    if args.command == 'coverage':
+        run_coverage(args.base_dir, args.date_from, args.date_to, args.devices, args.local_db)
+        return
+
     slack = SlackSender(no_slack=args.no_slack)
 
     try:
         if args.command == 'ingest':
-            run_ingest(args.base_dir, slack)
+            run_ingest(args.base_dir, slack, args.local_db, args.ingest_workers)
         elif args.command == 'daily':
-            run_daily(args.base_dir, slack)
+            run_daily(args.base_dir, slack, args.full_rebuild, args.local_db)
         elif args.command == 'weekly-report':
-            run_weekly_report(args.base_dir, slack)
+            run_weekly_report(args.base_dir, slack, args.local_db, args.rollup_after_days)
+        elif args.command == 'serve':
+            run_serve(args.base_dir, slack, args.local_db, args.ingest_workers,
+                      args.rollup_after_days, args.watch, args.poll_interval,
+                      args.daily_at, args.weekly_at)
     except Exception as e:
         logger.error(f"予期せぬエラーが発生しました: {e}")
         traceback.print_exc()
@@ -0,0 +1,260 @@
+"""
+Slack API の代役（手元でSlack送信の動きを試すためのHTTPサーバー）。
+
+collector.py が使う Slack API（chat.postMessage と、files_upload_v2 が呼ぶ
+files.getUploadURLExternal → アップロード → files.completeUploadExternal）だけを真似て、
+受け取った内容を画面に表示する。本物のSlackやネットワークなしで、
+outbox の再送・バックオフ・レート制限（HTTP 429）の扱いや、たまったアラートをまとめて送る様子を確かめられる。
+
+使い方:
+    # 1秒に1件を超えたら 429、1割の確率で 500 を返す代役を立てる
+    python3 slack_standin.py --port 8099 --rate-per-sec 1 --failure-rate 0.1
+
+    # 別の端末から、代役に向けて collector.py を動かす（トークン・チャンネルIDは何でもよい）
+    SLACK_API_URL=http://127.0.0.1:8099/api/ SLACK_TOKEN=xoxb-test SLACK_CHANNEL_ID=C0TEST \
+        python3 collector.py serve --base-dir /tmp/fake_nas
+
+    # 受け取った件数・返したエラーの件数
+    curl http://127.0.0.1:8099/stats
+
+Ctrl+C で止めると、最後に集計を表示する。
+"""
+
+import argparse
+import collections
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+# =============================================================================
+# 設定値
+# =============================================================================
+
+DEFAULT_PORT = 8099
+DEFAULT_RETRY_AFTER_SEC = 5     # 429 を返すときに Retry-After で指定する秒数
+MESSAGE_PREVIEW_CHARS = 200     # 画面に表示する本文の長さ
+SLACK_MESSAGE_MAX_CHARS = 40000  # これより長い本文は msg_too_long（本物のSlackと同じ上限）
+
+
+class StandinState:
+    """代役サーバーが受け取ったもの・返したエラーの記録（複数のリクエスト処理スレッドから使う）"""
+
+    def __init__(self, rate_per_sec: float, failure_rate: float, latency_sec: float,
+                 retry_after_sec: int):
+        self.rate_per_sec = rate_per_sec
+        self.failure_rate = failure_rate
+        self.latency_sec = latency_sec
+        self.retry_after_sec = retry_after_sec
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.recent_calls = collections.deque()  # レート制限の判定用（直近1秒の受付時刻）
+        self.pending_uploads = {}                # file_id -> (ファイル名, 受け取ったバイト数)
+        self.started = time.monotonic()
+
+    def admit(self) -> str:
+        """
+        API呼び出しを受け付けるかを決める。
+
+        Returns:
+            None なら受け付ける。'rate_limited' なら 429、'internal_error' なら 500 を返す
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.recent_calls and now - self.recent_calls[0] >= 1.0:
+                self.recent_calls.popleft()
+            if self.rate_per_sec and len(self.recent_calls) >= self.rate_per_sec:
+                self.counts['rate_limited'] += 1
+                return 'rate_limited'
+            self.recent_calls.append(now)
+            if random.random() < self.failure_rate:
+                self.counts['internal_error'] += 1
+                return 'internal_error'
+            return None
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {'uptime_sec': round(time.monotonic() - self.started, 1), **self.counts}
+
+
+class StandinHandler(http.server.BaseHTTPRequestHandler):
+    """Slack Web API の代役。レスポンスは本物と同じく {"ok": true, ...} 形式のJSON"""
+
+    server_version = 'SlackStandin/1.0'
+    state: StandinState = None  # serve() で設定する
+
+    def log_message(self, format, *args):
+        # アクセスログは出さない（受け取った内容だけを表示する）
+        pass
+
+    def _send_json(self, body: dict, status: int = 200, headers: dict = None) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_params(self) -> dict:
+        """フォーム形式・JSONどちらのリクエスト本文も辞書にする"""
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if 'application/json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(raw or b'{}')
+        query = urllib.parse.urlsplit(self.path).query
+        params = urllib.parse.parse_qs(query)
+        params.update(urllib.parse.parse_qs(raw.decode('utf-8')))
+        return {key: values[0] for key, values in params.items()}
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == '/stats':
+            self._send_json(self.state.summary())
+        else:
+            self._send_json({'ok': False, 'error': 'unknown_method'}, status=404)
+
+    def do_POST(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path.startswith('/upload/'):
+            self._receive_upload(path.rsplit('/', 1)[-1])
+            return
+
+        if self.state.latency_sec:
+            time.sleep(self.state.latency_sec)
+        verdict = self.state.admit()
+        if verdict == 'rate_limited':
+            # 本文は読み捨てる（読まずに返すとクライアント側で接続エラーになることがある）
+            self._read_params()
+            self._send_json({'ok': False, 'error': 'ratelimited'}, status=429,
+                            headers={'Retry-After': str(self.state.retry_after_sec)})
+            return
+        if verdict == 'internal_error':
+            self._read_params()
+            self._send_json({'ok': False, 'error': 'internal_error'}, status=500)
+            return
+
+        method = path.rsplit('/', 1)[-1]
+        params = self._read_params()
+        handler = {
+            'chat.postMessage': self._post_message,
+            'files.getUploadURLExternal': self._get_upload_url,
+            'files.completeUploadExternal': self._complete_upload,
+        }.get(method)
+        if handler is None:
+            self._send_json({'ok': False, 'error': 'unknown_method'}, status=404)
+            return
+        handler(params)
+
+    def _post_message(self, params: dict) -> None:
+        text = params.get('text') or ''
+        if not text:
+            self._send_json({'ok': False, 'error': 'no_text'})
+            return
+        if len(text) > SLACK_MESSAGE_MAX_CHARS:
+            self._send_json({'ok': False, 'error': 'msg_too_long'})
+            return
+        with self.state.lock:
+            self.state.counts['messages'] += 1
+        print(f"[{time.strftime('%H:%M:%S')}] message #{params.get('channel')} "
+              f"({len(text)}文字)\n  {text[:MESSAGE_PREVIEW_CHARS]}", flush=True)
+        self._send_json({'ok': True, 'channel': params.get('channel'), 'ts': f"{time.time():.6f}",
+                         'message': {'text': text}})
+
+    def _get_upload_url(self, params: dict) -> None:
+        file_id = f"F{random.randrange(16 ** 10):010X}"
+        with self.state.lock:
+            self.state.pending_uploads[file_id] = (params.get('filename'), 0)
+        host, port = self.server.server_address[:2]
+        self._send_json({'ok': True, 'file_id': file_id,
+                         'upload_url': f"http://{host}:{port}/upload/{file_id}"})
+
+    def _receive_upload(self, file_id: str) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        received = len(self.rfile.read(length)) if length else 0
+        with self.state.lock:
+            if file_id not in self.state.pending_uploads:
+                found = False
+            else:
+                found = True
+                filename, _ = self.state.pending_uploads[file_id]
+                self.state.pending_uploads[file_id] = (filename, received)
+        if not found:
+            self.send_response(404)
+            self.end_headers()
+            return
+        payload = f"OK - {received}".encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _complete_upload(self, params: dict) -> None:
+        files = params.get('files')
+        if isinstance(files, str):
+            files = json.loads(files)
+        completed = []
+        with self.state.lock:
+            for entry in files or []:
+                upload = self.state.pending_uploads.pop(entry.get('id'), None)
+                if upload is None:
+                    continue
+                completed.append((entry, upload))
+            self.state.counts['files'] += len(completed)
+        if not completed:
+            self._send_json({'ok': False, 'error': 'file_not_found'})
+            return
+        comment = params.get('initial_comment') or ''
+        for entry, (filename, size) in completed:
+            print(f"[{time.strftime('%H:%M:%S')}] file #{params.get('channel_id') or params.get('channels')} "
+                  f"{entry.get('title') or filename} ({size}バイト)\n  {comment[:MESSAGE_PREVIEW_CHARS]}",
+                  flush=True)
+        self._send_json({'ok': True, 'files': [
+            {'id': entry['id'], 'title': entry.get('title') or filename, 'name': filename}
+            for entry, (filename, _) in completed
+        ]})
+
+
+def serve(port: int, state: StandinState) -> None:
+    """代役サーバーを Ctrl+C まで動かす"""
+    StandinHandler.state = state
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), StandinHandler)
+    print(f"Slack API の代役を起動しました: SLACK_API_URL=http://127.0.0.1:{port}/api/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"集計: {json.dumps(state.summary(), ensure_ascii=False)}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Slack API の代役（送信の動作確認・負荷試験用）')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'待ち受けるポート（127.0.0.1のみ。デフォルト: {DEFAULT_PORT}）')
+    parser.add_argument('--rate-per-sec', type=float, default=0,
+                        help='1秒あたりこの件数を超えたAPI呼び出しに 429 を返す（0なら制限なし）')
+    parser.add_argument('--retry-after', type=int, default=DEFAULT_RETRY_AFTER_SEC,
+                        help=f'429 のときに Retry-After で返す秒数（デフォルト: {DEFAULT_RETRY_AFTER_SEC}）')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='この確率で 500 を返す（0〜1。Slack障害の再現用）')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='API呼び出しごとに待つ秒数（遅いSlackの再現用）')
+    args = parser.parse_args()
+    if not 0 <= args.failure_rate <= 1:
+        parser.error('--failure-rate は 0〜1 で指定してください')
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    serve(args.port, StandinState(args.rate_per_sec, args.failure_rate, args.latency,
+                                  args.retry_after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+DHT22の読み取り用の子プロセス（temp_humid_notifier.py の SensorReader が起動する。単独では使わない）。
+
+    python3 sensor_worker.py <接続のファイル記述子> <ピン名（例: D4）>
+
+子プロセスは temp_humid_notifier.py を読み込まずにこのファイルだけで動く。本体を読み込むと、
+子を起動する（ウォッチドッグで作り直す）たびにログ設定（ログファイルを開く）・atexit の登録などの
+import 時の処理が繰り返され、Pi Zero では初期化の待ち時間（SENSOR_READ_TIMEOUT_SEC）の多くを使ってしまう。
+Raspberry Pi 専用のライブラリ（board / adafruit_dht）もここでだけ読み込む
+（読み込めなければ初期化の失敗として親に知らせる）。このモジュールは import しても何もしない。
+"""
+
+import multiprocessing.connection
+import signal
+import sys
+import time
+
+DHT_MIN_READ_INTERVAL_SEC = 2.0     # DHT22の読み取り間隔の下限（データシートの仕様）
+
+
+def worker_main(pin_name: str, connection) -> None:
+    """
+    センサー読み取り用の子プロセスの本体。DHT22はこのプロセスだけが掴む。
+
+    親プロセスから接続（Pipe）経由で読み取り要求（要求ID）を1つずつ受け取り、
+    (要求ID, 'ok', humidity, temperature) または (要求ID, 'error'/'fatal', メッセージ) を返す。
+    None を受け取ったら終了する。DHT22は読み取り間隔を2秒以上あける必要があるため、
+    要求が続けて来てもここで DHT_MIN_READ_INTERVAL_SEC の間隔を必ずあける。
+    親が強制終了するときにDHTライブラリの補助プロセスごと止められるよう、
+    親はこのプロセスを専用のプロセスグループ（セッション）で起動する。
+    """
+    def handle_sigterm(sig, frame) -> None:
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl+C は親が受けて、親から止める
+
+    try:
+        import board
+        import adafruit_dht
+        pin = getattr(board, pin_name, None)
+        if pin is None:
+            raise ValueError(f"ピン名が不正です: {pin_name}")
+        # use_pulseio=False は adafruit_circuitpython_dht との相性が悪いため省略
+        device = adafruit_dht.DHT22(pin)
+    except Exception as e:
+        connection.send(('init_error', f"{type(e).__name__}: {e}"))
+        return
+    connection.send(('ready', None))
+
+    last_read_time = 0.0
+    try:
+        while True:
+            request_id = connection.recv()
+            if request_id is None:
+                break
+
+            wait_sec = last_read_time + DHT_MIN_READ_INTERVAL_SEC - time.monotonic()
+            if wait_sec > 0:
+                time.sleep(wait_sec)
+            last_read_time = time.monotonic()
+
+            try:
+                temperature = device.temperature
+                humidity = device.humidity
+            except RuntimeError as e:
+                # 読み取り失敗はDHT22では頻繁に起こる正常な一時エラー
+                connection.send((request_id, 'error', str(e)))
+                continue
+            except Exception as e:
+                # その他の重大エラーはこのプロセスを終えて、親に作り直してもらう
+                connection.send((request_id, 'fatal', str(e)))
+                break
+            connection.send((request_id, 'ok', humidity, temperature))
+    except (EOFError, OSError):
+        pass   # 親プロセスが先に終了した
+    finally:
+        # dht_device.exit() を呼ばないと、次回起動時に
+        # 「unable to set line to input」エラーが出てGPIOが使えなくなる
+        try:
+            device.exit()
+        except Exception:
+            pass
+
+
+if __name__ == '__main__':
+    worker_main(sys.argv[2], multiprocessing.connection.Connection(int(sys.argv[1])))
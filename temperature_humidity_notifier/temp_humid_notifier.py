@@ -32,9 +32,13 @@ NAS上のデータを読むコレクター（collector/collector.py）が担当
 
 import argparse
 import atexit
+import collections
 import csv
 import datetime
+import gzip
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import random
 import re
@@ -42,22 +46,26 @@ import shutil
 import signal
 import socket
 import subprocess
+import sys
+import tempfile
 import threading
 import time
 import traceback
+import zlib
 
-import board
-import adafruit_dht
+# DHT22の読み取りは別プロセス（sensor_worker.py）で行う。Raspberry Pi 専用のライブラリもそちらで読み込む
+import sensor_worker
+from sensor_worker import DHT_MIN_READ_INTERVAL_SEC
 
 # スクリプトの版。配布後に journalctl の起動ログで新旧を見分けるために使う。
 # 動作に関わる変更をしたら日付を更新すること
-SCRIPT_VERSION = '2026-07-09'
+SCRIPT_VERSION = '2026-10-18'
 
 # =============================================================================
 # 設定パラメータ（必要に応じて変更）
 # =============================================================================
 
-DHT_PIN = board.D4                  # BCM4ピン（物理ピン7）に接続されたDHT22
+DHT_PIN = 'D4'                      # BCM4ピン（物理ピン7）に接続されたDHT22（board のピン名）
 
 CHECK_INTERVAL_SEC = 600            # センサー測定間隔（秒）= 10分
 
@@ -65,12 +73,33 @@ CHECK_INTERVAL_SEC = 600            # センサー測定間隔（秒）= 10分
 # 同じサイクル内で数回再試行する（最大で 15秒 × 4回 = 60秒の追加待ち）
 SENSOR_READ_RETRIES = 5             # 1サイクル内での読み取り試行回数（初回を含む）
 SENSOR_RETRY_INTERVAL_SEC = 15      # 再試行までの待ち時間（秒）。DHT22は読み取り間隔を2秒以上あける必要がある
-
-CSV_FILENAME = 'temperature_log.csv'
-UPLOAD_STATE_FILENAME = 'upload_state.txt'   # 送信済み行数を記録するファイル
+SENSOR_READ_TIMEOUT_SEC = 10        # 1回の読み取りがこれを超えたら固まったとみなし、読み取りプロセスを作り直す
+
+# 間引きモード（--deadband-temp / --deadband-humid）で、値が動かなくても
+# 最低この間隔で1行は記録する（コレクターが「データが止まった」と区別できるように）
+DEFAULT_HEARTBEAT_MINUTES = 60
+
+CSV_FILENAME = 'temperature_log.csv'        # 旧版の単一CSV（起動時にセグメントへ移行する）
+CSV_HEADER = ['timestamp', 'temperature', 'humidity']
+# 高頻度サンプリング（--sample-interval）時の集計行のヘッダー。
+# temperature / humidity には間隔内の平均値が入る
+AGGREGATE_CSV_HEADER = CSV_HEADER + ['temp_min', 'temp_max', 'humid_min', 'humid_max', 'sample_count']
+SEGMENT_DIRNAME = 'segments'        # 未送信・送信途中のセグメントCSVを置くフォルダ
+ARCHIVE_DIRNAME = 'archive'         # 送信済みセグメントのgzip圧縮版を置くフォルダ
+SEGMENT_MAX_BYTES = 1024 * 1024     # 1セグメントの上限。日付が変わるか、これを超えたら次のセグメントへ
+ARCHIVE_RETENTION_DAYS = 365        # 送信済みセグメント（archive）の保持日数
+UPLOAD_STATE_FILENAME = 'upload_state.txt'   # 送信済み位置（セグメント名とバイト位置）を記録するファイル
 DEFAULT_SAVE_DIR = '/home/harry.one/Desktop/data'
 DEFAULT_SSH_KEY = '~/.ssh/nas_upload_key'    # NAS送信専用のSSH秘密鍵
 TRANSFER_TIMEOUT_SEC = 60           # SFTP送信のタイムアウト（秒）
+SSH_CONTROL_TIMEOUT_SEC = 10        # マスター接続への問い合わせ（ssh -O check / exit）のタイムアウト（秒）
+UPLOAD_CHUNK_MAX_BYTES = 64 * 1024  # 1チャンクに入れる未送信データの上限（約1600行＝10分間隔で約11日分）
+UPLOAD_CYCLE_BUDGET_SEC = 180       # 1サイクルで送信に使う時間の上限（残りは次のサイクルへ）
+SFTP_RECONNECT_BACKOFF_BASE_SEC = 30    # SSH接続の張り直しに失敗したときの最初の待ち時間（秒）
+SFTP_RECONNECT_BACKOFF_MAX_SEC = 1800   # 同・待ち時間の上限（失敗が続くと倍々に延ばす）
+UPLOAD_RETRY_BACKOFF_BASE_SEC = 30      # 送信に失敗したときの、送信スレッドの最初の再試行待ち（秒）
+UPLOAD_RETRY_BACKOFF_MAX_SEC = 1800     # 同・待ち時間の上限（失敗が続くと倍々に延ばす）
+NAS_PROBE_TIMEOUT_SEC = 10          # マウント先の存在確認がこれを超えたら、NASが応答しないとみなす
 
 # テストモード用ダミーデータのパラメータ
 TEST_TEMP_BASE = 20.0
@@ -102,150 +131,351 @@ logger = logging.getLogger(__name__)
 # GPIO / センサー管理
 # =============================================================================
 
-# グローバル変数でデバイスを保持する。
-# atexit や finally ブロックからクリーンアップするために必要。
-_dht_device = None
+class SensorReader:
+    """
+    1台のDHT22を、専用の子プロセス1つで読み続ける。
+
+    DHT22は稀に .temperature の呼び出しで無限ブロックすることがある。以前は読み取りの
+    たびにスレッドを作り、10秒で見切っていたが、固まったスレッドは止める手段が無く、
+    デバイスを掴んだまま溜まっていった。子プロセスなら固まっても kill できる。
 
+      - 子プロセスは起動時に1回だけセンサーを初期化し、要求ごとに読み取って返す
+      - 読み取りが SENSOR_READ_TIMEOUT_SEC 以内に返らなければ、固まったとみなして
+        子プロセスを強制終了し、次の要求時に作り直す（ウォッチドッグ）。
+        重大エラーで子が終了した場合も同様
+      - 子プロセスと接続（Pipe）は常に1組だけなので、何か月動かしても
+        スレッド数・メモリは増えない
 
-def _cleanup_sensor() -> None:
+    複数センサーを並行して読めるよう、request_read() で要求を出し、poll() で
+    結果を受け取る非ブロッキングの使い方をする（read_sensors 参照）。
     """
-    DHT22センサーのリソースを解放する。
 
-    プログラムの終了方法（正常終了・例外・Ctrl+C・SIGTERM）を問わず、
-    必ず呼ばれるよう atexit.register と try/finally の両方で登録する。
+    def __init__(self, pin):
+        self.pin = pin
+        self._process = None
+        self._connection = None
+        self._state = None              # None（子プロセス無し）/ 'starting' / 'idle' / 'busy'
+        self._deadline = 0.0            # 初期化・読み取りの応答期限（time.monotonic() 基準）
+        self._respawn_after = 0.0       # 強制終了後、GPIOの解放を待ってから作り直すための時刻
+        self._wants_read = False
+        self._result = None
+        self._request_id = 0
+
+    @property
+    def connection(self):
+        """応答待ちに使う接続。子プロセスが無ければ None"""
+        return self._connection
+
+    def _spawn(self) -> None:
+        # fork で作ると、送信スレッドなどが途中で掴んでいたロック（logging など）を子が掴んだまま
+        # 引き継ぎ、子が固まることがある（ウォッチドッグからは固まったセンサーに見える）。
+        # multiprocessing の spawn でも、子は親のスクリプト（このファイル）を読み込み直すので、
+        # 小さな sensor_worker.py を新しいインタープリターで直接起動し、接続（Pipe）の片側だけを渡す。
+        # start_new_session で専用のプロセスグループにし、DHTライブラリの補助プロセスごと kill できるようにする
+        parent_connection, child_connection = multiprocessing.Pipe()
+        self._process = subprocess.Popen(
+            [sys.executable, sensor_worker.__file__, str(child_connection.fileno()), self.pin],
+            pass_fds=(child_connection.fileno(),), start_new_session=True,
+        )
+        child_connection.close()
+        self._connection = parent_connection
+        self._state = 'starting'
+        self._deadline = time.monotonic() + SENSOR_READ_TIMEOUT_SEC
+
+    def _kill(self) -> None:
+        """子プロセスをプロセスグループ（DHTライブラリの補助プロセス）ごと即座に終了させる"""
+        if self._process is not None:
+            if self._process.poll() is None:
+                try:
+                    os.killpg(self._process.pid, signal.SIGKILL)
+                except Exception:
+                    self._process.kill()
+            self._join(3)
+            self._connection.close()
+        self._process = None
+        self._connection = None
+        self._state = None
+        self._respawn_after = time.monotonic() + 2   # GPIOの解放を待つ
+
+    def start(self) -> bool:
+        """
+        子プロセスを起動し、センサーの初期化結果を待つ（起動時の確認用）。
+
+        Returns:
+            True: 初期化成功、False: 初期化失敗
+        """
+        self._spawn()
+        while self._state == 'starting':
+            self._connection.poll(0.5)
+            if self._progress() is not None:
+                break
+        return self._state == 'idle'
+
+    def request_read(self) -> None:
+        """読み取りを1回要求する。結果は poll() で受け取る"""
+        self._wants_read = True
+        # 応答が既に届いていた場合に取りこぼさないよう、結果は poll() まで預かる
+        self._result = self._progress()
+
+    def poll(self):
+        """
+        要求した読み取りの結果を返す。
+
+        Returns:
+            まだ結果が無ければ None。終わっていれば (humidity, temperature) のタプル
+            （取得失敗時は (None, None)）
+        """
+        if self._result is not None:
+            result, self._result = self._result, None
+            return result
+        return self._progress()
+
+    def _progress(self):
+        """状態を1段進める。読み取り要求が終わったらその結果を返す"""
+        now = time.monotonic()
+        if self._process is None:
+            if not self._wants_read or now < self._respawn_after:
+                return None
+            # 前回の重大エラー・タイムアウト等で子プロセスが無ければ作り直す
+            logger.info(f"DHT22の読み取りプロセスを再起動します (ピン: {self.pin})")
+            self._spawn()
 
-    dht_device.exit() を呼ばないと、次回起動時に
-    「unable to set line to input」エラーが出てGPIOが使えなくなり、
-    Raspberry Piの再起動が必要になる。
-    """
-    global _dht_device
-    if _dht_device is not None:
         try:
-            _dht_device.exit()
-            logger.info("DHT22センサー接続を終了しました")
-        except Exception as e:
-            logger.warning(f"センサー終了時のエラー（無視して続行）: {e}")
-        # 二重呼び出しを防ぐために None に戻す
-        _dht_device = None
+            if self._state == 'starting':
+                if self._connection.poll():
+                    status, message = self._connection.recv()
+                    if status != 'ready':
+                        logger.error(f"DHT22センサーの初期化に失敗しました (ピン: {self.pin}): {message}")
+                        return self._fail()
+                    self._state = 'idle'
+                elif now > self._deadline or self._process.poll() is not None:
+                    logger.error(
+                        f"DHT22センサーの初期化が{SENSOR_READ_TIMEOUT_SEC}秒で終わりませんでした "
+                        f"(ピン: {self.pin})"
+                    )
+                    return self._fail()
+
+            if self._state == 'idle' and self._wants_read:
+                self._wants_read = False
+                self._request_id += 1
+                self._connection.send(self._request_id)
+                self._state = 'busy'
+                self._deadline = now + SENSOR_READ_TIMEOUT_SEC
+
+            if self._state == 'busy':
+                while self._connection.poll():
+                    response = self._connection.recv()
+                    if response[0] == self._request_id:
+                        self._state = 'idle'
+                        return self._interpret(response)
+                    # 以前の要求への遅れた応答は捨てる
+                if now > self._deadline:
+                    # タイムアウト：GPIOが応答していない
+                    logger.warning(
+                        f"センサー読み取りが{SENSOR_READ_TIMEOUT_SEC}秒でタイムアウトしました "
+                        f"(ピン: {self.pin})。読み取りプロセスを作り直します"
+                    )
+                    return self._fail()
+                if self._process.poll() is not None:
+                    logger.error(f"読み取りプロセスが異常終了しました (ピン: {self.pin})")
+                    return self._fail()
+        except (EOFError, OSError) as e:
+            logger.error(f"読み取りプロセスとの通信に失敗しました (ピン: {self.pin}): {e}")
+            return self._fail()
+        return None
+
+    def _fail(self) -> tuple:
+        self._wants_read = False
+        self._kill()
+        return None, None
 
+    def _interpret(self, response: tuple) -> tuple:
+        status = response[1]
+        if status == 'error':
+            logger.debug(f"DHT 取得失敗（一時的エラー） (ピン: {self.pin}): {response[2]}")
+            return None, None
+        if status == 'fatal':
+            # 子プロセスはセンサーを解放して終了している。次の読み取りで作り直す
+            logger.error(f"DHT 重大エラー (ピン: {self.pin}): {response[2]}")
+            return self._fail()
+
+        humidity, temperature = response[2], response[3]
+        if humidity is not None and temperature is not None:
+            return round(humidity, 3), round(temperature, 3)
+        logger.warning(f"センサーからのデータ取得に失敗しました (ピン: {self.pin})")
+        return None, None
 
-# atexitに登録：正常終了・例外終了いずれでも呼ばれる
-atexit.register(_cleanup_sensor)
+    def stop(self) -> None:
+        """子プロセスを終了させる。応答しなければプロセスグループごと強制終了する"""
+        if self._process is None:
+            return
+        try:
+            self._connection.send(None)
+        except Exception:
+            pass
+        if not self._join(3):
+            self._process.terminate()
+            self._join(3)
+        self._kill()
+
+    def _join(self, timeout_sec: float) -> bool:
+        """子プロセスの終了を timeout_sec 秒まで待つ。終わっていれば True"""
+        try:
+            self._process.wait(timeout=timeout_sec)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
 
 
-def _init_sensor() -> bool:
+class Sensor:
     """
-    DHT22センサーを初期化する。
+    1台のDHT22と、その測定値の記録・送信に使うものをまとめたもの。
 
-    Returns:
-        True: 初期化成功、False: 初期化失敗
+    device_name はNAS上のフォルダ名（incoming/<device_name>/）になるので、
+    コレクターからはセンサーごとに別のデバイスとして見える。
     """
-    global _dht_device
-    logger.info(f"DHT22センサーを初期化します (ピン: {DHT_PIN})...")
-    try:
-        # use_pulseio=False は adafruit_circuitpython_dht との相性が悪いため省略
-        _dht_device = adafruit_dht.DHT22(DHT_PIN)
-        logger.info("DHT22センサーの初期化に成功しました")
-        return True
-    except Exception as e:
-        logger.error(f"DHT22センサーの初期化に失敗しました: {e}")
-        logger.error(
-            "  【よくある原因と対処法】\n"
-            "  1. 前回の実行でGPIOが解放されていない（異常終了が原因）\n"
-            "       → sudo python3 gpio_reset.py を実行してください\n"
-            "  2. 多重起動している\n"
-            "       → ps aux | grep temp_humid で確認し、sudo kill <PID> で終了\n"
-            "  3. センサーの配線が外れている\n"
-            "       → DHT22のDATAピンがGPIO4（物理ピン7）に接続されているか確認"
-        )
-        _dht_device = None
-        return False
 
+    def __init__(self, device_name: str, pin, save_dir: str, retention_days: int,
+                 sample_capacity: int = None):
+        self.device_name = device_name
+        self.pin = pin
+        self.save_dir = save_dir
+        os.makedirs(save_dir, exist_ok=True)
+        header = AGGREGATE_CSV_HEADER if sample_capacity else CSV_HEADER
+        self.store = SegmentStore(save_dir, retention_days, header)
+        self.reader = None              # テストモードでは None（実センサーを使わない）
+        self.error_count = 0            # 連続で読み取りに失敗したサイクル数
+        # 高頻度サンプリング時に、1測定間隔ぶんのサンプルをためるRAM上のリングバッファ。
+        # SDカードには書かず、間隔ごとに集計した1行だけを記録する
+        self.samples = collections.deque(maxlen=sample_capacity) if sample_capacity else None
+        # 間引きモードの比較基準になる、最後に記録した (湿度, 温度, 時刻)。起動直後は None
+        self.last_recorded = None
 
-def _read_sensor() -> tuple:
-    """
-    DHT22センサーから温湿度を10秒のタイムアウト付きで読み取る。
 
-    DHT22は稀に .temperature の呼び出しで無限ブロックすることがある。
-    threading でタイムアウトを設けることでプログラムの凍結を防ぐ。
+# グローバル変数で全センサーを保持する。
+# atexit や finally ブロックから読み取りプロセスをクリーンアップするために必要。
+_sensors = []
 
-    Returns:
-        (humidity, temperature) のタプル。取得失敗時は (None, None)
+
+def _cleanup_sensor() -> None:
     """
-    global _dht_device
-    if _dht_device is None:
-        return None, None
+    DHT22センサーのリソースを解放する（全センサーの読み取りプロセスを終了させる）。
 
-    # スレッド間で結果・例外を共有するための辞書
-    result = {'temperature': None, 'humidity': None, 'error': None}
+    プログラムの終了方法（正常終了・例外・Ctrl+C・SIGTERM）を問わず、
+    必ず呼ばれるよう atexit.register と try/finally の両方で登録する。
 
-    def do_read():
+    センサーを解放しないと、次回起動時に
+    「unable to set line to input」エラーが出てGPIOが使えなくなり、
+    Raspberry Piの再起動が必要になる。
+    """
+    for sensor in _sensors:
+        if sensor.reader is None:
+            continue
         try:
-            result['temperature'] = _dht_device.temperature
-            result['humidity'] = _dht_device.humidity
+            sensor.reader.stop()
+            logger.info(f"DHT22センサー接続を終了しました [{sensor.device_name}]")
         except Exception as e:
-            result['error'] = e
+            logger.warning(f"センサー終了時のエラー（無視して続行）: {e}")
+        # 二重呼び出しを防ぐために None に戻す
+        sensor.reader = None
 
-    thread = threading.Thread(target=do_read, daemon=True)
-    thread.start()
-    thread.join(timeout=10)  # 10秒で読み取りをあきらめる
 
-    if thread.is_alive():
-        # タイムアウト：GPIOが応答していない
-        logger.warning("センサー読み取りが10秒でタイムアウトしました。再試行します...")
-        return None, None
+# atexitに登録：正常終了・例外終了いずれでも呼ばれる
+atexit.register(_cleanup_sensor)
 
-    if result['error'] is not None:
-        e = result['error']
-        if isinstance(e, RuntimeError):
-            # 読み取り失敗はDHT22では頻繁に起こる正常な一時エラー
-            logger.debug(f"DHT 取得失敗（一時的エラー）: {e}")
-        else:
-            # その他の重大エラーはセンサーをリセットして再初期化を試みる
-            logger.error(f"DHT 重大エラー: {e}")
-            try:
-                _dht_device.exit()
-            except Exception:
-                pass
-            _dht_device = None
-            time.sleep(2)
-            _init_sensor()
-        return None, None
 
-    temperature = result['temperature']
-    humidity = result['humidity']
-    if humidity is not None and temperature is not None:
-        return round(humidity, 3), round(temperature, 3)
+def _init_sensor(sensor: Sensor) -> bool:
+    """
+    DHT22センサーの読み取りプロセスを起動する。
 
-    logger.warning("センサーからのデータ取得に失敗しました。再試行します...")
-    return None, None
+    Returns:
+        True: 初期化成功、False: 初期化失敗（読み取りプロセスは次の読み取り時に作り直される）
+    """
+    logger.info(f"DHT22センサーを初期化します [{sensor.device_name}] (ピン: {sensor.pin})...")
+    sensor.reader = SensorReader(sensor.pin)
+    if sensor.reader.start():
+        logger.info(f"DHT22センサーの初期化に成功しました [{sensor.device_name}]")
+        return True
+
+    logger.error(
+        "  【よくある原因と対処法】\n"
+        "  1. 前回の実行でGPIOが解放されていない（異常終了が原因）\n"
+        "       → sudo python3 gpio_reset.py を実行してください\n"
+        "  2. 多重起動している\n"
+        "       → ps aux | grep temp_humid で確認し、sudo kill <PID> で終了\n"
+        "  3. センサーの配線が外れている\n"
+        f"       → DHT22のDATAピンが {sensor.pin} に接続されているか確認"
+    )
+    return False
 
 
-def _read_sensor_with_retry() -> tuple:
+def read_sensors(sensors: list, max_attempts: int = SENSOR_READ_RETRIES) -> dict:
     """
-    センサー読み取りを、失敗時はサイクル内で再試行する。
+    全センサーを並行して読み、失敗したセンサーはサイクル内で再試行する。
 
     以前は1サイクル1回しか読まなかったため、一時的な失敗でも
     次の測定（10分後）までデータ点が丸ごと欠けていた。
     DHT22の失敗のほとんどは数秒〜数十秒で回復する一時的なものなので、
     短い間隔で数回試すことで欠測をほぼ防げる。
 
+    各センサーは別々の読み取りプロセスで読むため、1台が固まったり再試行を
+    繰り返したりしても、他のセンサーの読み取りは待たされない。
+    センサーごとの読み取り間隔（2秒以上）は各読み取りプロセスが守る。
+    高頻度サンプリング時は次のサンプルがすぐ来るので、max_attempts=1 で再試行しない。
+
     Returns:
-        (humidity, temperature) のタプル。全試行失敗時は (None, None)
+        {デバイス名: (humidity, temperature)}。全試行失敗したセンサーは (None, None)
     """
-    for attempt in range(1, SENSOR_READ_RETRIES + 1):
-        humidity, temperature = _read_sensor()
-        if humidity is not None and temperature is not None:
-            if attempt > 1:
-                logger.info(f"{attempt}回目の試行で読み取りに成功しました")
-            return humidity, temperature
-        if attempt < SENSOR_READ_RETRIES:
-            logger.info(
-                f"読み取りに失敗しました（{attempt}/{SENSOR_READ_RETRIES}回目）。"
-                f"{SENSOR_RETRY_INTERVAL_SEC}秒後に再試行します"
-            )
-            time.sleep(SENSOR_RETRY_INTERVAL_SEC)
-    return None, None
+    results = {}
+    attempts = {sensor.device_name: 0 for sensor in sensors}
+    next_attempt_time = {sensor.device_name: 0.0 for sensor in sensors}
+    in_flight = set()
+
+    while len(results) < len(sensors):
+        now = time.monotonic()
+        for sensor in sensors:
+            name = sensor.device_name
+            if name in results:
+                continue
+            if name not in in_flight:
+                if now < next_attempt_time[name]:
+                    continue
+                attempts[name] += 1
+                sensor.reader.request_read()
+                in_flight.add(name)
+
+            value = sensor.reader.poll()
+            if value is None:
+                continue
+            in_flight.discard(name)
+            if value[0] is not None:
+                if attempts[name] > 1:
+                    logger.info(f"[{name}] {attempts[name]}回目の試行で読み取りに成功しました")
+                results[name] = value
+            elif attempts[name] >= max_attempts:
+                results[name] = (None, None)
+            else:
+                logger.info(
+                    f"[{name}] 読み取りに失敗しました（{attempts[name]}/{max_attempts}回目）。"
+                    f"{SENSOR_RETRY_INTERVAL_SEC}秒後に再試行します"
+                )
+                next_attempt_time[name] = now + SENSOR_RETRY_INTERVAL_SEC
+
+        if len(results) == len(sensors):
+            break
+        # 応答が届くか、次の再試行時刻になるまで待つ（長くても0.5秒ごとに状態を見直す）
+        now = time.monotonic()
+        timeout = min([0.5] + [max(0.0, next_attempt_time[sensor.device_name] - now)
+                               for sensor in sensors
+                               if sensor.device_name not in results
+                               and sensor.device_name not in in_flight])
+        connections = [sensor.reader.connection for sensor in sensors
+                       if sensor.device_name in in_flight and sensor.reader.connection is not None]
+        if connections:
+            multiprocessing.connection.wait(connections, timeout)
+        else:
+            time.sleep(timeout)
+    return results
 
 
 def _generate_test_data() -> tuple:
@@ -260,40 +490,416 @@ def _generate_test_data() -> tuple:
     return round(humidity, 3), round(temperature, 3)
 
 
+def _take_readings(sensors: list, test_mode: bool, max_attempts: int) -> dict:
+    """全センサーを1回ずつ読む（テストモードではダミーデータ）。{デバイス名: (humidity, temperature)}"""
+    if test_mode:
+        return {sensor.device_name: _generate_test_data() for sensor in sensors}
+    return read_sensors(sensors, max_attempts)
+
+
+def collect_samples(sensors: list, test_mode: bool, sample_interval: float,
+                    deadline: float = None) -> None:
+    """
+    deadline（time.monotonic() の値）まで、sample_interval 秒ごとに全センサーを読み、
+    各センサーのリングバッファにためる。deadline ちょうどに戻る。
+
+    サンプルの時刻は deadline から sample_interval 刻みで逆算した格子に乗せるので、
+    読み取りに時間がかかっても間隔がずれていかない。
+    読み取りに失敗したサンプルは捨てるだけで再試行しない（すぐ次のサンプルがあるため）。
+    deadline が None なら1回だけ読む。
+    """
+    while True:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # deadline より前で、いちばん近い格子点まで待つ
+            _sleep_until(deadline - (remaining // sample_interval) * sample_interval)
+            if deadline - time.monotonic() < DHT_MIN_READ_INTERVAL_SEC:
+                _sleep_until(deadline)
+                return
+        readings = _take_readings(sensors, test_mode, max_attempts=1)
+        for sensor in sensors:
+            humidity, temperature = readings[sensor.device_name]
+            if humidity is not None and temperature is not None:
+                sensor.samples.append((humidity, temperature))
+        if deadline is None:
+            return
+
+
+# =============================================================================
+# 測定スケジュール
+# =============================================================================
+
+def _sleep_until(deadline: float) -> None:
+    """time.monotonic() が deadline に達するまで待つ（時計合わせの影響を受けない）"""
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(remaining)
+
+
+class IntervalSchedule:
+    """
+    測定タイミングを壁時計の区切り（10分間隔なら :00, :10, :20, ...）に揃える。
+
+    「処理してから CHECK_INTERVAL_SEC 眠る」方式では、読み取りの再試行や送信の時間の分だけ
+    周期が毎回延びて時刻がずれていき、Piごとに測定時刻もばらばらになる。
+    ここでは次の区切りを壁時計で求め、そこまでの待ち時間を time.monotonic() の締め切りに
+    換算して待つ。処理が長引いて区切りを過ぎた場合は、遅れを取り戻そうと続けて測らず、
+    過ぎた区切りは飛ばして次の区切りで測る。
+    """
+
+    def __init__(self, interval_sec: int):
+        self.interval_sec = interval_sec
+        self._last_slot = None   # 直前に返した区切り（ローカル時刻の壁時計秒）
+
+    def next_slot(self) -> tuple:
+        """
+        次の区切りを (その時刻の datetime, 対応する time.monotonic() の締め切り) で返す。
+        """
+        now_wall = time.time()
+        now_monotonic = time.monotonic()
+        # タイムゾーンのずれを足してから割ることで、ローカル時刻の区切りに揃える
+        utc_offset = datetime.datetime.fromtimestamp(now_wall).astimezone().utcoffset().total_seconds()
+        local_now = now_wall + utc_offset
+        slot = (local_now // self.interval_sec + 1) * self.interval_sec
+
+        if self._last_slot is not None:
+            # 区切りの直前に起きた場合に同じ区切りを2度返さない
+            slot = max(slot, self._last_slot + self.interval_sec)
+            skipped = int((slot - self._last_slot) // self.interval_sec) - 1
+            if skipped > 0:
+                logger.warning(f"前回の処理が長引いたため、測定を{skipped}回飛ばしました")
+        self._last_slot = slot
+
+        slot_time = datetime.datetime.fromtimestamp(slot - utc_offset)
+        return slot_time, now_monotonic + (slot - local_now)
+
+    def wait_next(self) -> datetime.datetime:
+        """次の区切りまで待ち、その区切りの時刻を返す"""
+        slot_time, deadline = self.next_slot()
+        logger.info(f"次の測定（{slot_time:%H:%M:%S}）まで {max(0.0, deadline - time.monotonic()):.0f} 秒待機します...")
+        _sleep_until(deadline)
+        return slot_time
+
+
 # =============================================================================
 # CSV記録
 # =============================================================================
 
-def save_to_csv(csv_path: str, humidity: float, temperature: float) -> None:
-    """測定値をCSVファイルに追記する"""
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+# 旧版の temperature_log.csv を移行したセグメントの名前。日付入りの名前より前に並ぶ
+LEGACY_SEGMENT_NAME = 'temperature_log_00000000_000.csv'
+SEGMENT_NAME_PATTERN = re.compile(r'^temperature_log_(\d{8})_(\d{3})\.csv$')
+
+
+class SegmentStore:
+    """
+    ローカル記録（送信バッファ兼NAS障害時の予備）を、日ごと・サイズ上限ごとの
+    セグメントCSVに分けて持つ。
+
+    以前は1つの temperature_log.csv に永久に追記していたため、稼働年数とともに
+    送信処理やSDカードの使用量が増え続けた。セグメントに分けることで
+      - 追記先は常に最新の小さなセグメント（日付が変わるか SEGMENT_MAX_BYTES を超えたら次へ）
+      - 送信し終えたセグメントは archive/ にgzip圧縮して移す
+      - archive は保持日数を過ぎたら削除する
+    となり、稼働1日目でも5年目でも各処理のコストが変わらない。
+    未送信のセグメントは保持日数に関係なく消さない（NAS障害中のデータを守るため）。
+
+    フォルダ構成（--save-dir 以下）:
+        segments/temperature_log_YYYYMMDD_NNN.csv     未送信・送信途中のセグメント
+        archive/temperature_log_YYYYMMDD_NNN.csv.gz   送信済みセグメント（保持日数まで）
+    """
+
+    def __init__(self, save_dir: str, retention_days: int, header: list = CSV_HEADER):
+        self.segment_dir = os.path.join(save_dir, SEGMENT_DIRNAME)
+        self.archive_dir = os.path.join(save_dir, ARCHIVE_DIRNAME)
+        self.retention_days = retention_days
+        self.header = header
+        self._active_path = None
+        self._active_header_matches = False
+        os.makedirs(self.segment_dir, exist_ok=True)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        # 旧版の単一CSVがあれば、最も古いセグメントとして取り込む
+        # （送信済み位置もそのまま引き継がれる。_load_upload_cursor 参照）
+        legacy_path = os.path.join(save_dir, CSV_FILENAME)
+        if os.path.exists(legacy_path):
+            os.replace(legacy_path, self.segment_path(LEGACY_SEGMENT_NAME))
+            logger.info(f"旧形式のCSVをセグメントに移行しました: {LEGACY_SEGMENT_NAME}")
+
+    def segment_path(self, segment_name: str) -> str:
+        return os.path.join(self.segment_dir, segment_name)
+
+    def list_segments(self) -> list:
+        """セグメント名を古い順に返す。最後の1つが追記中のセグメント"""
+        return sorted(name for name in os.listdir(self.segment_dir)
+                      if SEGMENT_NAME_PATTERN.match(name))
+
+    def append(self, row: list) -> None:
+        """1行を追記中のセグメントに書き込む"""
+        path = self._current_segment_path()
+        with open(path, 'a', newline='') as f:
+            csv.writer(f).writerow(row)
+
+    def _current_segment_path(self) -> str:
+        """
+        追記先のセグメントを返す。日付が変わったかサイズ上限を超えたら新しいセグメントを作る。
+
+        ディレクトリの一覧は起動後の初回だけ読み、以降は追記先を覚えておく。
+        起動時に見つけた最新セグメントの列構成（ヘッダー）が今の設定と違う場合
+        （--sample-interval の有無を切り替えた場合）も、新しいセグメントを作る。
+        """
+        today = datetime.date.today().strftime('%Y%m%d')
+        if self._active_path is None:
+            segments = self.list_segments()
+            if segments:
+                self._active_path = self.segment_path(segments[-1])
+                with open(self._active_path, newline='') as f:
+                    self._active_header_matches = next(csv.reader(f), None) == self.header
+
+        if self._active_path is not None:
+            date_text, sequence = SEGMENT_NAME_PATTERN.match(
+                os.path.basename(self._active_path)).groups()
+            if (date_text == today and self._active_header_matches
+                    and os.path.getsize(self._active_path) < SEGMENT_MAX_BYTES):
+                return self._active_path
+            next_sequence = int(sequence) + 1 if date_text == today else 0
+        else:
+            next_sequence = 0
+
+        path = self.segment_path(f"temperature_log_{today}_{next_sequence:03d}.csv")
+        with open(path, 'w', newline='') as f:
+            csv.writer(f).writerow(self.header)
+        logger.info(f"新しいセグメントを作成しました: {os.path.basename(path)}")
+        self._active_path = path
+        self._active_header_matches = True
+        return path
+
+    def archive(self, segment_name: str) -> None:
+        """
+        送信し終えたセグメントをgzip圧縮して archive/ に移す。
+
+        圧縮は一時ファイルに書いてから置き換えるため、途中で電源が落ちても
+        元のセグメントが残り、次回の送信サイクルで圧縮し直される。
+        """
+        source_path = self.segment_path(segment_name)
+        archive_path = os.path.join(self.archive_dir, segment_name + '.gz')
+        temp_path = archive_path + '.tmp'
+        try:
+            with open(source_path, 'rb') as source, gzip.open(temp_path, 'wb') as archive:
+                shutil.copyfileobj(source, archive)
+            os.replace(temp_path, archive_path)
+            os.remove(source_path)
+            logger.info(f"送信済みセグメントを圧縮しました: {os.path.basename(archive_path)}")
+        except Exception as e:
+            logger.error(f"セグメントの圧縮に失敗しました（次回再試行します）: {e}")
+            return
+        self.prune_archives()
+
+    def prune_archives(self) -> None:
+        """保持日数を過ぎた archive を削除する（圧縮した時刻を基準にする）"""
+        cutoff = time.time() - self.retention_days * 86400
+        for name in os.listdir(self.archive_dir):
+            path = os.path.join(self.archive_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    logger.info(f"保持期間を過ぎたアーカイブを削除しました: {name}")
+            except Exception as e:
+                logger.warning(f"アーカイブの削除に失敗しました: {name}: {e}")
+
+
+def save_to_csv(store: SegmentStore, humidity: float, temperature: float,
+                extra_columns: list = (), measured_at: datetime.datetime = None) -> None:
+    """
+    測定値（集計行の場合は min/max/サンプル数の列も）をローカルのセグメントCSVに追記する。
+    measured_at を省略すると現在時刻で記録する。
+    """
+    timestamp = (measured_at or datetime.datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
     try:
-        with open(csv_path, 'a', newline='') as f:
-            csv.writer(f).writerow([timestamp, temperature, humidity])
+        store.append([timestamp, temperature, humidity, *extra_columns])
     except Exception as e:
         logger.error(f"CSV書き込みエラー: {e}")
 
 
+def aggregate_samples(samples) -> tuple:
+    """
+    1測定間隔ぶんのサンプル（(humidity, temperature) の並び）を1行にまとめる。
+
+    Returns:
+        (湿度の平均, 温度の平均, [温度min, 温度max, 湿度min, 湿度max, サンプル数])
+    """
+    humidities = [humidity for humidity, _ in samples]
+    temperatures = [temperature for _, temperature in samples]
+    return (
+        round(sum(humidities) / len(humidities), 3),
+        round(sum(temperatures) / len(temperatures), 3),
+        [min(temperatures), max(temperatures), min(humidities), max(humidities), len(samples)],
+    )
+
+
+def should_record(sensor: Sensor, humidity: float, temperature: float, extra_columns,
+                  now: datetime.datetime, deadband_temp: float, deadband_humid: float,
+                  heartbeat_minutes: int) -> bool:
+    """
+    間引きモードで、この測定値を記録するかどうかを決める。
+
+    最後に記録した値から温度が deadband_temp、湿度が deadband_humid を超えて動いたか、
+    heartbeat_minutes が経過したときだけ記録する。どちらの幅も未指定なら間引きしない。
+    集計行は間隔内の最小・最大も比べるので、平均に埋もれた短時間の変化でも記録される。
+    """
+    if deadband_temp is None and deadband_humid is None:
+        return True
+    if sensor.last_recorded is None:
+        return True  # 起動後の1行目は必ず記録する
+
+    last_humidity, last_temperature, last_time = sensor.last_recorded
+    # 測定時刻は読み取り・再試行の分だけ毎回少しずれるため、半間隔の余裕を持たせる
+    # （ぴったりで比べると、ハートビートが1間隔ぶん遅れることがある）
+    elapsed_sec = (now - last_time).total_seconds()
+    if elapsed_sec >= heartbeat_minutes * 60 - CHECK_INTERVAL_SEC / 2:
+        return True
+
+    temperatures = [temperature]
+    humidities = [humidity]
+    if extra_columns:
+        temperatures += extra_columns[0:2]
+        humidities += extra_columns[2:4]
+    if deadband_temp is not None and any(
+            abs(value - last_temperature) > deadband_temp for value in temperatures):
+        return True
+    if deadband_humid is not None and any(
+            abs(value - last_humidity) > deadband_humid for value in humidities):
+        return True
+    return False
+
+
 # =============================================================================
 # NASへのデータ送信
 # =============================================================================
 
-def _load_uploaded_row_count(state_path: str) -> int:
-    """送信済みのデータ行数をステートファイルから読む。無ければ0（＝全行未送信）"""
+def _read_last_line_before(f, offset: int) -> bytes:
+    """
+    バイナリで開いたファイルの offset 直前で終わる1行（改行込み）を返す。
+
+    送信済み位置の検証用。CSVの1行は数十バイトなので、末尾から小さく読み戻すだけで済む。
+    """
+    start = max(0, offset - 4096)
+    f.seek(start)
+    block = f.read(offset - start)
+    # 最後の改行（＝送信済み最終行の終端）の手前にある改行の次から始まる部分が最終行
+    line_start = block.rfind(b'\n', 0, len(block) - 1) + 1
+    return block[line_start:]
+
+
+def _count_offset_of_rows(csv_path: str, row_count: int) -> tuple:
+    """
+    旧形式（送信済み行数）のステートを変換するため、ヘッダー＋row_count行の終端位置を求める。
+
+    移行時の1回だけ全体を読むが、行を保持せずに数えるだけなのでメモリは増えない。
+
+    Returns:
+        (バイト位置, 最終行のbytes)。行数がファイルより多ければ (None, None)
+    """
+    offset = 0
+    last_line = b''
+    with open(csv_path, 'rb') as f:
+        # ヘッダー行＋送信済みのrow_count行を読み飛ばす
+        for _ in range(row_count + 1):
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                # ファイルが記録された行数より短い（または書きかけの行に当たった）
+                return None, None
+            offset += len(line)
+            last_line = line
+    return offset, last_line
+
+
+def _load_upload_cursor(state_path: str, store: SegmentStore) -> tuple:
+    """
+    送信済み位置（どのセグメントの何バイト目まで送ったか）をステートファイルから読む。
+
+    ステートファイルの形式:
+        segment=<送信中のセグメント名>
+        offset=<そのセグメント内の送信済み部分の終端のバイト位置>
+        last_line_crc32=<送信済み最終行のCRC32（16進）>
+    これより名前が古いセグメントは送信済み、新しいセグメントは未送信を表す。
+    CRC32はセグメントが作り直された・切り詰められた場合に、無関係な位置から
+    送ってしまうのを防ぐための照合用。一致しなければそのセグメントを最初から再送する
+    （コレクターは重複を捨てるので、再送してもデータは壊れない）。
+
+    旧形式（segment= の無い単一CSV用の形式や、送信済み行数の整数のみ）は
+    旧CSVを移行したセグメント（LEGACY_SEGMENT_NAME）の位置として読み替える。
+
+    Returns:
+        (セグメント名, バイト位置)。バイト位置が None ならそのセグメントの先頭（ヘッダー直後）から。
+        ステートが無い・読めない場合は ('', None)（全セグメントが未送信扱い）
+    """
+    if not os.path.exists(state_path):
+        return '', None
+
+    try:
+        with open(state_path) as f:
+            text = f.read().strip()
+
+        # 旧形式: 送信済みのデータ行数だけが書かれている
+        if text.isdigit():
+            legacy_path = store.segment_path(LEGACY_SEGMENT_NAME)
+            if not os.path.exists(legacy_path):
+                return '', None
+            offset, last_line = _count_offset_of_rows(legacy_path, int(text))
+            if offset is None:
+                logger.warning("旧形式の送信状態がCSVと一致しないため、最初から再送します")
+                return LEGACY_SEGMENT_NAME, None
+            _save_upload_cursor(state_path, LEGACY_SEGMENT_NAME, offset, last_line)
+            logger.info(f"送信状態ファイルを新形式に変換しました（{text}行 → {offset}バイト目）")
+            return LEGACY_SEGMENT_NAME, offset
+
+        fields = dict(line.split('=', 1) for line in text.splitlines() if '=' in line)
+        segment_name = fields.get('segment', LEGACY_SEGMENT_NAME)
+        offset = int(fields['offset'])
+        expected_crc = int(fields['last_line_crc32'], 16)
+    except Exception as e:
+        logger.warning(f"送信状態ファイルが使えないため、最初から再送します: {e}")
+        return '', None
+
+    segment_path = store.segment_path(segment_name)
+    if not os.path.exists(segment_path):
+        # 送信し終えて圧縮済み（以降のセグメントは未送信）
+        return segment_name, None
     try:
-        if os.path.exists(state_path):
-            with open(state_path) as f:
-                return int(f.read().strip())
+        with open(segment_path, 'rb') as f:
+            header_end = len(f.readline())
+            if offset <= header_end:
+                return segment_name, None
+            if offset > os.fstat(f.fileno()).st_size:
+                raise ValueError("送信済み位置がセグメントの末尾を超えています")
+            if zlib.crc32(_read_last_line_before(f, offset)) != expected_crc:
+                raise ValueError("送信済み最終行のCRC32が一致しません")
+        return segment_name, offset
     except Exception as e:
-        logger.warning(f"送信状態ファイルの読み込みに失敗しました（最初から再送します）: {e}")
-    return 0
+        logger.warning(f"送信状態が {segment_name} と一致しないため、このセグメントを最初から再送します: {e}")
+    return segment_name, None
+
 
+def _save_upload_cursor(state_path: str, segment_name: str, offset: int,
+                        last_line: bytes) -> None:
+    """
+    送信済み位置をステートファイルに保存する。
 
-def _save_uploaded_row_count(state_path: str, count: int) -> None:
-    """送信済みのデータ行数をステートファイルに保存する"""
+    書きかけのステートファイルが残らないよう、一時ファイルに書いてから置き換える。
+    """
+    temp_path = state_path + '.tmp'
     try:
-        with open(state_path, 'w') as f:
-            f.write(str(count))
+        with open(temp_path, 'w') as f:
+            f.write(
+                f"segment={segment_name}\n"
+                f"offset={offset}\n"
+                f"last_line_crc32={zlib.crc32(last_line):08x}\n"
+            )
+        os.replace(temp_path, state_path)
     except Exception as e:
         logger.error(f"送信状態ファイルの保存に失敗しました: {e}")
 
@@ -303,142 +909,515 @@ def _is_remote_target(nas_target: str) -> bool:
     return re.match(r'^[^/@\s]+@[^:@\s]+:', nas_target) is not None
 
 
-def _transfer_via_sftp(local_path: str, nas_target: str, device_name: str,
-                       remote_filename: str, ssh_key: str) -> bool:
+def _sftp_quote(path: str) -> str:
     """
-    チャンクCSVをSFTPでNASに送信する。
+    sftp のバッチコマンドに書くパスを、空白や # を含んでも1つの引数になるよう二重引用符で囲む。
 
-    sftpのバッチモードを使い、デバイス用ディレクトリの作成（既にあれば無視）と
-    ファイルのputを1接続で行う。scpではなくsftpを使うのは、
-    リモート側にディレクトリを作成できるのがsftpだけのため。
+    OpenSSH の sftp は、引用符の中の「\\"」だけを引用符として読み、それ以外の「\\」はそのまま残す
+    （「\\\\」と書いても1文字にならない）。そのため引用符は「\\"」にし、引用符の前に来る「\\」と改行
+    （バッチの1行が分かれる）は正しく書き表せないので、ValueError にする。
+    """
+    if '\n' in path or '\r' in path:
+        raise ValueError(f"改行を含むパスはsftpで送れません: {path!r}")
+    if '\\"' in path or path.endswith('\\'):
+        raise ValueError(f"引用符の前に \\ があるパスはsftpで送れません: {path!r}")
+    return '"' + path.replace('"', '\\"') + '"'
 
-    Returns:
-        True: 送信成功、False: 失敗
+
+class SftpTransport:
     """
-    # user@host:/base/path を接続先とリモートパスに分解する
-    host_part, base_path = nas_target.split(':', 1)
-    remote_dir = f"{base_path.rstrip('/')}/{device_name}"
+    チャンクCSVをSFTPでNASに送信する。
 
-    # バッチコマンド。-mkdir の先頭の「-」は「失敗しても続行」の意味
-    # （2回目以降はディレクトリが既に存在してエラーになるため）
-    batch_commands = f"-mkdir {remote_dir}\nput {local_path} {remote_dir}/{remote_filename}\n"
+    以前は送信のたびに sftp を起動していたため、数百バイトのチャンクごとに
+    TCP接続とSSHハンドシェイクが発生していた。ここでは OpenSSH の多重化
+    （ControlMaster）でNASへのマスター接続を1本張りっぱなしにし、各送信の sftp は
+    その接続の上で動かす（ハンドシェイクはセッション開始時の1回だけ）。
 
-    try:
-        completed = subprocess.run(
-            [
-                'sftp',
-                '-i', os.path.expanduser(ssh_key),
-                '-o', 'BatchMode=yes',            # パスワードを聞かれたら失敗させる（無人運用のため）
-                '-o', 'ConnectTimeout=15',
-                '-b', '-',                        # バッチコマンドを標準入力から渡す
-                host_part,
-            ],
-            input=batch_commands,
-            capture_output=True,
-            text=True,
-            timeout=TRANSFER_TIMEOUT_SEC,
-        )
-    except FileNotFoundError:
-        logger.error("sftpコマンドが見つかりません。openssh-clientをインストールしてください")
+      - マスター接続が切れていたら次の送信時に張り直す。失敗が続く場合は
+        SFTP_RECONNECT_BACKOFF_BASE_SEC から倍々に（上限 SFTP_RECONNECT_BACKOFF_MAX_SEC）
+        間隔をあけて再接続する（NAS停止中に毎回接続を試みて詰まらないように）
+      - デバイス用ディレクトリの作成（-mkdir）はセッションごとに1回だけ行う
+
+    scpではなくsftpを使うのは、リモート側にディレクトリを作成できるのがsftpだけのため。
+    """
+
+    def __init__(self, nas_target: str, ssh_key: str):
+        # user@host:/base/path を接続先とリモートパスに分解する
+        self.host_part, base_path = nas_target.split(':', 1)
+        self.base_path = base_path.rstrip('/')
+        self.ssh_key = os.path.expanduser(ssh_key)
+        # UNIXソケットのパス長制限（約100文字）に収まるよう /tmp 以下に置く
+        self.control_path = f'/tmp/temp_humid_notifier_ssh_{os.getpid()}.sock'
+        self._master = None
+        self._master_log = None           # マスター接続の stderr の書き先（接続に失敗したときだけ読む）
+        self._ready_dirs = set()          # このセッションで作成済み（確認済み）のリモートディレクトリ
+        self._failure_count = 0
+        self._next_attempt_time = 0.0     # 再接続を試してよい時刻（time.monotonic() 基準）
+
+    def _ssh_options(self) -> list:
+        return [
+            '-i', self.ssh_key,
+            '-o', 'BatchMode=yes',            # パスワードを聞かれたら失敗させる（無人運用のため）
+            '-o', 'ConnectTimeout=15',
+            '-o', f'ControlPath={self.control_path}',
+        ]
+
+    def _open_session(self) -> bool:
+        """マスター接続を張る。成功したら True"""
+        # マスターは何日も動き続けるので、stderr をパイプにすると誰も読まないまま警告が溜まり、
+        # パイプが一杯になった時点でマスターが止まる（以後の送信が全て固まる）。
+        # 一時ファイルに書かせて、接続に失敗したときだけ読む
+        self._master_log = tempfile.TemporaryFile(mode='w+')
+        try:
+            self._master = subprocess.Popen(
+                ['ssh', '-M', '-N', *self._ssh_options(),
+                 '-o', 'ServerAliveInterval=60',   # 無通信で切られないよう、また切断を検出できるように
+                 '-o', 'ServerAliveCountMax=3',
+                 self.host_part],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=self._master_log,
+            )
+        except FileNotFoundError:
+            logger.error("sshコマンドが見つかりません。openssh-clientをインストールしてください")
+            self._close_session()
+            return False
+
+        # マスターがソケットを作って接続を確立するまで待つ
+        deadline = time.monotonic() + TRANSFER_TIMEOUT_SEC
+        while time.monotonic() < deadline:
+            if self._master.poll() is not None:
+                self._master_log.seek(0)
+                logger.error(f"NASへのSSH接続に失敗しました: {self._master_log.read().strip()}")
+                self._master = None
+                self._close_session()
+                return False
+            try:
+                check = subprocess.run(
+                    ['ssh', '-O', 'check', '-o', f'ControlPath={self.control_path}', self.host_part],
+                    capture_output=True,
+                    timeout=SSH_CONTROL_TIMEOUT_SEC,
+                )
+            except subprocess.TimeoutExpired:
+                # マスターが固まっている。張り直しは _ensure_session のバックオフに任せる
+                logger.error(f"NASへのSSHマスター接続が{SSH_CONTROL_TIMEOUT_SEC}秒応答しません。切断します")
+                self._close_session()
+                return False
+            if check.returncode == 0:
+                return True
+            time.sleep(0.5)
+
+        logger.error(f"NASへのSSH接続が{TRANSFER_TIMEOUT_SEC}秒でタイムアウトしました")
+        self._close_session()
         return False
-    except subprocess.TimeoutExpired:
-        logger.error(f"NASへの送信が{TRANSFER_TIMEOUT_SEC}秒でタイムアウトしました")
+
+    def _session_alive(self) -> bool:
+        return self._master is not None and self._master.poll() is None
+
+    def _close_session(self) -> None:
+        if self._master is not None:
+            try:
+                subprocess.run(
+                    ['ssh', '-O', 'exit', '-o', f'ControlPath={self.control_path}', self.host_part],
+                    capture_output=True,
+                    timeout=SSH_CONTROL_TIMEOUT_SEC,
+                )
+            except subprocess.TimeoutExpired:
+                pass  # 固まったマスターは下で強制終了する
+            try:
+                self._master.terminate()
+                self._master.wait(timeout=5)
+            except Exception:
+                self._master.kill()
+            self._master = None
+        if self._master_log is not None:
+            self._master_log.close()
+            self._master_log = None
+
+    def _run_batch(self, batch_commands: str) -> tuple:
+        """
+        マスター接続の上で sftp のバッチコマンドを実行する。
+
+        Returns:
+            (成功したか, 失敗時のエラー内容)
+        """
+        try:
+            completed = subprocess.run(
+                ['sftp', *self._ssh_options(), '-b', '-', self.host_part],  # -b - : 標準入力からバッチ
+                input=batch_commands,
+                capture_output=True,
+                text=True,
+                timeout=TRANSFER_TIMEOUT_SEC,
+            )
+        except FileNotFoundError:
+            return False, "sftpコマンドが見つかりません。openssh-clientをインストールしてください"
+        except subprocess.TimeoutExpired:
+            # マスター接続が固まっていると次の送信も固まるので、接続を捨てて次回張り直す
+            self._close_session()
+            return False, f"{TRANSFER_TIMEOUT_SEC}秒でタイムアウトしました"
+        if completed.returncode != 0:
+            return False, f"exit={completed.returncode}: {completed.stderr.strip()}"
+        return True, ''
+
+    def _ensure_session(self) -> bool:
+        """セッションが無ければ（再接続待ちの間でなければ）張り直す"""
+        if self._session_alive():
+            return True
+        if self._master is not None:
+            logger.warning("NASへのSSH接続が切れていました。再接続します")
+            self._close_session()
+
+        now = time.monotonic()
+        if now < self._next_attempt_time:
+            logger.info(f"NASへの再接続は {self._next_attempt_time - now:.0f} 秒後まで待機します")
+            return False
+
+        self._ready_dirs = set()
+        if self._open_session():
+            if self._failure_count:
+                logger.info("NASへのSSH接続を再確立しました")
+            self._failure_count = 0
+            return True
+
+        self._failure_count += 1
+        backoff = min(SFTP_RECONNECT_BACKOFF_BASE_SEC * 2 ** (self._failure_count - 1),
+                      SFTP_RECONNECT_BACKOFF_MAX_SEC)
+        self._next_attempt_time = now + backoff
         return False
 
-    if completed.returncode != 0:
-        logger.error(
-            f"NASへの送信に失敗しました (exit={completed.returncode}): "
-            f"{completed.stderr.strip()}"
-        )
+    def put(self, local_path: str, device_name: str, remote_filename: str) -> bool:
+        """
+        ファイルを <base_path>/<device_name>/<remote_filename> に送信する。
+
+        Returns:
+            True: 送信成功、False: 失敗
+        """
+        remote_dir = f"{self.base_path}/{device_name}"
+        try:
+            # --nas-target や --save-dir に空白・# があっても1つの引数になるよう、パスは全て引用符で囲む
+            quoted_dir = _sftp_quote(remote_dir)
+            quoted_put = f"put {_sftp_quote(local_path)} {_sftp_quote(f'{remote_dir}/{remote_filename}')}\n"
+        except ValueError as e:
+            logger.error(f"NASへの送信に失敗しました: {e}")
+            return False
+
+        if not self._ensure_session():
+            return False
+
+        batch_commands = ''
+        if remote_dir not in self._ready_dirs:
+            # -mkdir の先頭の「-」は「失敗しても続行」の意味（既に存在するとエラーになるため）
+            batch_commands += f"-mkdir {quoted_dir}\n"
+        batch_commands += quoted_put
+
+        success, error_text = self._run_batch(batch_commands)
+        if not success:
+            logger.error(f"NASへの送信に失敗しました: {error_text}")
+            # 接続自体が切れていた場合は次回張り直す。ディレクトリ作成済みの記録も捨てておく
+            if not self._session_alive():
+                self._close_session()
+            self._ready_dirs.discard(remote_dir)
+            return False
+        self._ready_dirs.add(remote_dir)
+        return True
+
+    def is_stalled(self) -> bool:
+        """送信の操作はその場で終わる（タイムアウトで止める）ので、持ち越している操作は無い"""
         return False
-    return True
+
+    def close(self) -> None:
+        self._close_session()
 
 
-def _transfer_via_local_copy(local_path: str, nas_target: str, device_name: str,
-                             remote_filename: str) -> bool:
+class LocalCopyTransport:
     """
     チャンクCSVをディレクトリにコピーする。
 
     --nas-target に通常のディレクトリパスを渡した場合に使われる。
     通常運用ではNASのSMBマウント先（/mnt/sensor_data/incoming）を指定する。
     テスト時は任意のローカルフォルダも指定できる。
+
+    SMBマウントはNASが応答しなくなると、os.path.isdir や copy の呼び出しが
+    何分も（場合によっては戻らないまま）固まる。そこでマウント先への操作は使い捨ての
+    スレッドで行い、時間内に戻らなければ失敗として扱う。固まったスレッドは放っておくしかないので、
+    それが戻るまでは新しい操作を始めない（固まったスレッドが積み上がるのを防ぐ）。
     """
-    # 送信先ベースフォルダ（incoming）はNAS上にのみ存在する。
-    # マウントが外れていると /mnt/sensor_data は空になり incoming が見えないため、
-    # ここで検出できる。無い場合に作ってしまうと、SDカード上の隠れたフォルダに
-    # 書き込まれて「送信成功」と誤記録される事故になるので、作らずに失敗させる
-    if not os.path.isdir(nas_target):
-        logger.error(
-            f"送信先フォルダが見つかりません: {nas_target}\n"
-            "  NASのマウントを確認してください: ls /mnt/sensor_data\n"
-            "  マウントし直す場合: sudo mount -a"
-        )
-        return False
 
-    destination_dir = os.path.join(nas_target, device_name)
-    try:
-        os.makedirs(destination_dir, exist_ok=True)
-        shutil.copy2(local_path, os.path.join(destination_dir, remote_filename))
-        return True
-    except Exception as e:
-        logger.error(f"ローカルコピーに失敗しました: {e}")
-        return False
+    def __init__(self, nas_target: str):
+        self.nas_target = nas_target
+        self._stuck_thread = None   # 時間内に戻らなかったマウント先への操作
+
+    def _call_with_timeout(self, func, timeout_sec: float, description: str):
+        """
+        func() を別スレッドで実行し、timeout_sec 以内に戻ればその戻り値を返す。
+        時間切れ・前回の操作がまだ固まっている場合は None を返す（func の例外はそのまま送出する）。
+        """
+        if self.is_stalled():
+            logger.warning(f"NASのマウント先への前回の操作がまだ戻らないため、{description}を見送ります")
+            return None
+
+        outcome = {}
+
+        def target() -> None:
+            try:
+                outcome['value'] = func()
+            except BaseException as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=target, name='nas-fs-call', daemon=True)
+        thread.start()
+        thread.join(timeout_sec)
+        if thread.is_alive():
+            self._stuck_thread = thread
+            logger.error(f"NASのマウント先が {timeout_sec} 秒応答しません（{description}）: {self.nas_target}")
+            return None
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['value']
+
+    def is_stalled(self) -> bool:
+        """時間内に戻らなかったマウント先への操作（コピーなど）がまだ動いていれば True"""
+        if self._stuck_thread is not None and not self._stuck_thread.is_alive():
+            self._stuck_thread = None
+        return self._stuck_thread is not None
+
+    def put(self, local_path: str, device_name: str, remote_filename: str) -> bool:
+        # 送信先ベースフォルダ（incoming）はNAS上にのみ存在する。
+        # マウントが外れていると /mnt/sensor_data は空になり incoming が見えないため、
+        # ここで検出できる。無い場合に作ってしまうと、SDカード上の隠れたフォルダに
+        # 書き込まれて「送信成功」と誤記録される事故になるので、作らずに失敗させる
+        is_dir = self._call_with_timeout(lambda: os.path.isdir(self.nas_target),
+                                         NAS_PROBE_TIMEOUT_SEC, '送信先フォルダの確認')
+        if is_dir is None:
+            return False
+        if not is_dir:
+            logger.error(
+                f"送信先フォルダが見つかりません: {self.nas_target}\n"
+                "  NASのマウントを確認してください: ls /mnt/sensor_data\n"
+                "  マウントし直す場合: sudo mount -a"
+            )
+            return False
+
+        destination_dir = os.path.join(self.nas_target, device_name)
 
+        def copy() -> bool:
+            os.makedirs(destination_dir, exist_ok=True)
+            shutil.copy2(local_path, os.path.join(destination_dir, remote_filename))
+            return True
+
+        try:
+            return bool(self._call_with_timeout(copy, TRANSFER_TIMEOUT_SEC, 'コピー'))
+        except Exception as e:
+            logger.error(f"ローカルコピーに失敗しました: {e}")
+            return False
+
+    def close(self) -> None:
+        pass
+
+
+def create_transport(nas_target: str, ssh_key: str):
+    """--nas-target の形式に応じた送信方法を返す（リモート形式ならSFTP、ディレクトリパスならローカルコピー）"""
+    if _is_remote_target(nas_target):
+        return SftpTransport(nas_target, ssh_key)
+    return LocalCopyTransport(nas_target)
 
-def upload_unsent_data(csv_path: str, save_dir: str, device_name: str,
-                       nas_target: str, ssh_key: str) -> None:
+
+def _write_chunk(segment_path: str, start_offset: int, chunk_path: str,
+                 max_bytes: int, compress: bool) -> tuple:
+    """
+    セグメントの start_offset 以降の完全な行を、ヘッダー付きのチャンクCSVに書き写す。
+
+    書き写すのは max_bytes（圧縮前のデータ行の合計）までで、残りは次のチャンクに回す。
+    書きかけの最終行（改行で終わっていない行）は送らず、次のサイクルに回す。
+    start_offset が None ならヘッダー直後から。compress が True ならgzip圧縮して書く。
+
+    Returns:
+        (書き写した行数, 書き写した部分の終端のバイト位置, 最後に書き写した行)
+    """
+    row_count = 0
+    copied_bytes = 0
+    last_line = b''
+    open_chunk = gzip.open if compress else open
+    with open(segment_path, 'rb') as source, open_chunk(chunk_path, 'wb') as chunk:
+        header = source.readline()
+        chunk.write(header)
+        end_offset = start_offset if start_offset is not None else len(header)
+        source.seek(end_offset)
+        for line in source:
+            if not line.endswith(b'\n'):
+                break
+            if row_count > 0 and copied_bytes + len(line) > max_bytes:
+                break
+            chunk.write(line)
+            row_count += 1
+            copied_bytes += len(line)
+            end_offset += len(line)
+            last_line = line
+    return row_count, end_offset, last_line
+
+
+def upload_unsent_data(store: SegmentStore, save_dir: str, device_name: str,
+                       transport, compress: bool = False) -> bool:
     """
-    ローカルCSVの未送信行をチャンクCSVにまとめてNASへ送信する。
+    ローカルのセグメントCSVの未送信行を、チャンクCSVに分けてNASへ送信する。
 
     仕組み:
-      - 送信済みのデータ行数をステートファイルに記録しておき、それ以降の行だけを送る
+      - どのセグメントの何バイト目まで送ったかをステートファイルに記録しておき、
+        そこへseekして以降の行だけを読む（送信済み部分は読み直さない）
+      - 未送信分は UPLOAD_CHUNK_MAX_BYTES ごとのチャンクに分け、1チャンク送るたびに
+        送信済み位置を進める。NAS停止明けに数日分たまっていても1回の送信は小さく、
+        不安定な回線で途中失敗しても送れた分は二度と送らない
+      - 1サイクルで送信に使う時間は UPLOAD_CYCLE_BUDGET_SEC までとし、
+        残りは次のサイクルに回す（たまった分は数サイクルで必ず送り切れる）
+      - compress が True ならチャンクをgzip圧縮して .csv.gz で送る
+      - 追記の終わった古いセグメントを送り切ったら、archive/ に圧縮して移す
       - チャンクのファイル名は「デバイス名_日時.csv」で毎回一意 → リモートを上書きしない
-      - 送信に失敗しても行数を進めないため、次の測定サイクルでまとめて再送される
-        （ローカルCSVが残っている限りデータは欠損しない）
+      - 送信に失敗しても位置を進めないため、次の測定サイクルで続きから再送される
+        （ローカルのセグメントが残っている限りデータは欠損しない）
       - 初回起動時は全行が未送信扱いになるので、既存データの移行も自動で行われる
+
+    測定ループと別スレッド（UploadWorker）から呼ばれる。測定側は最新のセグメントに
+    追記するだけで、ここで圧縮するのは一覧の最後より前（追記の終わった）セグメントだけなので、
+    ロック無しで同時に動かしてよい。
+
+    チャンクは送るたびに別の一時ファイルに書き、送り終えたら消す。時間切れで見捨てたコピーの
+    スレッドがまだ前のチャンクを読んでいても、そのファイルを書き換えることはない
+    （その操作が戻るまでは、送信自体を見送って再試行に回す）。
+
+    Returns:
+        送信に失敗したら False（持ち時間切れで残りを持ち越した場合は True）
     """
     state_path = os.path.join(save_dir, UPLOAD_STATE_FILENAME)
-    uploaded_count = _load_uploaded_row_count(state_path)
+    cursor_segment, cursor_offset = _load_upload_cursor(state_path, store)
+    extension = '.csv.gz' if compress else '.csv'
+    if transport.is_stalled():
+        logger.warning(f"[{device_name}] NASのマウント先への前回のコピーがまだ戻らないため、送信を見送ります")
+        return False
+    deadline = time.monotonic() + UPLOAD_CYCLE_BUDGET_SEC
+    sent_rows = 0
+
+    segments = store.list_segments()
+    for segment_name in segments:
+        is_active = segment_name == segments[-1]
+        if segment_name < cursor_segment:
+            # 送信済みだが圧縮前に止まっていたセグメント
+            if not is_active:
+                store.archive(segment_name)
+            continue
+        offset = cursor_offset if segment_name == cursor_segment else None
 
-    # ローカルCSVを読み、未送信のデータ行を抜き出す
-    try:
-        with open(csv_path, newline='') as f:
-            rows = list(csv.reader(f))
-    except Exception as e:
-        logger.error(f"送信用のCSV読み込みに失敗しました: {e}")
-        return
+        while True:
+            if time.monotonic() >= deadline:
+                logger.info(
+                    f"送信の持ち時間（{UPLOAD_CYCLE_BUDGET_SEC}秒）を使い切ったため、"
+                    "残りは次のサイクルで送信します"
+                )
+                return True
 
-    header, data_rows = rows[0], rows[1:]
-    unsent_rows = data_rows[uploaded_count:]
-    if not unsent_rows:
+            chunk_fd, chunk_path = tempfile.mkstemp(prefix='outbox_chunk_', suffix=extension, dir=save_dir)
+            os.close(chunk_fd)
+            try:
+                try:
+                    row_count, end_offset, last_line = _write_chunk(
+                        store.segment_path(segment_name), offset, chunk_path,
+                        UPLOAD_CHUNK_MAX_BYTES, compress)
+                except Exception as e:
+                    logger.error(f"送信用チャンクの作成に失敗しました: {e}")
+                    return False
+                if row_count == 0:
+                    break
+
+                # マイクロ秒まで含めるのは、同一秒内の連続送信でファイル名が衝突しないようにするため
+                timestamp_label = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+                remote_filename = f"{device_name}_{timestamp_label}{extension}"
+
+                if not transport.put(chunk_path, device_name, remote_filename):
+                    logger.warning(f"[{device_name}] 送信に失敗しました。続きから再送します")
+                    return False
+            finally:
+                # 見捨てたコピーのスレッドが開いたままでも、消すのは名前だけ（読み終えるまで中身は残る）
+                os.remove(chunk_path)
+
+            _save_upload_cursor(state_path, segment_name, end_offset, last_line)
+            offset = end_offset
+            sent_rows += row_count
+            logger.info(f"NASへ{row_count}行を送信しました: {remote_filename}")
+
+        if not is_active:
+            # 追記の終わったセグメントを送り切った
+            store.archive(segment_name)
+
+    if sent_rows == 0:
         logger.debug("未送信のデータはありません")
-        return
+    return True
 
-    # 未送信分をチャンクCSVとして書き出す
-    # マイクロ秒まで含めるのは、同一秒内の連続送信でファイル名が衝突しないようにするため
-    timestamp_label = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    remote_filename = f"{device_name}_{timestamp_label}.csv"
-    chunk_path = os.path.join(save_dir, 'outbox_chunk.csv')
-    try:
-        with open(chunk_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(header)
-            writer.writerows(unsent_rows)
-    except Exception as e:
-        logger.error(f"送信用チャンクの作成に失敗しました: {e}")
-        return
 
-    # 送信（リモート形式ならSFTP、ディレクトリパスならローカルコピー）
-    if _is_remote_target(nas_target):
-        success = _transfer_via_sftp(chunk_path, nas_target, device_name, remote_filename, ssh_key)
-    else:
-        success = _transfer_via_local_copy(chunk_path, nas_target, device_name, remote_filename)
+class UploadWorker(threading.Thread):
+    """
+    NASへの送信を測定ループから切り離して行うスレッド。
 
-    if success:
-        _save_uploaded_row_count(state_path, uploaded_count + len(unsent_rows))
-        logger.info(f"NASへ{len(unsent_rows)}行を送信しました: {remote_filename}")
-    else:
-        logger.warning("送信に失敗したため、次の測定サイクルで再送します")
+    NASのSMBマウントが固まったりSFTPが遅かったりしても、測定側はローカルのセグメントに
+    追記して notify() を呼ぶだけなので、測定の時刻は送信の状態に左右されない。
+    送信に失敗したら UPLOAD_RETRY_BACKOFF_BASE_SEC から倍々に待ち時間を延ばして再試行する
+    （上限 UPLOAD_RETRY_BACKOFF_MAX_SEC）。待っている間に届いた新しい行は、次の再試行でまとめて送る。
+    """
+
+    def __init__(self, sensors: list, transport, compress: bool):
+        super().__init__(name='upload-worker', daemon=True)
+        self.sensors = sensors
+        self.transport = transport
+        self.compress = compress
+        self._wake = threading.Event()
+        self._stop_requested = threading.Event()
+        self._failure_count = 0
+
+    def notify(self) -> None:
+        """新しい行を記録したことを知らせる（送信中・再試行待ちなら、それが終わってから送る）"""
+        self._wake.set()
+
+    def stop(self, timeout_sec: float = TRANSFER_TIMEOUT_SEC) -> None:
+        """送信中のチャンクが終わるまで最大 timeout_sec 待ってスレッドを止める"""
+        self._stop_requested.set()
+        self._wake.set()
+        self.join(timeout_sec)
+        if self.is_alive():
+            logger.warning("送信スレッドが時間内に終わりませんでした。送信途中の分は次回起動時に再送されます")
+
+    def run(self) -> None:
+        while True:
+            self._wake.wait()
+            if self._stop_requested.is_set():
+                return
+            self._wake.clear()
+
+            if self._upload_all():
+                if self._failure_count:
+                    logger.info("NASへの送信が回復しました")
+                self._failure_count = 0
+                continue
+
+            self._failure_count += 1
+            backoff = min(UPLOAD_RETRY_BACKOFF_BASE_SEC * 2 ** (self._failure_count - 1),
+                          UPLOAD_RETRY_BACKOFF_MAX_SEC)
+            logger.info(f"NASへの送信は {backoff} 秒後に再試行します（連続{self._failure_count}回失敗）")
+            if self._stop_requested.wait(backoff):
+                return
+            self._wake.set()
+
+    def _upload_all(self) -> bool:
+        """全センサーの未送信分を送る。1台でも失敗したら False"""
+        succeeded = True
+        for sensor in self.sensors:
+            try:
+                if not upload_unsent_data(sensor.store, sensor.save_dir, sensor.device_name,
+                                          self.transport, compress=self.compress):
+                    succeeded = False
+            except Exception as e:
+                # スレッドが落ちると以後送信されなくなるため、予期せぬ例外も失敗として再試行する
+                logger.error(f"[{sensor.device_name}] 送信中に予期せぬエラーが発生しました: {e}")
+                logger.debug(traceback.format_exc())
+                succeeded = False
+        return succeeded
 
 
 # =============================================================================
@@ -483,6 +1462,49 @@ def check_already_running() -> None:
 # コマンドライン引数
 # =============================================================================
 
+def _parse_sensor_spec(text: str) -> tuple:
+    """--sensor の値（デバイス名:ピン名。例: 246-upper:D4）を (デバイス名, ピン名) に変換する"""
+    device_name, separator, pin_name = text.partition(':')
+    if not separator or not device_name or not pin_name:
+        raise argparse.ArgumentTypeError(f"デバイス名:ピン名 の形式で指定してください（例: 246-upper:D4）: {text}")
+    pin_name = pin_name.upper()
+    if pin_name.isdigit():
+        pin_name = 'D' + pin_name   # 「4」だけの指定は BCM番号とみなす
+    # ピンの有無は board を読み込む読み取りプロセスが確かめる（無ければ初期化の失敗として出る）
+    if not re.fullmatch(r'D\d+', pin_name):
+        raise argparse.ArgumentTypeError(f"ピン名が不正です（例: D4, D17）: {pin_name}")
+    return device_name, pin_name
+
+
+def build_sensors(args: argparse.Namespace) -> list:
+    """
+    コマンドライン引数から測定するセンサーの一覧を作る。
+
+    --sensor が無ければ従来どおり DHT_PIN の1台を --device-name の名前で使い、
+    ローカル記録は --save-dir 直下に置く。--sensor を複数指定した場合は、
+    センサーごとに --save-dir/<デバイス名>/ に分けて記録・送信状態を持つ。
+    """
+    # 高頻度サンプリング時は、1測定間隔ぶんのサンプルが入るリングバッファを持たせる
+    sample_capacity = None
+    if args.sample_interval:
+        sample_capacity = int(CHECK_INTERVAL_SEC // args.sample_interval) + 1
+
+    if not args.sensor:
+        return [Sensor(args.device_name, DHT_PIN, args.save_dir, args.retention_days,
+                       sample_capacity)]
+
+    device_names = [device_name for device_name, _ in args.sensor]
+    if len(set(device_names)) != len(device_names):
+        logger.error(f"--sensor のデバイス名が重複しています: {device_names}")
+        raise SystemExit(1)
+    if len(args.sensor) == 1:
+        device_name, pin = args.sensor[0]
+        return [Sensor(device_name, pin, args.save_dir, args.retention_days, sample_capacity)]
+    return [Sensor(device_name, pin, os.path.join(args.save_dir, device_name),
+                   args.retention_days, sample_capacity)
+            for device_name, pin in args.sensor]
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='温湿度センサークライアント')
     parser.add_argument(
@@ -491,6 +1513,50 @@ def parse_args() -> argparse.Namespace:
         help='このデバイスの識別名（例: 246）。NAS上のフォルダ名・ファイル名に使われる'
              '（デフォルト: ホスト名）'
     )
+    parser.add_argument(
+        '--sensor',
+        action='append',
+        type=_parse_sensor_spec,
+        metavar='DEVICE:PIN',
+        help='1台のPiに複数のDHT22をつなぐ場合に、センサーごとに「デバイス名:ピン名」を指定する'
+             '（繰り返し指定可。例: --sensor 246-upper:D4 --sensor 246-lower:D17）。'
+             '指定するとデバイス名ごとに incoming/<デバイス名>/ へ送信する。'
+             f'省略時は {DHT_PIN} の1台を --device-name の名前で使う'
+    )
+    parser.add_argument(
+        '--sample-interval',
+        type=float,
+        default=None,
+        metavar='SEC',
+        help='高頻度サンプリングの間隔（秒。15〜30程度）。指定すると測定間隔'
+             f'（{CHECK_INTERVAL_SEC}秒）の間この間隔でサンプリングしてメモリにため、'
+             '間隔ごとに平均・最小・最大・サンプル数を1行にまとめて記録する'
+             '（短時間のドア開けっ放し等も最小・最大に残る。送信量・SD書き込みは増えない）'
+    )
+    parser.add_argument(
+        '--deadband-temp',
+        type=float,
+        default=None,
+        metavar='DEG',
+        help='間引きモード: 最後に記録した温度からこの幅（°C）を超えて動いたときだけ記録する'
+             '（例: 0.2）。湿度の --deadband-humid と組み合わせられる'
+    )
+    parser.add_argument(
+        '--deadband-humid',
+        type=float,
+        default=None,
+        metavar='PCT',
+        help='間引きモード: 最後に記録した湿度からこの幅（%%）を超えて動いたときだけ記録する（例: 1.0）'
+    )
+    parser.add_argument(
+        '--heartbeat-minutes',
+        type=int,
+        default=DEFAULT_HEARTBEAT_MINUTES,
+        metavar='MIN',
+        help='間引きモードでも、値が動かないまま最低この間隔（分）で1行は記録する'
+             f'（デフォルト: {DEFAULT_HEARTBEAT_MINUTES}）。'
+             'コレクターの thresholds.yaml の heartbeat_minutes にも同じ値を書くこと'
+    )
     parser.add_argument(
         '--nas-target',
         required=True,
@@ -503,11 +1569,23 @@ def parse_args() -> argparse.Namespace:
         default=DEFAULT_SSH_KEY,
         help=f'NAS送信用のSSH秘密鍵のパス（デフォルト: {DEFAULT_SSH_KEY}）'
     )
+    parser.add_argument(
+        '--compress-uploads',
+        action='store_true',
+        help='チャンクをgzip圧縮（.csv.gz）して送信する（遅い回線向け。コレクターはどちらも取り込める）'
+    )
     parser.add_argument(
         '--save-dir',
         default=DEFAULT_SAVE_DIR,
         help=f'ログファイルの保存先ディレクトリ（デフォルト: {DEFAULT_SAVE_DIR}）'
     )
+    parser.add_argument(
+        '--retention-days',
+        type=int,
+        default=ARCHIVE_RETENTION_DAYS,
+        help='送信済みセグメント（archive/）の保持日数。未送信分はこの日数を過ぎても消さない'
+             f'（デフォルト: {ARCHIVE_RETENTION_DAYS}）'
+    )
     parser.add_argument(
         '--test-mode',
         action='store_true',
@@ -523,7 +1601,10 @@ def parse_args() -> argparse.Namespace:
         action='store_true',
         help='デバッグログを有効化'
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.heartbeat_minutes <= 0:
+        parser.error("--heartbeat-minutes には1以上を指定してください")
+    return args
 
 
 # =============================================================================
@@ -537,7 +1618,7 @@ def main() -> None:
       1. コマンドライン引数のパース
       2. 多重起動チェック
       3. センサー初期化（テストモード時はスキップ）
-      4. 10分ごとに測定 → ローカルCSVに追記 → 未送信分をNASへ送信
+      4. 壁時計の10分区切り（:00, :10, ...）ごとに全センサーを測定 → ローカルCSVに追記 → 未送信分をNASへ送信
     """
     args = parse_args()
     if args.debug:
@@ -554,71 +1635,113 @@ def main() -> None:
 
     signal.signal(signal.SIGTERM, handle_sigterm)
 
+    # 保存先ディレクトリとセグメントの置き場を準備（旧形式のCSVがあればここで移行される）
+    global _sensors
+    _sensors = build_sensors(args)
+
     # センサーを初期化（テストモードでは実センサーを使わない）
+    # 複数台のうち一部だけ初期化に失敗した場合は、残りで監視を始める
+    # （失敗したセンサーの読み取りプロセスは次の測定時に作り直される）
     if not args.test_mode:
-        if not _init_sensor():
+        initialized = [_init_sensor(sensor) for sensor in _sensors]
+        if not any(initialized):
             raise SystemExit(1)
 
-    # 保存先ディレクトリを準備
-    os.makedirs(args.save_dir, exist_ok=True)
-    csv_path = os.path.join(args.save_dir, CSV_FILENAME)
-
-    # 初回実行時にCSVファイルがなければヘッダー行を作成
-    if not os.path.exists(csv_path):
-        with open(csv_path, 'w', newline='') as f:
-            csv.writer(f).writerow(['timestamp', 'temperature', 'humidity'])
-        logger.info(f"CSVファイルを作成しました: {csv_path}")
+    # NASへの送信方法（SFTPの場合、接続は次の送信から終了まで使い回す）。
+    # 送信は別スレッドで行い、測定ループはNASの応答を待たない（--once はその場で送る）
+    transport = create_transport(args.nas_target, args.ssh_key)
+    uploader = None
+    if not args.once:
+        uploader = UploadWorker(_sensors, transport, args.compress_uploads)
+        uploader.start()
 
     mode_label = "テストモードで" if args.test_mode else ""
+    device_names = ', '.join(sensor.device_name for sensor in _sensors)
     logger.info(
         f"{mode_label}センサー監視を開始します (version {SCRIPT_VERSION}) "
-        f"[デバイス名: {args.device_name}, 送信先: {args.nas_target}]"
+        f"[デバイス名: {device_names}, 送信先: {args.nas_target}]"
     )
 
-    error_count = 0
     max_consecutive_errors = 5
+    # 測定は壁時計の区切り（:00, :10, ...）に揃える。全Piで測定時刻が揃うので、
+    # 部屋どうしの比較やコレクターの2連続判定のペアが時刻どおりに並ぶ
+    schedule = IntervalSchedule(CHECK_INTERVAL_SEC)
 
     try:
         while True:
-            current_time = datetime.datetime.now()
-
-            # センサー読み取りとCSV記録
-            if args.test_mode:
-                humidity, temperature = _generate_test_data()
+            # センサー読み取り（複数台は並行して読む）。高頻度サンプリング時は
+            # 次の区切りまでサンプリングしてリングバッファにため、区切りの時刻で1行にまとめる。
+            # --once は区切りを待たずにその場で1回だけ測る
+            if args.once:
+                current_time = datetime.datetime.now()
+                if args.sample_interval:
+                    collect_samples(_sensors, args.test_mode, args.sample_interval)
+                else:
+                    readings = _take_readings(_sensors, args.test_mode, SENSOR_READ_RETRIES)
+            elif args.sample_interval:
+                current_time, deadline = schedule.next_slot()
+                collect_samples(_sensors, args.test_mode, args.sample_interval, deadline)
             else:
-                humidity, temperature = _read_sensor_with_retry()
+                # 再試行で読み取りが区切りから遅れても、記録する時刻は区切りの時刻にする
+                current_time = schedule.wait_next()
+                readings = _take_readings(_sensors, args.test_mode, SENSOR_READ_RETRIES)
+
+            # CSV記録
+            for sensor in _sensors:
+                extra_columns = ()
+                if sensor.samples is None:
+                    humidity, temperature = readings[sensor.device_name]
+                elif sensor.samples:
+                    humidity, temperature, extra_columns = aggregate_samples(sensor.samples)
+                    sensor.samples.clear()
+                else:
+                    humidity, temperature = None, None
+
+                if humidity is not None and temperature is not None:
+                    sensor.error_count = 0
+                    if not should_record(sensor, humidity, temperature, extra_columns, current_time,
+                                         args.deadband_temp, args.deadband_humid,
+                                         args.heartbeat_minutes):
+                        logger.debug(
+                            f"[{sensor.device_name}] 前回の記録から変化が小さいため記録しません "
+                            f"(温度: {temperature}°C, 湿度: {humidity}%)"
+                        )
+                        continue
+                    save_to_csv(sensor.store, humidity, temperature, extra_columns, current_time)
+                    sensor.last_recorded = (humidity, temperature, current_time)
+                    sample_label = f" ({extra_columns[-1]}サンプルの平均)" if extra_columns else ""
+                    logger.info(
+                        f"[{current_time.strftime('%Y-%m-%d %H:%M:%S')}] [{sensor.device_name}] "
+                        f"温度: {temperature}°C, 湿度: {humidity}%{sample_label}"
+                    )
+                    continue
 
-            if humidity is not None and temperature is not None:
-                save_to_csv(csv_path, humidity, temperature)
-                logger.info(
-                    f"[{current_time.strftime('%Y-%m-%d %H:%M:%S')}] "
-                    f"温度: {temperature}°C, 湿度: {humidity}%"
-                )
-                error_count = 0
-            else:
                 # 通知はしない（データが止まればコレクター側の欠測アラートが検出する）
-                error_count += 1
+                sensor.error_count += 1
+                failure_label = ("測定間隔内のサンプルが1つも取れませんでした" if sensor.samples is not None
+                                 else f"{SENSOR_READ_RETRIES}回試しても読めませんでした")
                 logger.warning(
-                    f"センサー読み取りエラー: {SENSOR_READ_RETRIES}回試しても読めませんでした "
-                    f"(連続{error_count}/{max_consecutive_errors}サイクル)"
+                    f"[{sensor.device_name}] センサー読み取りエラー: {failure_label} "
+                    f"(連続{sensor.error_count}/{max_consecutive_errors}サイクル)"
                 )
-                if error_count >= max_consecutive_errors:
+                if sensor.error_count >= max_consecutive_errors:
                     logger.error(
-                        f"センサーの読み取りに連続で失敗しています ({error_count}回)。"
-                        "配線とセンサーの状態を確認してください。"
+                        f"[{sensor.device_name}] センサーの読み取りに連続で失敗しています "
+                        f"({sensor.error_count}回)。配線とセンサーの状態を確認してください。"
                     )
-                    error_count = 0  # ログの出しすぎを防ぐためリセット
+                    sensor.error_count = 0  # ログの出しすぎを防ぐためリセット
 
-            # 未送信データをNASへ送信（失敗しても次サイクルで自動再送）
-            upload_unsent_data(csv_path, args.save_dir, args.device_name,
-                               args.nas_target, args.ssh_key)
-
-            if args.once:
-                logger.info("--once 指定のため、1回の測定・送信で終了します")
-                break
+            # 未送信データをNASへ送信（失敗しても送信スレッドが自動で再送）。
+            # センサーごとに incoming/<デバイス名>/ へ送る
+            if uploader is not None:
+                uploader.notify()
+                continue
 
-            logger.info(f"次の測定まで {CHECK_INTERVAL_SEC} 秒待機します...")
-            time.sleep(CHECK_INTERVAL_SEC)
+            for sensor in _sensors:
+                upload_unsent_data(sensor.store, sensor.save_dir, sensor.device_name, transport,
+                                   compress=args.compress_uploads)
+            logger.info("--once 指定のため、1回の測定・送信で終了します")
+            break
 
     except KeyboardInterrupt:
         logger.info("\n監視を終了します。")
@@ -629,6 +1752,9 @@ def main() -> None:
         # どのような終了方法でもセンサーを正しく解放する
         # atexit でも呼ばれるが、二重呼び出しは _cleanup_sensor 内でガードしている
         _cleanup_sensor()
+        if uploader is not None:
+            uploader.stop()
+        transport.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,69 @@
+"""
+テストの共通設定。
+
+collector.py / temp_humid_notifier.py はパッケージではなく単体のスクリプトなので、置き場所を import パスに加える。
+"""
+
+import csv
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'collector'))
+sys.path.insert(0, PROJECT_DIR)
+
+import collector  # noqa: E402
+
+# temp_humid_notifier は import 時にカレントディレクトリへログファイルを作るので、一時フォルダで import する
+_cwd = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix='temp_humid_notifier_test_'))
+try:
+    import temp_humid_notifier  # noqa: E402,F401
+finally:
+    os.chdir(_cwd)
+
+# テストで使う thresholds.yaml の中身
+TEST_CONFIG = """\
+defaults:
+  temp_range: [18, 26]
+  humid_range: [30, 70]
+"""
+
+
+@pytest.fixture
+def base_dir(tmp_path):
+    """NAS共有フォルダの代わりの一時フォルダ（config/thresholds.yaml 入り）"""
+    config_dir = tmp_path / 'config'
+    config_dir.mkdir()
+    (config_dir / 'thresholds.yaml').write_text(TEST_CONFIG, encoding='utf-8')
+    return str(tmp_path)
+
+
+@pytest.fixture
+def conn(base_dir):
+    """base_dir の新形式DB"""
+    connection = collector.open_database(base_dir)
+    yield connection
+    connection.close()
+
+
+def write_chunk(base_dir: str, device_id: str, name: str, rows: list) -> str:
+    """incoming/<デバイス名>/ にセンサーPiと同じ形式のCSVチャンクを置く。rows は (時刻の文字列, 温度, 湿度)"""
+    device_dir = os.path.join(base_dir, 'incoming', device_id)
+    os.makedirs(device_dir, exist_ok=True)
+    path = os.path.join(device_dir, name)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['timestamp', 'temperature', 'humidity'])
+        writer.writerows(rows)
+    return path
+
+
+def outbox_texts(connection: sqlite3.Connection, kind: str = 'alert') -> list:
+    """outbox に入ったSlack通知の本文（古い順）"""
+    return [text for (text,) in connection.execute(
+        "SELECT text FROM outbox WHERE kind = ? ORDER BY id", (kind,))]
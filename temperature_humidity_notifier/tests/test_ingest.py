@@ -0,0 +1,27 @@
+"""チャンクファイルの取り込み（ingest_incoming_files）のテスト"""
+
+import logging
+
+import collector
+from conftest import write_chunk
+
+
+def test_rows_with_wrong_column_count_are_skipped_and_counted(conn, base_dir, caplog):
+    path = write_chunk(base_dir, 'room01', 'a.csv', [
+        ('2026-10-17 09:00:00', 22.0, 50.0),
+        ('2026-10-17 09:10:00', 22.5, 51.0),
+    ])
+    # Piの電源断で途中まで書かれた行と、列の多すぎる行
+    with open(path, 'a', newline='') as f:
+        f.write('2026-10-17 09:20:00,23.0\n')
+        f.write('2026-10-17 09:30:00,23.0,52.0,1\n')
+        f.write('\n')
+
+    with caplog.at_level(logging.WARNING):
+        collector.ingest_incoming_files(conn, base_dir, workers=1)
+
+    assert conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0] == 2
+    warnings = [record.getMessage() for record in caplog.records if record.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert '2行スキップしました' in warnings[0]
+    assert 'a.csv' in warnings[0]
@@ -0,0 +1,190 @@
+"""旧形式（テキストの時刻の readings テーブル）のDBから新形式への移行のテスト"""
+
+import datetime
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import collector
+from conftest import write_chunk
+
+DEVICE_IDS = ['room01', 'room02', 'room03']
+ROWS_PER_DEVICE = 50
+
+
+def create_old_database(base_dir: str) -> list:
+    """更新前の形式のDBを作り、入れた行（device_id, timestamp, temperature, humidity）を返す"""
+    db_path = os.path.join(base_dir, collector.DB_RELATIVE_PATH)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE readings (
+            device_id   TEXT NOT NULL,
+            timestamp   TEXT NOT NULL,
+            temperature REAL,
+            humidity    REAL,
+            PRIMARY KEY (device_id, timestamp)
+        );
+        CREATE TABLE daily_summary (
+            device_id TEXT NOT NULL,
+            date      TEXT NOT NULL,
+            temp_min  REAL, temp_max  REAL, temp_avg  REAL,
+            humid_min REAL, humid_max REAL, humid_avg REAL,
+            PRIMARY KEY (device_id, date)
+        );
+        CREATE TABLE alert_state (
+            device_id TEXT NOT NULL,
+            alert_key TEXT NOT NULL,
+            last_sent TEXT NOT NULL,
+            PRIMARY KEY (device_id, alert_key)
+        );
+    """)
+    start = datetime.datetime(2026, 10, 1)
+    rows = [(device_id, (start + datetime.timedelta(minutes=10 * i)).strftime('%Y-%m-%d %H:%M:%S'),
+             20.0 + i / 100, 50.0 - i / 100)
+            for device_id in DEVICE_IDS for i in range(ROWS_PER_DEVICE)]
+    conn.executemany("INSERT INTO readings VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return rows
+
+
+def migrated_rows(conn: sqlite3.Connection) -> list:
+    return conn.execute(
+        "SELECT device_id, timestamp, temperature, humidity FROM readings ORDER BY device_id, timestamp"
+    ).fetchall()
+
+
+def assert_fully_migrated(conn: sqlite3.Connection, rows: list) -> None:
+    assert conn.execute("SELECT type FROM sqlite_master WHERE name = 'readings'").fetchone()[0] == 'view'
+    assert not collector._table_exists(conn, 'migrate_progress')
+    assert migrated_rows(conn) == sorted(rows)
+    assert conn.execute("SELECT SUM(row_count) FROM hourly_rollup").fetchone()[0] == len(rows)
+    assert dict(conn.execute("SELECT device_id, last_timestamp FROM devices")) == {
+        device_id: '2026-10-01 08:10:00' for device_id in DEVICE_IDS}
+
+
+def test_migrate_resumes_after_interruption(base_dir, monkeypatch):
+    rows = create_old_database(base_dir)
+    monkeypatch.setattr(collector, 'MIGRATE_BATCH_ROWS', 20)
+
+    # 4バッチ目の途中で止まる（停電・Ctrl+C）
+    real_to_epoch = collector.to_epoch
+    calls = {'count': 0}
+
+    def interrupted_to_epoch(text):
+        calls['count'] += 1
+        if calls['count'] > 70:
+            raise KeyboardInterrupt
+        return real_to_epoch(text)
+
+    monkeypatch.setattr(collector, 'to_epoch', interrupted_to_epoch)
+    with pytest.raises(KeyboardInterrupt):
+        collector.run_migrate(base_dir)
+
+    conn = sqlite3.connect(os.path.join(base_dir, collector.DB_RELATIVE_PATH))
+    copied = conn.execute("SELECT copied FROM migrate_progress").fetchone()[0]
+    assert copied == 60
+    assert conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0] == 60
+    conn.close()
+
+    monkeypatch.setattr(collector, 'to_epoch', real_to_epoch)
+    collector.run_migrate(base_dir)
+
+    conn = collector.open_database(base_dir)
+    assert_fully_migrated(conn, rows)
+    conn.close()
+
+
+def test_ingest_migrates_old_database_and_keeps_alerting(base_dir, caplog):
+    rows = create_old_database(base_dir)
+    write_chunk(base_dir, 'room01', 'new.csv',
+                [('2026-10-01 08:20:00', 30.0, 50.0), ('2026-10-01 08:30:00', 30.0, 50.0)])
+
+    # 更新後、誰も migrate を実行しないまま最初の ingest が動く
+    with caplog.at_level(logging.INFO, logger='collector'):
+        conn = collector.open_database(base_dir)
+    assert '新形式に移行' in caplog.text
+    collector.ingest_and_check_alerts(conn, base_dir, collector.load_config(base_dir), workers=1)
+
+    new_rows = [('room01', '2026-10-01 08:20:00', 30.0, 50.0), ('room01', '2026-10-01 08:30:00', 30.0, 50.0)]
+    assert migrated_rows(conn) == sorted(rows + new_rows)
+    # 範囲逸脱の判定も動く（データが古いので欠測の判定も動く）
+    alerts = [text for (text,) in conn.execute("SELECT text FROM outbox WHERE kind = 'alert'")]
+    assert any('[room01] 温度が高すぎます' in text for text in alerts)
+    assert any('欠測' in text for text in alerts)
+    conn.close()
+
+
+def assert_not_migrated(base_dir: str) -> None:
+    conn = sqlite3.connect(os.path.join(base_dir, collector.DB_RELATIVE_PATH))
+    assert conn.execute("SELECT type FROM sqlite_master WHERE name = 'readings'").fetchone()[0] == 'table'
+    assert not collector._table_exists(conn, 'samples')
+    conn.close()
+
+
+def test_read_only_commands_leave_migration_to_the_writer(base_dir):
+    create_old_database(base_dir)
+    with pytest.raises(SystemExit):
+        collector.run_status(base_dir)
+    assert_not_migrated(base_dir)
+
+
+def test_daily_and_weekly_reports_leave_migration_to_ingest(base_dir):
+    # 移行が長引いて daily・weekly-report のタイマーと重なっても、そちらは移行を始めない
+    create_old_database(base_dir)
+    slack = collector.SlackSender(no_slack=True)
+    with pytest.raises(SystemExit):
+        collector.run_daily(base_dir, slack)
+    with pytest.raises(SystemExit):
+        collector.run_weekly_report(base_dir, slack)
+    assert_not_migrated(base_dir)
+
+
+def test_second_open_during_migration_does_not_write(base_dir, monkeypatch):
+    rows = create_old_database(base_dir)
+    monkeypatch.setattr(collector, 'MIGRATE_BATCH_ROWS', 20)
+    db_path = os.path.join(base_dir, collector.DB_RELATIVE_PATH)
+
+    # 2バッチ目を写している最中に、次の ingest のタイマーが同じDBを開く
+    real_to_epoch = collector.to_epoch
+    seen = {'calls': 0, 'second_open': None}
+
+    def to_epoch_with_second_open(text):
+        seen['calls'] += 1
+        if seen['calls'] == 30:
+            progress_before = sqlite3.connect(db_path).execute(
+                "SELECT copied FROM migrate_progress").fetchone()
+            with pytest.raises(SystemExit):
+                collector.open_database(base_dir)
+            seen['second_open'] = (progress_before, sqlite3.connect(db_path).execute(
+                "SELECT copied FROM migrate_progress").fetchone())
+        return real_to_epoch(text)
+
+    monkeypatch.setattr(collector, 'to_epoch', to_epoch_with_second_open)
+    conn = collector.open_database(base_dir)
+
+    # 2つ目は移行の続きを始めずに（進み具合を書き換えずに）終わり、1つ目が最後まで移行する
+    assert seen['second_open'] == ((20,), (20,))
+    assert_fully_migrated(conn, rows)
+    assert not os.path.exists(db_path + collector.MIGRATE_LOCK_SUFFIX)
+    conn.close()
+
+
+def test_stale_migration_lock_is_taken_over(base_dir):
+    rows = create_old_database(base_dir)
+    # 移行中に停電した（ロックファイルを作ったプロセスはもういない）
+    finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                              capture_output=True, text=True, check=True)
+    lock_path = os.path.join(base_dir, collector.DB_RELATIVE_PATH) + collector.MIGRATE_LOCK_SUFFIX
+    with open(lock_path, 'w') as f:
+        f.write(f"{finished.stdout.strip()}@{os.uname().nodename}\n")
+
+    conn = collector.open_database(base_dir)
+    assert_fully_migrated(conn, rows)
+    assert not os.path.exists(lock_path)
+    conn.close()
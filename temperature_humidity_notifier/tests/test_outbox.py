@@ -0,0 +1,33 @@
+"""Slack送信キュー（deliver_outbox）のテスト"""
+
+import time
+
+import collector
+
+
+def test_slow_slack_returns_to_the_caller_after_the_budget(conn, monkeypatch):
+    # 応答は返るが1通に0.2秒かかるSlack
+    sent = []
+
+    def slow_send(slack, batch):
+        time.sleep(0.2)
+        sent.append(batch[0][2])
+
+    monkeypatch.setattr(collector, '_send_batch', slow_send)
+    monkeypatch.setattr(collector, 'OUTBOX_SEND_INTERVAL_SEC', 0)
+    for i in range(10):
+        collector.enqueue_slack(conn, 'message', f"レポート{i}")
+    conn.commit()
+
+    slack = collector.SlackSender(no_slack=True)
+    started = time.monotonic()
+    wait_sec = collector.deliver_outbox(conn, slack, 0.5, wait_for_retry=False)
+
+    # 持ち時間を過ぎたら次の1通を送り始めずに戻り、残りはすぐ送れる状態で outbox に残る
+    assert time.monotonic() - started < 1.0
+    assert sent == ["レポート0", "レポート1", "レポート2"]
+    assert wait_sec == 0
+    assert conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 7
+
+    collector.deliver_outbox(conn, slack, 10)
+    assert len(sent) == 10
@@ -0,0 +1,113 @@
+"""範囲逸脱アラート（check_range_alerts と判定済みの位置 alert_watermarks）のテスト"""
+
+import datetime
+import os
+
+import collector
+from conftest import outbox_texts, write_chunk
+
+
+def readings(start: str, count: int, temperature=22.0, humidity=50.0, overrides=None) -> list:
+    """start から10分ごとの count 行。overrides は {時刻の文字列: 温度} で一部の温度を変える"""
+    start_time = datetime.datetime.fromisoformat(start)
+    rows = []
+    for i in range(count):
+        timestamp = (start_time + datetime.timedelta(minutes=10 * i)).strftime('%Y-%m-%d %H:%M:%S')
+        rows.append((timestamp, (overrides or {}).get(timestamp, temperature), humidity))
+    return rows
+
+
+def ingest_and_check(conn, base_dir: str, now: str) -> None:
+    config = collector.load_config(base_dir)
+    collector.ingest_incoming_files(conn, base_dir, workers=1)
+    collector.check_range_alerts(conn, config, datetime.datetime.fromisoformat(now))
+
+
+def test_resent_segment_does_not_repeat_alerted_excursion(conn, base_dir):
+    # 09:40・09:50 に2連続で逸脱して通知済み。その後は範囲内
+    excursion = {'2026-10-17 09:40:00': 30.0, '2026-10-17 09:50:00': 30.0}
+    segment = readings('2026-10-17 09:00:00', 6, overrides=excursion)
+    write_chunk(base_dir, 'room01', 'a.csv', segment)
+    ingest_and_check(conn, base_dir, '2026-10-17 10:00:00')
+    assert len(outbox_texts(conn)) == 1
+
+    later = readings('2026-10-17 10:00:00', 105)
+    write_chunk(base_dir, 'room01', 'b.csv', later)
+    ingest_and_check(conn, base_dir, '2026-10-18 03:35:00')
+
+    # クールダウン（6時間）が明けてから、CRCの合わないセグメントが丸ごと送り直され、新しい行が1行だけ増えた
+    resent = segment + later + readings('2026-10-18 03:30:00', 1)
+    write_chunk(base_dir, 'room01', 'c.csv', resent)
+    ingest_and_check(conn, base_dir, '2026-10-18 03:45:00')
+
+    assert len(outbox_texts(conn)) == 1
+    watermark = conn.execute("SELECT ts FROM alert_watermarks").fetchone()[0]
+    assert collector.from_epoch(watermark) == '2026-10-18 03:30:00'
+
+
+def test_late_rows_are_still_checked(conn, base_dir):
+    write_chunk(base_dir, 'room01', 'a.csv', readings('2026-10-17 12:00:00', 6))
+    ingest_and_check(conn, base_dir, '2026-10-17 13:00:00')
+    assert outbox_texts(conn) == []
+
+    # NAS障害明けに、それより前の時間のチャンクが遅れて届いた（取り込み済みの行も混ざっている）
+    excursion = {'2026-10-17 10:10:00': 30.0, '2026-10-17 10:20:00': 30.0}
+    write_chunk(base_dir, 'room01', 'b.csv',
+                readings('2026-10-17 10:00:00', 18, overrides=excursion)
+                + readings('2026-10-17 12:00:00', 2))
+    ingest_and_check(conn, base_dir, '2026-10-17 13:05:00')
+
+    alerts = outbox_texts(conn)
+    assert len(alerts) == 1
+    assert '10/17 10:10・10:20' in alerts[0]
+
+
+def test_single_excursion_does_not_alert(conn, base_dir):
+    # DHT22の単発ノイズ
+    write_chunk(base_dir, 'room01', 'a.csv',
+                readings('2026-10-17 09:00:00', 6, overrides={'2026-10-17 09:20:00': 30.0}))
+    ingest_and_check(conn, base_dir, '2026-10-17 10:00:00')
+    assert outbox_texts(conn) == []
+
+
+def test_excursions_on_opposite_sides_do_not_alert(conn, base_dir):
+    overrides = {'2026-10-17 09:20:00': 30.0, '2026-10-17 09:30:00': 10.0}
+    write_chunk(base_dir, 'room01', 'a.csv', readings('2026-10-17 09:00:00', 6, overrides=overrides))
+    ingest_and_check(conn, base_dir, '2026-10-17 10:00:00')
+    assert outbox_texts(conn) == []
+
+
+def test_pair_further_apart_than_max_gap_does_not_alert(conn, base_dir):
+    # 09:10 の逸脱の後、欠測明けの 09:50 も逸脱（40分空いているので2連続とみなさない）
+    rows = [('2026-10-17 09:00:00', 22.0, 50.0), ('2026-10-17 09:10:00', 30.0, 50.0),
+            ('2026-10-17 09:50:00', 30.0, 50.0), ('2026-10-17 10:00:00', 22.0, 50.0)]
+    write_chunk(base_dir, 'room01', 'a.csv', rows)
+    ingest_and_check(conn, base_dir, '2026-10-17 10:05:00')
+    assert outbox_texts(conn) == []
+
+
+def test_pair_within_max_gap_alerts(conn, base_dir):
+    # ちょうど MAX_PAIR_GAP_MINUTES（30分）空いた2点は2連続とみなす
+    rows = [('2026-10-17 09:00:00', 22.0, 50.0), ('2026-10-17 09:10:00', 22.0, 20.0),
+            ('2026-10-17 09:40:00', 22.0, 20.0), ('2026-10-17 09:50:00', 22.0, 50.0)]
+    write_chunk(base_dir, 'room01', 'a.csv', rows)
+    ingest_and_check(conn, base_dir, '2026-10-17 09:55:00')
+
+    alerts = outbox_texts(conn)
+    assert len(alerts) == 1
+    assert '湿度が低すぎます' in alerts[0]
+    assert '10/17 09:10・09:40' in alerts[0]
+
+
+def test_heartbeat_device_treats_one_heartbeat_as_consecutive(conn, base_dir):
+    # 間引きモード（ハートビート60分）では、ハートビート＋1測定間隔（70分）までを2連続とみなす
+    with open(os.path.join(base_dir, 'config', 'thresholds.yaml'), 'a', encoding='utf-8') as f:
+        f.write("devices:\n  room01:\n    heartbeat_minutes: 60\n")
+    rows = [('2026-10-17 09:00:00', 22.0, 50.0), ('2026-10-17 09:10:00', 30.0, 50.0),
+            ('2026-10-17 10:10:00', 30.0, 50.0), ('2026-10-17 10:20:00', 22.0, 50.0)]
+    write_chunk(base_dir, 'room01', 'a.csv', rows)
+    ingest_and_check(conn, base_dir, '2026-10-17 10:25:00')
+
+    alerts = outbox_texts(conn)
+    assert len(alerts) == 1
+    assert '10/17 09:10・10:10' in alerts[0]
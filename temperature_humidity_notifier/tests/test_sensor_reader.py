@@ -0,0 +1,67 @@
+"""SensorReader（DHT22を読む子プロセスの起動・ウォッチドッグ）のテスト"""
+
+import importlib.util
+import os
+import textwrap
+import time
+import types
+
+import pytest
+
+import temp_humid_notifier
+from temp_humid_notifier import SensorReader
+
+
+def wait_result(reader: SensorReader, timeout_sec: float = 10):
+    deadline = time.monotonic() + timeout_sec
+    while time.monotonic() < deadline:
+        result = reader.poll()
+        if result is not None:
+            return result
+        time.sleep(0.05)
+    raise AssertionError("読み取りの結果が返りませんでした")
+
+
+@pytest.mark.skipif(importlib.util.find_spec('board') is not None, reason="実機ではセンサーを掴んでしまう")
+def test_worker_starts_without_reimporting_the_client(tmp_path, monkeypatch):
+    # 本体スクリプトを読み込み直すと、カレントディレクトリにログファイルが作られる
+    monkeypatch.chdir(tmp_path)
+    reader = SensorReader('D4')
+    started = time.monotonic()
+
+    # board が入っていない機械では、子の初期化の失敗として（固まらずに）返る
+    assert not reader.start()
+    assert time.monotonic() - started < temp_humid_notifier.SENSOR_READ_TIMEOUT_SEC
+    assert os.listdir(tmp_path) == []
+
+
+def test_stuck_read_kills_the_worker_and_respawns(tmp_path, monkeypatch):
+    # 初期化には成功するが、読み取りで固まるセンサー
+    fake_worker = tmp_path / 'stuck_worker.py'
+    fake_worker.write_text(textwrap.dedent("""
+        import multiprocessing.connection, sys, time
+        connection = multiprocessing.connection.Connection(int(sys.argv[1]))
+        connection.send(('ready', None))
+        connection.recv()
+        time.sleep(60)
+    """))
+    monkeypatch.setattr(temp_humid_notifier, 'sensor_worker', types.SimpleNamespace(__file__=str(fake_worker)))
+    monkeypatch.setattr(temp_humid_notifier, 'SENSOR_READ_TIMEOUT_SEC', 0.5)
+
+    reader = SensorReader('D4')
+    try:
+        assert reader.start()
+        stuck_process = reader._process
+        reader.request_read()
+        assert wait_result(reader) == (None, None)
+        # 固まった子はプロセスグループごと終わらせてある
+        assert stuck_process.poll() is not None
+        assert reader._process is None
+
+        # GPIOの解放を待ってから、次の読み取りで作り直す
+        reader._respawn_after = 0
+        reader.request_read()
+        assert reader._process is not None and reader._process is not stuck_process
+        assert wait_result(reader) == (None, None)
+    finally:
+        reader.stop()
@@ -0,0 +1,157 @@
+"""SftpTransport（マスター接続の使い回し・再接続とバックオフ・-mkdir の回数）のテスト"""
+
+import os
+import shlex
+import shutil
+import types
+
+import pytest
+
+import temp_humid_notifier
+from temp_humid_notifier import SftpTransport
+
+
+class LoopbackSftpTransport(SftpTransport):
+    """
+    ssh / sftp を起動する代わりに、バッチコマンド（-mkdir / put）を解釈してローカルフォルダに書き込む疑似SFTP。
+    引用符で囲んだパスは sftp と同じく1つの引数として読む（_sftp_quote が書く「\\"」だけのエスケープなら
+    shlex と sftp の読み方は同じ）。
+
+    リモートパス /sensor_data/incoming は <root>/sensor_data/incoming に対応する。
+    drop_session() で接続断を、fail_connect_count で接続失敗を再現する。
+    """
+
+    def __init__(self, nas_target: str, root_dir: str):
+        super().__init__(nas_target, '~/.ssh/unused_key')
+        self.root_dir = root_dir
+        self.session_count = 0      # 張ったセッション数（＝実機ならハンドシェイク回数）
+        self.mkdir_count = 0
+        self.fail_connect_count = 0
+        self._connected = False
+
+    def _open_session(self) -> bool:
+        if self.fail_connect_count > 0:
+            self.fail_connect_count -= 1
+            return False
+        self._connected = True
+        self.session_count += 1
+        return True
+
+    def _session_alive(self) -> bool:
+        return self._connected
+
+    def _close_session(self) -> None:
+        self._connected = False
+
+    def drop_session(self) -> None:
+        """接続断を再現する"""
+        self._connected = False
+
+    def _local_path(self, remote_path: str) -> str:
+        return os.path.join(self.root_dir, remote_path.lstrip('/'))
+
+    def _run_batch(self, batch_commands: str) -> tuple:
+        if not self._connected:
+            return False, "Connection closed"
+        for command in batch_commands.splitlines():
+            verb, *operands = shlex.split(command)
+            try:
+                if verb == '-mkdir':
+                    self.mkdir_count += 1
+                    os.makedirs(self._local_path(operands[0]), exist_ok=True)
+                elif verb == 'put':
+                    shutil.copy2(operands[0], self._local_path(operands[1]))
+                else:
+                    return False, f"未対応のコマンドです: {command}"
+            except Exception as e:
+                return False, str(e)
+        return True, ''
+
+
+@pytest.fixture
+def transport(tmp_path):
+    return LoopbackSftpTransport('sensor-uploader@nas:/sensor_data/incoming', str(tmp_path / 'nas'))
+
+
+@pytest.fixture
+def chunk_file(tmp_path):
+    path = tmp_path / 'outbox_chunk.csv'
+    path.write_text('timestamp,temperature,humidity\n2026-10-18 09:00:00,22.0,50.0\n')
+    return str(path)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """_ensure_session のバックオフが見る time.monotonic を、手で進められる時計にする"""
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(temp_humid_notifier, 'time',
+                        types.SimpleNamespace(monotonic=lambda: now.value))
+    return now
+
+
+def delivered(transport: LoopbackSftpTransport, device_name: str) -> list:
+    return sorted(os.listdir(transport._local_path(f'/sensor_data/incoming/{device_name}')))
+
+
+def test_one_session_and_one_mkdir_per_device(transport, chunk_file):
+    for i in range(3):
+        assert transport.put(chunk_file, 'room01', f'chunk_{i}.csv')
+    assert transport.put(chunk_file, 'room02', 'chunk_0.csv')
+
+    assert transport.session_count == 1
+    assert transport.mkdir_count == 2
+    assert delivered(transport, 'room01') == ['chunk_0.csv', 'chunk_1.csv', 'chunk_2.csv']
+    assert delivered(transport, 'room02') == ['chunk_0.csv']
+
+
+def test_reconnects_after_dropped_session(transport, chunk_file):
+    assert transport.put(chunk_file, 'room01', 'chunk_0.csv')
+    transport.drop_session()
+
+    # 切れたことは次の送信で気づき、張り直して送る（新しいセッションでは -mkdir をもう1回だけ行う）
+    assert transport.put(chunk_file, 'room01', 'chunk_1.csv')
+    assert transport.put(chunk_file, 'room01', 'chunk_2.csv')
+
+    assert transport.session_count == 2
+    assert transport.mkdir_count == 2
+    assert delivered(transport, 'room01') == ['chunk_0.csv', 'chunk_1.csv', 'chunk_2.csv']
+
+
+def test_reconnect_backs_off_after_failures(transport, chunk_file, clock):
+    transport.fail_connect_count = 2
+    base = temp_humid_notifier.SFTP_RECONNECT_BACKOFF_BASE_SEC
+
+    assert not transport.put(chunk_file, 'room01', 'chunk_0.csv')  # 1回目の失敗
+    clock.value += base - 1
+    assert not transport.put(chunk_file, 'room01', 'chunk_0.csv')  # 待ちの間は接続を試さない
+    assert transport.fail_connect_count == 1
+
+    clock.value += 1
+    assert not transport.put(chunk_file, 'room01', 'chunk_0.csv')  # 2回目の失敗。待ちは倍になる
+    assert transport.fail_connect_count == 0
+    clock.value += 2 * base - 1
+    assert not transport.put(chunk_file, 'room01', 'chunk_0.csv')
+
+    clock.value += 1
+    assert transport.put(chunk_file, 'room01', 'chunk_0.csv')
+    assert transport.session_count == 1
+    assert transport.mkdir_count == 1
+
+
+def test_paths_with_spaces_and_hash_are_sent_as_one_argument(tmp_path):
+    transport = LoopbackSftpTransport('sensor-uploader@nas:/sensor data/incoming #2', str(tmp_path / 'nas'))
+    save_dir = tmp_path / 'save dir "pi"'
+    save_dir.mkdir()
+    chunk_path = save_dir / 'outbox_chunk.csv'
+    chunk_path.write_text('timestamp,temperature,humidity\n')
+
+    assert transport.put(str(chunk_path), 'room 01', 'chunk_0.csv')
+    assert os.listdir(transport._local_path('/sensor data/incoming #2/room 01')) == ['chunk_0.csv']
+
+
+def test_sftp_quote_escapes_quotes_and_refuses_unrepresentable_paths():
+    assert temp_humid_notifier._sftp_quote('/a b/#1/"x"') == '"/a b/#1/\\"x\\""'
+    assert temp_humid_notifier._sftp_quote('/a\\b') == '"/a\\b"'
+    for path in ('/a\nb', '/a\\"b', '/a\\'):
+        with pytest.raises(ValueError):
+            temp_humid_notifier._sftp_quote(path)
@@ -0,0 +1,84 @@
+"""simulate の再現（simulate_alerts）が、実際の取り込み・判定（ingest のタイマー）と同じアラートを出すかのテスト"""
+
+import datetime
+import re
+
+import pytest
+
+import collector
+from conftest import write_chunk
+
+pytest.importorskip('numpy')
+
+START = datetime.datetime(2026, 10, 17, 0, 0)
+END = datetime.datetime(2026, 10, 18, 12, 0)
+STEP = datetime.timedelta(minutes=collector.READING_INTERVAL_MINUTES)
+
+
+def scenario(device_id: str, at: datetime.datetime):
+    """その時刻に記録された (温度, 湿度)。行が届かない時刻は None"""
+    minutes = (at - START).total_seconds() / 60
+    hour = minutes / 60
+    if device_id == 'room01':
+        if 3 <= hour < 5 or 12 <= hour < 12.5:
+            return 30.0, 50.0   # 高温が続く（2回目はクールダウン明け）
+        if minutes == 8 * 60:
+            return 30.0, 50.0   # 単発のノイズ
+        if 20 <= hour < 21.5 and minutes % 40:
+            return None         # 欠けながらの逸脱（40分空いた2点は2連続とみなさない）
+        if 20 <= hour < 21.5:
+            return 10.0, 50.0
+        return 22.0, 50.0
+    if device_id == 'room02':
+        if 6 <= hour < 10 or 30 <= hour < 33:
+            return None         # 欠測（2回目は1回目のちょうど24時間後に2時間を超え、クールダウンの境目に当たる）
+        if 2 <= hour < 2.5 or 29 <= hour < 30:
+            return 22.0, 20.0   # 低湿度
+        return 22.0, 50.0
+    raise ValueError(device_id)
+
+
+def live_alerts(conn, base_dir: str, config: dict) -> set:
+    """ingest のタイマーと同じく、測定間隔ごとに届いた行を取り込んで判定し、出たアラートを集める"""
+    kinds = {'温度': 'temp_range', '湿度': 'humid_range', 'データ': 'missing'}
+    alerts = set()
+    last_id = 0
+    at = START
+    while at <= END:
+        label = f"{at:%Y%m%d_%H%M%S}"
+        for device_id in ('room01', 'room02'):
+            values = scenario(device_id, at)
+            if values is not None:
+                write_chunk(base_dir, device_id, f'{device_id}_{label}.csv',
+                            [(f"{at:%Y-%m-%d %H:%M:%S}", *values)])
+        collector.ingest_incoming_files(conn, base_dir, workers=1)
+        collector.check_range_alerts(conn, config, at)
+        collector.check_missing_data_alerts(conn, config, at)
+        for alert_id, text in conn.execute(
+                "SELECT id, text FROM outbox WHERE id > ? ORDER BY id", (last_id,)).fetchall():
+            device_id, subject = re.match(r'\S+ \[(\S+)\] (温度|湿度|データ)', text).groups()
+            alerts.add((collector.to_epoch(f"{at:%Y-%m-%d %H:%M:%S}"), device_id, kinds[subject]))
+            last_id = alert_id
+        at += STEP
+    return alerts
+
+
+def test_simulate_matches_live_alerts(conn, base_dir):
+    config = collector.load_config(base_dir)
+    live = live_alerts(conn, base_dir, config)
+
+    series_by_device = collector.fetch_all_series(conn, ['room01', 'room02'], START, END,
+                                                  rollup_after_days=float('inf'))
+    start_ts = collector.to_epoch(f"{START:%Y-%m-%d %H:%M:%S}")
+    end_ts = collector.to_epoch(f"{END:%Y-%m-%d %H:%M:%S}")
+    simulated = {(alert_ts, device_id, kind)
+                 for device_id, alerts in collector.simulate_alerts(
+                     series_by_device, config, start_ts, end_ts).items()
+                 for alert_ts, kind, _ in alerts}
+
+    # 場面ごとに期待どおり出ていること（両方が何も出さずに一致、を防ぐ）
+    kinds = sorted((device_id, kind) for _, device_id, kind in live)
+    assert kinds == [('room01', 'temp_range'), ('room01', 'temp_range'),
+                     ('room02', 'humid_range'), ('room02', 'humid_range'),
+                     ('room02', 'missing'), ('room02', 'missing')]
+    assert simulated == live
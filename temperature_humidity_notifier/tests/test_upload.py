@@ -0,0 +1,234 @@
+"""センサーPiのローカル記録（SegmentStore）とNASへの送信（upload_unsent_data）のテスト"""
+
+import csv
+import datetime
+import os
+import threading
+import time
+
+import pytest
+
+import temp_humid_notifier
+from temp_humid_notifier import LocalCopyTransport, SegmentStore, save_to_csv, upload_unsent_data
+
+
+@pytest.fixture
+def save_dir(tmp_path):
+    return str(tmp_path / 'client')
+
+
+@pytest.fixture
+def nas_dir(tmp_path):
+    path = tmp_path / 'nas' / 'incoming'
+    path.mkdir(parents=True)
+    return str(path)
+
+
+def record(store: SegmentStore, start: str, count: int) -> list:
+    """start から10分ごとに count 行を記録し、記録した時刻の文字列を返す"""
+    start_time = datetime.datetime.fromisoformat(start)
+    timestamps = []
+    for i in range(count):
+        measured_at = start_time + datetime.timedelta(minutes=10 * i)
+        save_to_csv(store, 50.0, 22.0, measured_at=measured_at)
+        timestamps.append(measured_at.strftime('%Y-%m-%d %H:%M:%S'))
+    return timestamps
+
+
+def delivered_rows(nas_dir: str, device_name: str) -> list:
+    """NASに届いたチャンクの行の時刻（届いた全チャンクぶん、ファイル名順）"""
+    device_dir = os.path.join(nas_dir, device_name)
+    timestamps = []
+    for name in sorted(os.listdir(device_dir)):
+        with open(os.path.join(device_dir, name), newline='') as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == temp_humid_notifier.CSV_HEADER
+        timestamps.extend(row[0] for row in rows[1:])
+    return timestamps
+
+
+def leftover_chunks(save_dir: str) -> list:
+    return [name for name in os.listdir(save_dir) if name.startswith('outbox_chunk')]
+
+
+def test_stalled_copy_is_not_overwritten_by_next_chunk(save_dir, nas_dir, monkeypatch):
+    store = SegmentStore(save_dir, retention_days=365)
+    first = record(store, '2026-10-18 09:00:00', 3)
+    transport = LocalCopyTransport(nas_dir)
+
+    # NASのマウントが固まり、コピーがチャンクを途中まで読んだところで止まる
+    release = threading.Event()
+
+    def stalled_copy(source_path, destination_path):
+        with open(source_path, 'rb') as f:
+            data = f.read(40)
+            release.wait(10)
+            data += f.read()
+        with open(destination_path, 'wb') as f:
+            f.write(data)
+
+    monkeypatch.setattr(temp_humid_notifier.shutil, 'copy2', stalled_copy)
+    monkeypatch.setattr(temp_humid_notifier, 'TRANSFER_TIMEOUT_SEC', 0.2)
+    assert not upload_unsent_data(store, save_dir, 'room01', transport)
+    assert transport.is_stalled()
+
+    # コピーが戻らない間は、新しいチャンクを作らずに見送る
+    second = record(store, '2026-10-18 09:30:00', 2)
+    assert not upload_unsent_data(store, save_dir, 'room01', transport)
+    assert leftover_chunks(save_dir) == []
+
+    release.set()
+    transport._stuck_thread.join(5)
+    assert upload_unsent_data(store, save_dir, 'room01', transport)
+
+    # 固まっていたコピーは最初のチャンクをそのまま届け、送信済み位置を進めていないので全行を送り直す
+    rows = delivered_rows(nas_dir, 'room01')
+    assert sorted(rows) == sorted(first + first + second)
+    assert leftover_chunks(save_dir) == []
+
+
+def segment_names(save_dir: str, dirname: str = temp_humid_notifier.SEGMENT_DIRNAME) -> list:
+    return sorted(os.listdir(os.path.join(save_dir, dirname)))
+
+
+def today_label(days_ago: int = 0) -> str:
+    return (datetime.date.today() - datetime.timedelta(days=days_ago)).strftime('%Y%m%d')
+
+
+class FlakyTransport(LocalCopyTransport):
+    """fail_after 回目の put から失敗する（NAS停止の再現）"""
+
+    def __init__(self, nas_target: str, fail_after: int = None):
+        super().__init__(nas_target)
+        self.fail_after = fail_after
+        self.put_count = 0
+
+    def put(self, local_path: str, device_name: str, remote_filename: str) -> bool:
+        self.put_count += 1
+        if self.fail_after is not None and self.put_count >= self.fail_after:
+            return False
+        return super().put(local_path, device_name, remote_filename)
+
+
+def test_new_segment_when_date_changes(save_dir):
+    # 前日のセグメントに追記していたところで日付が変わった
+    yesterday_name = f'temperature_log_{today_label(1)}_004.csv'
+    SegmentStore(save_dir, retention_days=365)
+    with open(os.path.join(save_dir, 'segments', yesterday_name), 'w', newline='') as f:
+        csv.writer(f).writerow(temp_humid_notifier.CSV_HEADER)
+
+    record(SegmentStore(save_dir, retention_days=365), '2026-10-18 00:00:00', 2)
+
+    # 日付が変わったら連番は0から
+    assert segment_names(save_dir) == [yesterday_name, f'temperature_log_{today_label()}_000.csv']
+
+
+def test_new_segment_when_size_limit_is_exceeded(save_dir, monkeypatch):
+    monkeypatch.setattr(temp_humid_notifier, 'SEGMENT_MAX_BYTES', 100)
+    store = SegmentStore(save_dir, retention_days=365)
+    timestamps = record(store, '2026-10-18 09:00:00', 6)
+
+    names = segment_names(save_dir)
+    assert names == [f'temperature_log_{today_label()}_{i:03d}.csv' for i in range(len(names))]
+    assert len(names) > 1
+    for name in names:
+        # 上限を超えた時点で次へ移るので、1セグメントは上限＋1行まで
+        assert os.path.getsize(os.path.join(save_dir, 'segments', name)) < 100 + 40
+
+    # 再起動後の新しい SegmentStore も、上限に達していなければ最新のセグメントの続きに追記する
+    last_size = os.path.getsize(os.path.join(save_dir, 'segments', names[-1]))
+    record(SegmentStore(save_dir, retention_days=365), '2026-10-18 10:00:00', 1)
+    assert len(segment_names(save_dir)) == len(names) + (last_size >= 100)
+    rows = []
+    for name in segment_names(save_dir):
+        with open(os.path.join(save_dir, 'segments', name), newline='') as f:
+            rows.extend(row[0] for row in list(csv.reader(f))[1:])
+    assert rows == timestamps + ['2026-10-18 10:00:00']
+
+
+def test_new_segment_when_header_changes(save_dir):
+    record(SegmentStore(save_dir, retention_days=365), '2026-10-18 09:00:00', 1)
+    # --sample-interval を付けて再起動すると集計行の列が増える
+    aggregate_store = SegmentStore(save_dir, retention_days=365, header=temp_humid_notifier.AGGREGATE_CSV_HEADER)
+    save_to_csv(aggregate_store, 50.0, 22.0, [21.5, 22.5, 49.0, 51.0, 6],
+                measured_at=datetime.datetime(2026, 10, 18, 9, 10))
+
+    names = segment_names(save_dir)
+    assert names == [f'temperature_log_{today_label()}_000.csv', f'temperature_log_{today_label()}_001.csv']
+    with open(os.path.join(save_dir, 'segments', names[1]), newline='') as f:
+        assert next(csv.reader(f)) == temp_humid_notifier.AGGREGATE_CSV_HEADER
+
+
+def test_sent_segments_are_archived_and_pruned_after_retention(save_dir, nas_dir, monkeypatch):
+    monkeypatch.setattr(temp_humid_notifier, 'SEGMENT_MAX_BYTES', 100)
+    store = SegmentStore(save_dir, retention_days=30)
+    timestamps = record(store, '2026-10-18 09:00:00', 6)
+    segments = segment_names(save_dir)
+
+    assert upload_unsent_data(store, save_dir, 'room01', LocalCopyTransport(nas_dir))
+    assert sorted(delivered_rows(nas_dir, 'room01')) == timestamps
+
+    # 追記中の最新セグメントだけが残り、送り終えたものは archive/ に圧縮される
+    assert segment_names(save_dir) == segments[-1:]
+    archived = segment_names(save_dir, temp_humid_notifier.ARCHIVE_DIRNAME)
+    assert archived == [name + '.gz' for name in segments[:-1]]
+
+    # 保持日数を過ぎた archive だけを消す
+    expired_path = os.path.join(save_dir, 'archive', archived[0])
+    expired_at = time.time() - 31 * 86400
+    os.utime(expired_path, (expired_at, expired_at))
+    store.prune_archives()
+    assert segment_names(save_dir, temp_humid_notifier.ARCHIVE_DIRNAME) == archived[1:]
+
+
+def test_unsent_segments_are_kept_regardless_of_retention(save_dir, nas_dir, monkeypatch):
+    monkeypatch.setattr(temp_humid_notifier, 'SEGMENT_MAX_BYTES', 100)
+    store = SegmentStore(save_dir, retention_days=0)
+    timestamps = record(store, '2026-10-18 09:00:00', 6)
+    segments = segment_names(save_dir)
+
+    # NAS停止中は何も圧縮・削除しない
+    assert not upload_unsent_data(store, save_dir, 'room01', FlakyTransport(nas_dir, fail_after=1))
+    store.prune_archives()
+    assert segment_names(save_dir) == segments
+
+    assert upload_unsent_data(store, save_dir, 'room01', LocalCopyTransport(nas_dir))
+    assert sorted(delivered_rows(nas_dir, 'room01')) == timestamps
+
+
+def test_resume_from_byte_offset_after_failed_chunk(save_dir, nas_dir, monkeypatch):
+    # 1チャンク約2行に分けて送り、3チャンク目で失敗する
+    monkeypatch.setattr(temp_humid_notifier, 'UPLOAD_CHUNK_MAX_BYTES', 60)
+    store = SegmentStore(save_dir, retention_days=365)
+    timestamps = record(store, '2026-10-18 09:00:00', 7)
+
+    assert not upload_unsent_data(store, save_dir, 'room01', FlakyTransport(nas_dir, fail_after=3))
+    sent = delivered_rows(nas_dir, 'room01')
+    assert sent == timestamps[:len(sent)] and 0 < len(sent) < len(timestamps)
+
+    # 送れたチャンクの分は送り直さず、続きの行と新しく記録した行だけを送る
+    more = record(store, '2026-10-18 10:30:00', 2)
+    assert upload_unsent_data(store, save_dir, 'room01', LocalCopyTransport(nas_dir))
+    assert sorted(delivered_rows(nas_dir, 'room01')) == timestamps + more
+
+    with open(os.path.join(save_dir, temp_humid_notifier.UPLOAD_STATE_FILENAME)) as f:
+        state = f.read()
+    assert f'segment={segment_names(save_dir)[-1]}\n' in state
+
+
+def test_segment_is_resent_when_last_sent_line_does_not_match(save_dir, nas_dir):
+    store = SegmentStore(save_dir, retention_days=365)
+    first = record(store, '2026-10-18 09:00:00', 3)
+    assert upload_unsent_data(store, save_dir, 'room01', LocalCopyTransport(nas_dir))
+
+    # SDカードの復元などで、同じ長さの別の内容に書き換わった
+    segment_path = os.path.join(save_dir, 'segments', segment_names(save_dir)[-1])
+    with open(segment_path, newline='') as f:
+        text = f.read()
+    with open(segment_path, 'w', newline='') as f:
+        f.write(text.replace('09:20:00', '09:25:00'))
+
+    assert upload_unsent_data(store, save_dir, 'room01', LocalCopyTransport(nas_dir))
+    # 送信済み最終行のCRC32が合わないので、セグメントを最初から送り直す（コレクター側で重複は捨てる）
+    assert sorted(delivered_rows(nas_dir, 'room01')) == sorted(
+        first + first[:2] + ['2026-10-18 09:25:00'])